@@ -0,0 +1,123 @@
+"""
+Benchmark of the ERG particle part_products routines on synthetic data
+
+Generates synthetic tplot variables shaped like the Level-2 data of
+MEP-e ([time, 32, 16, 16]), LEP-i ([time, 30, 8, 16]), HEP-L (sctno and
+FEDU_L_Angle_sga variables, one sample per spin sector) and XEP-SSD, plus
+MGF magnetic field and orbit position support data, then runs
+erg_mep_part_products (per sample and with batch=True),
+erg_lep_part_products, erg_hep_part_products and erg_xep_part_products for
+every output type at several sizes, and reports the wall time and the peak
+memory allocated (tracemalloc) of each run. The generators are those of
+tests/synthetic.py.
+
+The CDF files get_dist reads the HEP energy table from are written to a
+temporary directory with cdflib.
+
+Usage:
+    python benchmarks/bench_part_products.py [n_times ...]
+
+n_times are the numbers of time samples (spins for HEP) of the synthetic
+data, at least 5 (get_dist needs 5 HEP spins); the default is 10 40 160.
+No data files or network access are needed.
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+from pyspedas import del_data
+
+#  ;; run from the source tree; the synthetic data are shared with the tests
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _root)
+sys.path.insert(0, os.path.join(_root, 'tests'))
+
+from ergpyspedas.erg import erg_mep_part_products, erg_lep_part_products, \
+    erg_hep_part_products, erg_xep_part_products
+
+import synthetic
+from synthetic import MAG_NAME, POS_NAME
+
+ALL_OUTPUTS = ['energy', 'theta', 'phi', 'pa', 'gyro', 'moments', 'fac_energy', 'fac_moments']
+
+
+def instruments(cdf_dir):
+    """
+    Returns (label, data generator, routine, supported outputs) of the
+    benchmarked runs; the HEP CDF file is written to cdf_dir
+    """
+
+    return [
+        ('MEP-e', synthetic.make_mepe, erg_mep_part_products, ALL_OUTPUTS),
+        ('MEP-e batch', synthetic.make_mepe, partial(erg_mep_part_products, batch=True), ALL_OUTPUTS),
+        ('LEP-i', synthetic.make_lepi, erg_lep_part_products, ALL_OUTPUTS),
+        ('HEP-L', partial(synthetic.make_hep, cdf_dir=cdf_dir), erg_hep_part_products, ALL_OUTPUTS),
+        ('XEP', synthetic.make_xep, erg_xep_part_products, ['energy', 'phi', 'pa', 'fac_energy']),
+    ]
+
+
+def run(routine, name, output):
+    #  ;; 'mphism' (the default) needs the spacecraft attitude data, which is
+    #  ;; downloaded; 'xdsi' needs only the field and position
+    out_vars = routine(name, outputs=[output], mag_name=MAG_NAME, pos_name=POS_NAME,
+                       fac_type='xdsi')
+    for out_var in out_vars:
+        del_data(out_var)
+
+
+def measure(routine, name, output):
+    """
+    Returns the wall time (s) and the peak memory allocated (bytes) of a run;
+    the run is timed without tracemalloc, which slows it down
+    """
+
+    start = time.perf_counter()
+    run(routine, name, output)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    run(routine, name, output)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main(sizes=(10, 40, 160)):
+    if min(sizes) < 5:
+        print('n_times must be at least 5')
+        return
+
+    #  ;; silence the per-call messages of the tplot tools
+    logging.disable(logging.WARNING)
+
+    synthetic.make_support(max(sizes))
+
+    results = []
+    with tempfile.TemporaryDirectory() as cdf_dir:
+        for label, make_data, routine, outputs in instruments(cdf_dir):
+            for n_times in sizes:
+                name = make_data(np.random.default_rng(0), n_times)
+
+                #  ;; warm up the operator and regrouping caches
+                run(routine, name, outputs[0])
+
+                for output in outputs:
+                    elapsed, peak = measure(routine, name, output)
+                    results.append((label, n_times, output, elapsed, peak))
+
+    print('%-11s %7s %-12s %10s %10s %12s' % ('data', 'n_times', 'output', 'time (s)',
+                                             'ms/sample', 'peak MiB'))
+    for label, n_times, output, elapsed, peak in results:
+        print('%-11s %7d %-12s %10.3f %10.2f %12.1f' % (label, n_times, output, elapsed,
+                                                      elapsed * 1e3 / n_times, peak / 2.**20))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or (10, 40, 160))
@@ -0,0 +1,159 @@
+"""
+Memory allocation benchmark of the per-sample pgs pipeline
+
+Runs the sample extraction -> erg_pgs_clean_data -> erg_pgs_limit_range ->
+the energy/theta/phi spectrograms -> erg_pgs_do_fac -> the FAC energy
+spectrogram on synthetic MEP-e sized data, in two ways:
+
+    previous deepcopies: the sample is rebuilt with a deepcopy of every
+        member, as the part_products loops did, and each stage deep-copies
+        its input as erg_convert_flux_units, erg_pgs_make_e_spec,
+        erg_pgs_make_theta_spec, erg_pgs_make_phi_spec and erg_pgs_do_fac
+        did (they also copied data, theta and phi once more)
+    ParticleDist: the sample members are views into the all-time arrays
+        and the stages share the members they don't replace
+
+Both run the current stage kernels, so the difference is the copies only.
+The stage inputs and outputs of a sample are kept alive until the sample
+is done, and the memory blocks (numpy arrays and other Python objects)
+allocated and bytes held are counted from the difference of two tracemalloc
+snapshots; temporaries freed inside the kernels are the same for both and
+are not counted. The time per sample is measured without tracemalloc.
+
+Usage:
+    python benchmarks/bench_particle_alloc.py [n_samples]
+
+No data files or network access are needed.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from copy import deepcopy
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ergpyspedas.erg.satellite.erg.particle.erg_pgs_clean_data import erg_pgs_clean_data
+from ergpyspedas.erg.satellite.erg.particle.erg_pgs_limit_range import erg_pgs_limit_range
+from ergpyspedas.erg.satellite.erg.particle.erg_pgs_do_fac import erg_pgs_do_fac
+from ergpyspedas.erg.satellite.erg.particle.erg_pgs_make_e_spec import erg_pgs_make_e_spec
+from ergpyspedas.erg.satellite.erg.particle.erg_pgs_make_theta_spec import erg_pgs_make_theta_spec
+from ergpyspedas.erg.satellite.erg.particle.erg_pgs_make_phi_spec import erg_pgs_make_phi_spec
+from ergpyspedas.erg.satellite.erg.particle.erg_pgs_time_broadcast import erg_pgs_time_broadcast
+
+
+def make_dist(n_times, n_energy=16, n_phi=32, n_theta=16, seed=0):
+    """
+    Returns an all-time particle data dict shaped like the output of
+    erg_mepe_get_dist() ([energy, phi, theta, time]), with the
+    time-invariant geometry as broadcast views
+    """
+
+    rng = np.random.default_rng(seed)
+    shape = (n_energy, n_phi, n_theta, 1)
+
+    energy = np.geomspace(90., 6., n_energy)
+    phi = (np.arange(n_phi) + 0.5) * 360. / n_phi
+    theta = (np.arange(n_theta) + 0.5) * 180. / n_theta - 90.
+
+    data = rng.lognormal(3., 1.5, size=shape[:3] + (n_times,))
+    data[rng.random(data.shape) < 0.02] = np.nan
+
+    def geometry(values):
+        return erg_pgs_time_broadcast(np.broadcast_to(values, shape), n_times)
+
+    return {'time': 8. * np.arange(n_times), 'end_time': 8. * np.arange(1, n_times + 1),
+            'charge': -1., 'mass': 5.68566e-06, 'species': 'e', 'units_name': 'flux',
+            'data': data,
+            'bins': np.ones(data.shape, dtype=np.int8),
+            'energy': geometry(energy[:, None, None, None]),
+            'denergy': geometry(energy[:, None, None, None] * 0.2),
+            'phi': geometry(phi[None, :, None, None]),
+            'dphi': geometry(np.full(shape, 360. / n_phi)),
+            'theta': geometry(theta[None, None, :, None]),
+            'dtheta': geometry(np.full(shape, 180. / n_theta))}
+
+
+def get_sample(dist, index, copy_stages):
+    # ;; the previous loops deep-copied every member of the sample
+    stage = deepcopy if copy_stages else (lambda value: value)
+    return {key: stage(value[..., index] if key in ['time', 'end_time'] or np.ndim(value) == 4 else value)
+            for key, value in dist.items()}
+
+
+def run_pipeline(dist, index, mat, copy_stages=False):
+    """
+    Processes one sample and returns every stage input and output, so that
+    they are all alive when the allocations are counted
+    """
+
+    stage = deepcopy if copy_stages else (lambda value: value)
+    kept = []
+
+    def keep(*values):
+        kept.extend(values)
+        return values[0]
+
+    sample = keep(get_sample(dist, index, copy_stages))
+    clean_data = keep(erg_pgs_clean_data(keep(stage(sample)), units='flux'))
+    clean_data = keep(erg_pgs_limit_range(clean_data, energy=[0., 1e6]))
+
+    for spec, array_name, kwargs in [(erg_pgs_make_e_spec, 'data', {}),
+                                     (erg_pgs_make_theta_spec, 'theta', {'resolution': 16}),
+                                     (erg_pgs_make_phi_spec, 'phi', {'resolution': 32})]:
+        spec_input = keep(stage(clean_data))
+        keep(stage(spec_input[array_name]))
+        keep(spec(spec_input, **kwargs))
+
+    fac_data = keep(erg_pgs_do_fac(keep(stage(clean_data)), mat))
+    fac_data['theta'] = 90. - fac_data['theta']
+    fac_data = keep(erg_pgs_limit_range(fac_data, theta=[0., 180.], phi=[0., 360.]))
+    spec_input = keep(stage(fac_data))
+    keep(stage(spec_input['data']))
+    keep(erg_pgs_make_e_spec(spec_input))
+
+    return kept
+
+
+def measure(dist, mat, n_samples, copy_stages):
+    # warm up the operator caches so that only per-sample work is measured
+    run_pipeline(dist, 0, mat, copy_stages=copy_stages)
+
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    tracemalloc.start()
+    counts = []
+    sizes = []
+    for index in range(n_samples):
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        kept = run_pipeline(dist, index, mat, copy_stages=copy_stages)
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+        stats = after.compare_to(before, 'filename')
+        counts.append(sum(stat.count_diff for stat in stats))
+        sizes.append(sum(stat.size_diff for stat in stats))
+        del kept
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for index in range(n_samples):
+        run_pipeline(dist, index, mat, copy_stages=copy_stages)
+    elapsed = time.perf_counter() - start
+
+    return int(np.median(counts)), int(np.median(sizes)), elapsed / n_samples
+
+
+def main(n_samples=20):
+    dist = make_dist(n_samples)
+    mat = np.array([[0., 0., 1.], [0., 1., 0.], [-1., 0., 0.]])
+
+    print('%-22s %16s %16s %12s' % ('pipeline', 'blocks/sample', 'bytes/sample', 'ms/sample'))
+    for label, copy_stages in [('previous deepcopies', True),
+                               ('ParticleDist', False)]:
+        count, size, elapsed = measure(dist, mat, n_samples, copy_stages)
+        print('%-22s %16d %16d %12.2f' % (label, count, size, elapsed * 1e3))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -9,7 +9,7 @@ from scipy import interpolate
 from ...att.att import att
 
 
-def erg_interpolate_att(erg_xxx_in=None, noload=False):
+def erg_interpolate_att(erg_xxx_in=None, noload=False, time_array=None):
     """
     This function interpolates erg att data to match erg_xxx_in.
 
@@ -17,6 +17,9 @@ def erg_interpolate_att(erg_xxx_in=None, noload=False):
         erg_xxx_in : str
             input tplot variable relating to ERG to be transformed
 
+        time_array : numpy.ndarray
+            times (s) to interpolate to, instead of those of erg_xxx_in
+
     Returns:
         output_dictionary : dict
             Dictionary which has below keys.
@@ -26,14 +29,18 @@ def erg_interpolate_att(erg_xxx_in=None, noload=False):
                 sgax_j2000, sgay_j2000, or sgaz_j2000: output interporated SGA axis vector for each component
 
     """
-    if (erg_xxx_in is None) or (erg_xxx_in not in tnames()):
-        print('inputted Tplot variable name is None, or not defined')
-        return
+    if time_array is None:
+        if (erg_xxx_in is None) or (erg_xxx_in not in tnames()):
+            print('inputted Tplot variable name is None, or not defined')
+            return
+        time_array = get_data(erg_xxx_in)[0]
+        tr = get_timespan(erg_xxx_in)
+    else:
+        time_array = np.asarray(time_array, dtype=np.float64)
+        tr = [time_array.min(), time_array.max()]
 
     reload = not noload
 
-    time_array = get_data(erg_xxx_in)[0]
-
     # Prepare some constants
     dtor = np.pi / 180.
 
@@ -45,11 +52,9 @@ def erg_interpolate_att(erg_xxx_in=None, noload=False):
             degap('erg_att_sprate', dt=8., margin=.5)
         sprate = get_data('erg_att_sprate')
         if sprate[0].min() > time_array.min() + 8. or sprate[0].max() < time_array.max() - 8.:
-            tr = get_timespan(erg_xxx_in)
             if reload:
                 att(trange=time_string([tr[0] - 60., tr[1] + 60.]))
     else:
-        tr = get_timespan(erg_xxx_in)
         if reload:
             att(trange=time_string([tr[0] - 60., tr[1] + 60.]))
 
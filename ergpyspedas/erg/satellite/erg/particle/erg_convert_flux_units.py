@@ -2,60 +2,42 @@ import logging
 
 import numpy as np
 
-from copy import deepcopy
-
 logging.captureWarnings(True)
 logging.basicConfig(format='%(asctime)s: %(message)s',
                     datefmt='%d-%b-%y %H:%M:%S', level=logging.INFO)
 
 
-def erg_convert_flux_units(input_dist, units='flux', relativistic=False):
-    """
-    ; The following unit names are acceptable for units:
-    ;   'flux' 'eflux' 'df' 'df_cm'
-    ;
-    ;   'df_km' and 'psd' are referred to as 'df'.
-    ;
-    ; CAUTION!!!
-    ; "relativistic" keyword is valid only for electron currently.
-    ; Using it for ions just messes up the conversion.
-    """
+# mass of each species (unit: proton mass)
+_species_mass = {
+    'e': 1.0/1836.0,  # e-
+    'hplus': 1.0,  # H+
+    'proton': 1.0,  # H+
+    'he2plus': 4.0,  # He2+
+    'alpha': 4.0,  # He2+
+    'heplus': 4.0,  # He+
+    'oplusplus': 16.0,  # O++
+    'oplus': 16.0,  # O+
+    'o2plus': 32.0,  # (O2)+
+}
 
-    output_dist = deepcopy(input_dist)
+# conversion factors keyed on (species, units_in, units_out, relativistic)
+_factor_cache = {}
 
-    units_out = units.lower()
-    species_lc = input_dist['species'].lower()
-    units_in = input_dist['units_name'].lower()
 
-    if units_in == units_out:
-        return input_dist
+def _conversion_factors(species_lc, units_in, units_out, relativistic):
+    """
+    Returns (exp, scale) for a conversion, where exp holds the final
+    exponents of [energy, flux_to_df, cm_to_km] and scale is the constant
+    part of the scaling factor. For relativistic conversions flux_to_df
+    depends on energy, so scale only holds the cm_to_km part.
+    """
 
-    # Unify some unit notations
-
-    if (units_in == 'df_km') or (units_in == 'psd'):
-        units_in = 'df'
-    if (units_out == 'df_km') or (units_out == 'psd'):
-        units_out = 'df'
+    key = (species_lc, units_in, units_out, relativistic)
+    if key in _factor_cache:
+        return _factor_cache[key]
 
     # Get the mass of species (unit: proton mass)
-    if species_lc == 'e':
-        A = 1.0/1836.0  # e-
-    elif species_lc == 'hplus':
-        A = 1.0  # H+
-    elif species_lc == 'proton':
-        A = 1.0  # H+
-    elif species_lc == 'he2plus':
-        A = 4.0  # He2+
-    elif species_lc == 'alpha':
-        A = 4.0  # He2+
-    elif species_lc == 'heplus':
-        A = 4.0  # He+
-    elif species_lc == 'oplusplus':
-        A = 16.0  # O++
-    elif species_lc == 'oplus':
-        A = 16.0  # O+
-    elif species_lc == 'o2plus':
-        A = 32.0  # (O2)+
+    A = _species_mass[species_lc]
 
     """
     ;; Scaling factor between df (s^3/km^6) and flux (#/eV/s/str/cm2).
@@ -77,23 +59,6 @@ def erg_convert_flux_units(input_dist, units='flux', relativistic=False):
 
     flux_to_df = A**2.0 * 0.5447 * 1e6
 
-    if relativistic:
-        # Conversion here is based on those adopted by Hilmer+JGR,2000.
-
-        mc2 = 5.10999e-1  # Electron rest energy [MeV]
-        ene = deepcopy(input_dist['energy'])  # [eV]
-        MeV_ene = ene * 1e-6  # [MeV]
-        p2c2 = MeV_ene * (MeV_ene + 2.0 * mc2)  # [MeV^2]
-
-        """
-        ;; f [(c/MeV/cm)^3]
-        ;;     = j [#/eV/s/str/cm2] * 1d+3 / p2c2 * 1.66d-10 * 200.3 
-        ;; 1d+3 is to convert input flux values to [#/keV/s/sr/cm2]. 
-        ;; The multiplication of energy [eV] is to be consistent
-        ;; with the conversion below. 
-        """
-        flux_to_df = 1.0e+3 / p2c2 * 1.66e-10 * 200.3 * ene
-
     # factor between km^6 and cm^6 for df
     cm_to_km = 1e+30
 
@@ -128,13 +93,89 @@ def erg_convert_flux_units(input_dist, units='flux', relativistic=False):
 
     exp = np.array(exp_in) + np.array(exp_out)
 
+    if relativistic:
+        scale = cm_to_km ** exp[2]
+    else:
+        scale = flux_to_df ** exp[1] * cm_to_km ** exp[2]
+
+    _factor_cache[key] = (exp, scale)
+
+    return exp, scale
+
+
+def erg_convert_flux_units(input_dist, units='flux', relativistic=False, in_place=False):
+    """
+    ; The following unit names are acceptable for units:
+    ;   'flux' 'eflux' 'df' 'df_cm'
+    ;
+    ;   'df_km' and 'psd' are referred to as 'df'.
+    ;
+    ; CAUTION!!!
+    ; "relativistic" keyword is valid only for electron currently.
+    ; Using it for ions just messes up the conversion.
+    ;
+    ; Only 'data' is replaced in the output; all the other members are
+    ; shared with input_dist. With in_place=True, 'data' and 'units_name'
+    ; of input_dist itself are overwritten (when 'data' is a writable
+    ; floating-point array) and input_dist is returned.
+    ;
+    ; The output data have the floating-point type of the input data
+    ; (float64 for integer data).
+    """
+
+    units_out = units.lower()
+    species_lc = input_dist['species'].lower()
+    units_in = input_dist['units_name'].lower()
+
+    if units_in == units_out:
+        return input_dist
+
+    # Unify some unit notations
+
+    if (units_in == 'df_km') or (units_in == 'psd'):
+        units_in = 'df'
+    if (units_out == 'df_km') or (units_out == 'psd'):
+        units_out = 'df'
+
+    exp, scale = _conversion_factors(species_lc, units_in, units_out, relativistic)
+
+    if relativistic:
+        # Conversion here is based on those adopted by Hilmer+JGR,2000.
+
+        mc2 = 5.10999e-1  # Electron rest energy [MeV]
+        ene = input_dist['energy']  # [eV]
+        MeV_ene = ene * 1e-6  # [MeV]
+        p2c2 = MeV_ene * (MeV_ene + 2.0 * mc2)  # [MeV^2]
+
+        """
+        ;; f [(c/MeV/cm)^3]
+        ;;     = j [#/eV/s/str/cm2] * 1d+3 / p2c2 * 1.66d-10 * 200.3 
+        ;; 1d+3 is to convert input flux values to [#/keV/s/sr/cm2]. 
+        ;; The multiplication of energy [eV] is to be consistent
+        ;; with the conversion below. 
+        """
+        flux_to_df = 1.0e+3 / p2c2 * 1.66e-10 * 200.3 * ene
+        scale = flux_to_df ** exp[1] * scale
+
     """
     ;; Ensure everything is double prec first for numerical stability
     ;;  -target field won't be mutated since it's part of a structure
     """
 
-    output_dist['data'] = input_dist['data'] * input_dist['energy']**exp[0] * \
-        (flux_to_df ** exp[1] * cm_to_km ** exp[2])
+    data = input_dist['data']
+    if in_place and isinstance(data, np.ndarray) and data.flags.writeable \
+            and np.issubdtype(data.dtype, np.floating):
+        output_dist = input_dist
+        data *= input_dist['energy']**exp[0]
+    else:
+        output_dist = dict(input_dist)
+        #  ;; float32 data stay float32 (see the dtype keyword of *_get_dist)
+        dtype = np.result_type(data)
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+        data = np.multiply(data, input_dist['energy']**exp[0], dtype=dtype)
+    data *= scale
+    output_dist['data'] = data
 
     output_dist['units_name'] = units_out
 
@@ -4,7 +4,6 @@ import numpy as np
 
 
 from copy import deepcopy
-from scipy.spatial import KDTree
 from pyspedas import tnames
 from pyspedas import time_double
 from pyspedas import time_string
@@ -13,9 +12,83 @@ from scipy import interpolate
 
 from astropy.coordinates import spherical_to_cartesian, cartesian_to_spherical
 
+from .erg_pgs_time_broadcast import erg_pgs_time_broadcast
+
 logging.captureWarnings(True)
 logging.basicConfig(format='%(asctime)s: %(message)s',
                     datefmt='%d-%b-%y %H:%M:%S', level=logging.INFO)
+
+
+# spin-grouped arrays keyed on the input variables; the tplot variable
+# objects are kept to tell whether the variables have been replaced since
+_regroup_cache = {}
+_regroup_cache_size = 2
+
+
+def _spin_regroup(input_name, sctno_name, nsct, nene, nazm):
+    """
+    Groups the HEP samples (one per spin sector) by spin
+
+    The result is cached for the tplot variables, so that the calls with
+    time_only=True and the ones for the data share it.
+
+    Returns:
+        Tuple of (indices of the samples at the start of each spin, spin start
+        times, spin periods, [spin, sector, energy, azimuth] data array,
+        [spin, sector] integration times), read-only, or None if fewer than
+        5 spins are loaded
+    """
+
+    data_quant = get_data(input_name, xarray=True)
+    sctno_quant = get_data(sctno_name, xarray=True)
+
+    cached = _regroup_cache.get((input_name, sctno_name, nsct, nene, nazm))
+    if (cached is not None) and (cached[0] is data_quant) and (cached[1] is sctno_quant):
+        return cached[2]
+
+    t_fedu, fedu = get_data(input_name)[0:2]
+    time_scno, scno = get_data(sctno_name)
+
+    id_scno_0 = np.flatnonzero(scno == 0)
+    sc0num = id_scno_0.shape[0]
+    if sc0num < 5:
+        return None
+
+    # ;; integration time for each spin sector
+    sctdt = time_scno[1:] - time_scno[:-1]
+    sctintgt=np.insert(sctdt, sctdt.shape[0],sctdt[-1])
+
+    sc0_t = time_scno[id_scno_0]  # ;; times of spin sector #0, namely the start of each spin
+    dt_array = sc0_t[1:] - sc0_t[:-1]
+    sc0_dt = np.insert(dt_array, dt_array.shape[0], dt_array[-1])
+
+    #  ;; 'id_t_fedu = value_locate(sc0_t, t_fedu)' in IDL
+    id_t_fedu = np.searchsorted(sc0_t, t_fedu, side='right') - 1
+
+    #  ;; Scatter the samples of spins with at least 2 valid sectors into
+    #  ;; [spin, sector]
+    valid = (id_t_fedu >= 0) & (scno >= 0) & (scno <= 15)
+    n_per_spin = np.bincount(id_t_fedu[valid], minlength=sc0num)
+    valid &= n_per_spin[np.maximum(id_t_fedu, 0)] >= 2
+    spin = id_t_fedu[valid]
+    sct = scno[valid].astype(int)
+
+    fedu_arr = np.full(shape=(sc0num, nsct, nene, nazm ), fill_value=np.nan)  # ;; padded with NaN
+    intgt = np.full(shape=(sc0num, nsct), fill_value=np.nan)  # ;; padded with NaN
+    fedu_arr[spin, sct, :, :] = fedu[valid]
+    intgt[spin, sct] = sctintgt[valid]
+
+    spins = (id_scno_0.tolist(), sc0_t, sc0_dt, fedu_arr, intgt)
+    for value in spins[1:]:
+        value.flags.writeable = False
+
+    if len(_regroup_cache) >= _regroup_cache_size:
+        del _regroup_cache[next(iter(_regroup_cache))]
+    _regroup_cache[(input_name, sctno_name, nsct, nene, nazm)] = (data_quant, sctno_quant, spins)
+
+    return spins
+
+
 def erg_hep_get_dist(tname,
                       index=None,
                       units='flux',
@@ -26,7 +99,8 @@ def erg_hep_get_dist(tname,
                       trange=None,
                       new_effic=False,
                       w_sct015=False,
-                      exclude_azms=False):
+                      exclude_azms=False,
+                      dtype='float64'):
     if len(tnames(tname)) > 0:
         input_name = tnames(tname)[0]
     else:
@@ -54,7 +128,7 @@ def erg_hep_get_dist(tname,
     vn_info = input_name.split('_')
     instrument = vn_info[1]  #  ;;hep
     level = vn_info[2]       #  ;;l2
-    dtype = vn_info[3]       #  ;;FEDU or rawcnt
+    data_type = vn_info[3]     #  ;;FEDU or rawcnt
     suf = vn_info[4]        #  ;; L or H 
     arrnm = vn_info[4]
     if species is None:
@@ -69,8 +143,6 @@ def erg_hep_get_dist(tname,
         print('Problem extracting the mepe 3dflux data.')
         return 0
     data_in_metadata = get_data(input_name, metadata=True)
-    t_fedu = deepcopy(data_in[0])
-    fedu = deepcopy(data_in[1])
     vn_angsga = '_'.join(vn_info[0:3] +['FEDU', suf, 'Angle_sga'])
     if get_data(vn_angsga) is not None:
         angsga = deepcopy(get_data(vn_angsga)[1])
@@ -82,34 +154,6 @@ def erg_hep_get_dist(tname,
     if len(tnames(vn_sctno)) < 1:
         print(f'Cannot find variable {vn_sctno}, which is essential for this routine to work.')
         return 0
-    else:
-        time_scno, scno = get_data(tnames(vn_sctno)[0])
-
-    id_scno_0=np.argwhere(scno == 0)
-    sc0num = len(id_scno_0)
-    if sc0num < 5:
-        print(f'Only data for less than 5 spins are loaded for HEP_{suf}!!')
-        return 0
-    
-    # ;; integration time for each spin sector
-    sctdt = time_scno[1:] - time_scno[:-1]
-    sctintgt=np.insert(sctdt, sctdt.shape[0],sctdt[-1])
-
-    id_scno_0_list = id_scno_0[:,0].tolist()
-    sc0_t = time_scno[id_scno_0_list]  # ;; times of spin sector #0, namely the start of each spin
-    dt_array = sc0_t[1:] - sc0_t[:-1]
-    sc0_dt = np.insert(dt_array, dt_array.shape[0], dt_array[-1])
-
-    #  processing for 'id_t_fedu = value_locate()' in IDL.
-    sc0_t_repeat = np.repeat(np.array([sc0_t]).T, 2, 1)
-    t_fedu_repeat = np.repeat(np.array([t_fedu]).T, 2, 1)
-    tree = KDTree(sc0_t_repeat)
-    _, id_t_fedu_nn = tree.query(t_fedu_repeat)
-    id_t_fedu = np.where((t_fedu - sc0_t[id_t_fedu_nn.tolist()]) < 0., id_t_fedu_nn-1, id_t_fedu_nn)
-    #  processing for 'id_t_fedu = value_locate()' in IDL.
-
-    #  ;; Genrate angarr by picking up angle values at each spin start
-    angarr = angsga[id_scno_0_list, :, :]
 
     #  ;; fedu_arr:[ time, spin sct, energy, azm ]
     #   ;; by default
@@ -120,23 +164,15 @@ def erg_hep_get_dist(tname,
 
     if suf == 'H':  # ;; Lv2 HEP-H flux array has 11 elements for energy bin currently.
         nene = 11
-    fedu_arr = np.full(shape=(sc0num, nsct, nene, nazm ), fill_value=np.nan)  # ;; padded with NaN
-    intgt = np.full(shape=(sc0num, nsct), fill_value=np.nan)  # ;; padded with NaN
-    
-    for i in range(sc0num):
-        id_array = np.argwhere( (id_t_fedu == i) & (scno >= 0) & (scno <= 15))
-        if len(id_array) < 2:
-            continue
-        id_list = id_array[:, 0].tolist()
-        datarr = fedu[id_list, :, :]  # ;; usually [16(time), 16(energy), 15(azm)]
-        tarr = t_fedu[id_list]
-        sctarr = scno[id_list]
-        sctarr_list = sctarr.tolist()
-        nsct = len(sctarr_list)
-        inttarr = sctintgt[id_list]
-
-        fedu_arr[i, sctarr_list, :, :] = datarr.reshape(1, nsct, nene, nazm)
-        intgt[i, sctarr_list] = inttarr.reshape(1, nsct)
+
+    spins = _spin_regroup(input_name, tnames(vn_sctno)[0], nsct, nene, nazm)
+    if spins is None:
+        print(f'Only data for less than 5 spins are loaded for HEP_{suf}!!')
+        return 0
+    id_scno_0_list, sc0_t, sc0_dt, fedu_arr, intgt = spins
+
+    #  ;; Genrate angarr by picking up angle values at each spin start
+    angarr = angsga[id_scno_0_list, :, :]
 
     p_structure = {
     'x':sc0_t,  # ;; Put the start time of each spin
@@ -194,7 +230,7 @@ def erg_hep_get_dist(tname,
         mass = 5.68566e-06
         charge = -1.
         data_name = f'HEP-{suf} Electron 3dflux'
-        if dtype == 'rawcnt':
+        if data_type == 'rawcnt':
             data_name = f'HEP-{suf} Electron raw count/sample'
         integ_time = 7.99 / 16  # ;; currently hard-coded, but practically not used.
     else:
@@ -225,7 +261,7 @@ def erg_hep_get_dist(tname,
     ;; The factor 1d-3 is to convert [/keV-s-sr-cm2] (default unit of
     ;; HEP Lv2 flux data) to [/eV-s-sr-cm2] 
     """
-    if 'cnt' not in dtype:
+    if 'cnt' not in data_type:
         dist['data'] = p_structure['y'][tuple([index])].transpose([2, 1, 3, 0]) * 1.e-03
     else:
         dist['data'] = p_structure['y'][tuple([index])].transpose([2, 1, 3, 0])  # ;; for count/sample, count/sec
@@ -247,7 +283,7 @@ def erg_hep_get_dist(tname,
         dist['bins'][:, :, invalid_azms, :] = 0
 
     #  ;; Apply the empiricallly-derived efficiency (only for cnt/cntrate/dtcntrate)
-    if (new_effic) and ('cnt' in dtype):
+    if (new_effic) and ('cnt' in data_type):
         """
         ;; efficiency for each azim. ch. based on the inter-ch. calibration
         ;; Only valid for 2017-06-21 through 2019-02-07 
@@ -288,8 +324,7 @@ def erg_hep_get_dist(tname,
                              axis=2)  # repeated across apd(elevation)
     energy_rebin2 = np.repeat(energy_rebin1, dim_array[1],
                               axis=1)  # repeated across spin phase(azimuth)
-    dist['energy'] = np.repeat(energy_rebin2, n_times,
-                              axis=3)  # repeated across n_time
+    dist['energy'] = erg_pgs_time_broadcast(energy_rebin2, n_times)  # shared across n_times
 
     # denergy member
     
@@ -300,8 +335,7 @@ def erg_hep_get_dist(tname,
                          axis=2)  # repeated across apd(elevation)
     de_rebin2 = np.repeat(de_rebin1, dim_array[1],
                          axis=1)  # repeated across spin phase(azimuth)
-    dist['denergy'] = np.repeat(de_rebin2, n_times,
-                         axis=3)  # repeated across n_times
+    dist['denergy'] = erg_pgs_time_broadcast(de_rebin2, n_times)  # shared across n_times
 
 
     dist['n_energy'] = dim_array[0]
@@ -369,21 +403,25 @@ def erg_hep_get_dist(tname,
     ;;    + offset angle 
     """
     dist['phi'] = np.fmod((phi0 + 360.), 360.)
-    dist['dphi'] = np.full(shape=np.insert(dim_array, dim_array.shape[0],
-                                           n_times), fill_value=22.5)  # ;; 22.5 deg as a constant
+    dist['dphi'] = erg_pgs_time_broadcast(
+        np.full(shape=np.insert(dim_array, dim_array.shape[0], 1), fill_value=22.5),
+        n_times)  # ;; 22.5 deg as a constant
     del phi0  # ;; Clean huge arrays
     dist['n_phi'] = dim_array[1]
     #  ;; elevation angle
     elev = angarr[index, 0, :]  # ;; [ (time), (Az.ch)]
     elev_reform = np.reshape(elev.T, [1, 1, dim_array[2], n_times])
-    elev_rebin1 = np.repeat(elev_reform, dim_array[1],
-                             axis=1)  # repeated across spin phase(azimuth)
-    dist['theta'] = np.repeat(elev_rebin1, dim_array[0],
-                             axis=0)  # repeated across energy
+    dist['theta'] = np.broadcast_to(elev_reform,
+                                    np.insert(dim_array, dim_array.shape[0], n_times))  # shared across energy and spin phase
 
-    dist['dtheta'] = np.full(shape=np.insert(dim_array, dim_array.shape[0],
-                                           n_times), fill_value=12.0)
+    dist['dtheta'] = erg_pgs_time_broadcast(
+        np.full(shape=np.insert(dim_array, dim_array.shape[0], 1), fill_value=12.0),
+        n_times)
 
     dist['n_theta'] = dim_array[2]
     
+    #  ;; The flux values may be kept in single precision (dtype='float32')
+    #  ;; to halve the memory; the times, energies and angles stay double
+    dist['data'] = dist['data'].astype(dtype, copy=False)
+
     return dist
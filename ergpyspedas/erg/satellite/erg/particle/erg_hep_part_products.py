@@ -1,27 +1,35 @@
 import numpy as np
 
-from copy import deepcopy
-
-from pyspedas import tinterpol, tcopy
 from pyspedas import time_double, tnames
 from pyspedas import time_string
 
 from pyspedas.particles.moments.spd_pgs_moments import spd_pgs_moments
 from pyspedas.particles.spd_part_products.spd_pgs_regrid import spd_pgs_regrid
-from pyspedas import get_timespan, get_data, store_data
+from pyspedas import get_timespan, store_data
 
 from .erg_hep_get_dist import erg_hep_get_dist
+from .erg_pgs_dist_source import DistributionSource
 from .erg_pgs_clean_data import erg_pgs_clean_data
 from .erg_pgs_limit_range import erg_pgs_limit_range
 from .erg_convert_flux_units import erg_convert_flux_units
+from .erg_pgs_moments import erg_pgs_moments_input
 from .erg_pgs_moments_tplot import erg_pgs_moments_tplot
-from .erg_pgs_make_fac import erg_pgs_make_fac
+from .erg_pgs_make_fac import erg_pgs_make_fac, erg_pgs_fac_att_names
+from .erg_pgs_support import erg_pgs_support_data
 from .erg_pgs_make_e_spec import erg_pgs_make_e_spec
 from .erg_pgs_make_theta_spec import erg_pgs_make_theta_spec
+from .erg_pgs_make_pa_energy_spec import erg_pgs_make_pa_energy_spec, erg_pgs_make_pa_energy_tplot, erg_pgs_pa_energy_slices
 from .erg_pgs_make_phi_spec import erg_pgs_make_phi_spec
 from .erg_pgs_do_fac import erg_pgs_do_fac
 from .erg_pgs_progress_update import erg_pgs_progress_update
+from .erg_pgs_run_parallel import erg_pgs_run_parallel
 from .erg_pgs_make_tplot import erg_pgs_make_tplot
+from .erg_pgs_plan import erg_pgs_plan
+from .erg_pgs_result_cache import erg_pgs_cache_key, erg_pgs_cache_load, erg_pgs_cache_save
+from .erg_pgs_append import erg_pgs_output_names, erg_pgs_append_prepare, erg_pgs_append_merge
+from .erg_pgs_profile import erg_pgs_profile
+from .erg_pgs_limit_sets import erg_pgs_limit_sets_check, erg_pgs_limit_set_arrays, erg_pgs_limit_sets_apply, \
+    erg_pgs_limit_set_moments
 
 def erg_hep_part_products(
     in_tvarname,
@@ -44,8 +52,17 @@ def erg_hep_part_products(
     relativistic=False,
     no_regrid=True,
     include_allazms=False,
-    muconv=False
+    muconv=False,
+    n_workers=1,
+    chunk_size=None,
+    plan_only=False,
+    cache=False,
+    append=False,
+    profile=None,
+    dtype='float64',
+    limit_sets=None
     ):
+    cache_params = dict(locals())
 
     if len(tnames(in_tvarname)) < 1:
         print('No input data, please specify tplot variable!')
@@ -87,6 +104,10 @@ def erg_hep_part_products(
     if gyro[0] == gyro[1]:
         gyro = [0., 360.]
 
+    limit_sets = erg_pgs_limit_sets_check(limit_sets)
+    if limit_sets is None:
+        return 0
+
 
     """
     ;;Create energy spectrogram after FAC transformation if limits are not 
@@ -103,6 +124,14 @@ def erg_hep_part_products(
             idx = idx[0]
             outputs_lc[idx] = 'fac_moments'
 
+    #  ;;Work out which stages the requested outputs need
+    plan = erg_pgs_plan(outputs_lc, regrid=not no_regrid)
+    if plan_only:
+        return plan
+
+    prof = erg_pgs_profile(profile)
+    prof.start()
+
     #  ;;Preserve the original time range
     tr_org = get_timespan(in_tvarname)
 
@@ -122,31 +151,69 @@ def erg_hep_part_products(
         time_indices = np.arange(times_array.shape[0])
 
     times_array = times_array[time_indices]
+    prof.lap('times')
+
+    #  ;;Only process the samples not in the existing output variables yet
+    if append:
+        append_done, append_previous = erg_pgs_append_prepare(erg_pgs_output_names(in_tvarname, plan['outputs'], suffix=suffix,
+                                                                                     limit_sets=limit_sets))
+        new_samples = ~np.isin(times_array, append_done)
+        time_indices = time_indices[new_samples]
+        times_array = times_array[new_samples]
+        if time_indices.shape[0] < 1:
+            print(f'No new {in_tvarname} data to append')
+            return prof.finish(list(append_previous.keys()))
 
+    #  ;;Restore the products of an identical earlier run if cached
+    if cache and not append:
+        #  ;;HEP spins and look directions are read from separate variables
+        cache_tvarnames = [in_tvarname, mag_name, pos_name,
+                           '_'.join(vn_info[0:3] + ['FEDU', vn_info[4], 'Angle_sga']),
+                           '_'.join(vn_info[0:3] + ['sctno', vn_info[4]])]
+        if 'fac_matrix' in plan['support']:
+            cache_tvarnames.extend(erg_pgs_fac_att_names(fac_type))
+        cache_key = erg_pgs_cache_key('erg_hep_part_products', cache_tvarnames,
+                                      time_indices, cache_params)
+        cached_vars = erg_pgs_cache_load(cache_key)
+        if cached_vars is not None:
+            return prof.finish(cached_vars)
 
 
-    dist_all_time_range =  erg_hep_get_dist(in_tvarname, time_indices, species=species, units=units_lc, exclude_azms= not include_allazms)
-    dist = deepcopy(dist_all_time_range)
+
+    """
+    ;; The data are parsed once and handed out as views, in blocks of
+    ;; chunk_size samples (all samples at once by default), so that the
+    ;; memory used doesn't grow with the time span
+    """
+    dist_source = DistributionSource(erg_hep_get_dist, in_tvarname, time_indices, chunk_size=chunk_size,
+                                     species=species, units=units_lc, exclude_azms= not include_allazms, dtype=dtype)
+    dist = dist_source.get(0)
+    prof.lap('get_dist')
 
     if 'energy' in outputs_lc:
-        out_energy = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_energy = np.zeros((times_array.shape[0], dist['n_energy']), dtype=dtype)
         out_energy_y = np.zeros((times_array.shape[0], dist['n_energy']))
     if 'theta' in outputs_lc:
-        n_theta_unique = len(np.unique(dist['theta']))
-        out_theta = np.zeros((times_array.shape[0], n_theta_unique))
+        n_theta_unique = len(dist_source.unique('theta'))
+        out_theta = np.zeros((times_array.shape[0], n_theta_unique), dtype=dtype)
         out_theta_y = np.zeros((times_array.shape[0], n_theta_unique))
     if 'phi' in outputs_lc:
-        out_phi = np.zeros((times_array.shape[0], dist['n_phi']))
+        out_phi = np.zeros((times_array.shape[0], dist['n_phi']), dtype=dtype)
         out_phi_y = np.zeros((times_array.shape[0], dist['n_phi']))
 
     if 'gyro' in outputs_lc:
-        out_gyro = np.zeros((times_array.shape[0], regrid[0]))
+        out_gyro = np.zeros((times_array.shape[0], regrid[0]), dtype=dtype)
         out_gyro_y = np.zeros((times_array.shape[0], regrid[0]))
 
     if 'pa' in outputs_lc:
-        out_pad = np.zeros((times_array.shape[0], regrid[1]))
+        out_pad = np.zeros((times_array.shape[0], regrid[1]), dtype=dtype)
         out_pad_y = np.zeros((times_array.shape[0], regrid[1]))
 
+    if 'pa_energy' in outputs_lc:
+        out_pa_energy = np.zeros((times_array.shape[0], dist['n_energy'], regrid[1]), dtype=dtype)
+        out_pa_energy_v1 = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_pa_energy_v2 = np.zeros((times_array.shape[0], regrid[1]))
+
     if 'moments' in outputs_lc:
         out_density = np.zeros(times_array.shape[0])
         out_avgtemp = np.zeros(times_array.shape[0])
@@ -159,7 +226,7 @@ def erg_hep_part_products(
 
 
     if 'fac_energy' in outputs_lc:
-        out_fac_energy = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_fac_energy = np.zeros((times_array.shape[0], dist['n_energy']), dtype=dtype)
         out_fac_energy_y = np.zeros((times_array.shape[0], dist['n_energy']))
 
     if 'fac_moments' in outputs_lc:
@@ -182,8 +249,7 @@ def erg_hep_part_products(
     """
     # ;;create rotation matrix to B-field aligned coordinates if needed
     
-    fac_outputs = ['pa','gyro','fac_energy', 'fac_moments']
-    fac_requested = len(set(outputs_lc).intersection(fac_outputs)) > 0
+    fac_requested = 'fac_matrix' in plan['support']
     if fac_requested:
         """
         ;; Currently triangulation fails, so forcidly no_regrid is set for
@@ -201,7 +267,7 @@ def erg_hep_part_products(
     magf = np.array([0., 0., 0.])
     no_mag_for_moments = False
 
-    if ('moments' in outputs_lc) or ('fac_moments' in outputs_lc):
+    if 'magf' in plan['support']:
 
         no_mag = mag_name is None
         magnm = tnames(mag_name)
@@ -216,10 +282,7 @@ def erg_hep_part_products(
             ;; periods
             """
 
-            magtmp = magnm+'_pgs_temp'
-            tcopy(magnm, magtmp)
-            tinterpol(magtmp, times_array, newname=magtmp)
-            magf = get_data(magtmp)[1]  #  ;; [ time, 3] nT
+            magf = erg_pgs_support_data(times_array, magnm)  #  ;; [ time, 3] nT
 
 
     if muconv:
@@ -236,79 +299,69 @@ def erg_hep_part_products(
             ;; periods
             """
 
-            magtmp = magnm+'_pgs_temp'
-            tcopy(magnm, magtmp)
-            tinterpol(magtmp, times_array, newname=magtmp)
-            magf = get_data(magtmp)[1]  #  ;; [ time, 3] nT
+            magf = erg_pgs_support_data(times_array, magnm)  #  ;; [ time, 3] nT
+
+    ysubtitle = None
+
+    prof.lap('support')
+
+    #  ;; Output arrays filled sample by sample, gathered for the parallel run
+    out_arrays = {name: value for name, value in locals().items()
+                  if name.startswith('out_') and isinstance(value, np.ndarray)}
+
+    #  ;; The limit sets make their fac_energy/fac_moments from the same FAC data
+    if not fac_requested:
+        limit_sets = []
+    limit_set_arrays = erg_pgs_limit_set_arrays(limit_sets, plan['outputs'], times_array.shape[0], dist['n_energy'], dtype=dtype)
+    out_arrays.update(limit_set_arrays)
 
     """
     ;;-------------------------------------------------
     ;; Loop over time to build the spectragrams and/or moments
     ;;-------------------------------------------------
     """
-    for index in range(time_indices.shape[0]):
-        last_update_time = erg_pgs_progress_update(last_update_time=last_update_time,
-             current_sample=index, total_samples=time_indices.shape[0], type_string=in_tvarname)
-
-        #  ;; Get the data structure for this sample
-
-        dist = {
-            'project_name': deepcopy(dist_all_time_range['project_name']),
-            'spacecraft': deepcopy(dist_all_time_range['spacecraft']),
-            'data_name': deepcopy(dist_all_time_range['data_name']),
-            'units_name': deepcopy(dist_all_time_range['units_name']),
-            'units_procedure': deepcopy(dist_all_time_range['units_procedure']),
-            'species': deepcopy(dist_all_time_range['species']),
-            'valid': deepcopy(dist_all_time_range['valid']),
-            'charge': deepcopy(dist_all_time_range['charge']),
-            'mass': deepcopy(dist_all_time_range['mass']),
-            'time': deepcopy(dist_all_time_range['time'][index]),
-            'end_time':  deepcopy(dist_all_time_range['end_time'][index]),
-            'data':  deepcopy(dist_all_time_range['data'][:, :, :, index]),
-            'bins':  deepcopy(dist_all_time_range['bins'][:, :, :, index]),
-            'energy':  deepcopy(dist_all_time_range['energy'][:, :, :, index]),
-            'denergy':  deepcopy(dist_all_time_range['denergy'][:, :, :, index]),
-            'n_energy': deepcopy(dist_all_time_range['n_energy']),
-            'n_bins': deepcopy(dist_all_time_range['n_bins']),
-            'phi':  deepcopy(dist_all_time_range['phi'][:, :, :, index]),
-            'dphi':  deepcopy(dist_all_time_range['dphi'][:, :, :, index]),
-            'n_phi': deepcopy(dist_all_time_range['n_phi']),
-            'theta':  deepcopy(dist_all_time_range['theta'][:, :, :, index]),
-            'dtheta':  deepcopy(dist_all_time_range['dtheta'][:, :, :, index]),
-            'n_theta': deepcopy(dist_all_time_range['n_theta'])
-        }
-
-        if magf.ndim == 2:
-            magvec = magf[index]
-        elif magf.ndim == 1:
-            magvec = magf
-
-        if ('moments' in outputs_lc) or ('fac_moments' in outputs_lc):
-            clean_data = erg_pgs_clean_data(dist, units=units_lc, magf=magvec,
-                                            for_moments=True)  #;; invalid values are zero-padded.
-        else:
-            clean_data = erg_pgs_clean_data(dist, units=units_lc, magf=magvec)
+    def process_samples(start, stop):
+        nonlocal last_update_time, ysubtitle
 
-        if 'mu_unit' in clean_data:
-            val = clean_data['mu_unit']
-            ysubtitle = val
-        else:
-            ysubtitle = None
+        for index in range(start, stop):
+            last_update_time = erg_pgs_progress_update(last_update_time=last_update_time,
+                 current_sample=index, total_samples=time_indices.shape[0], type_string=in_tvarname)
+            prof.mark()
+
+            #  ;; Get the data structure for this sample
+
+            dist = dist_source.get(index)
+            prof.lap('get_dist')
 
-        if fac_requested:
-            pre_limit_bins = deepcopy(clean_data['bins'])
+            if magf.ndim == 2:
+                magvec = magf[index]
+            elif magf.ndim == 1:
+                magvec = magf
 
-        clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
+            if ('moments' in outputs_lc) or ('fac_moments' in outputs_lc):
+                clean_data = erg_pgs_clean_data(dist, units=units_lc, magf=magvec,
+                                                for_moments=True)  #;; invalid values are zero-padded.
+            else:
+                clean_data = erg_pgs_clean_data(dist, units=units_lc, magf=magvec)
+            prof.lap('clean')
 
-        if ('moments' in outputs_lc) or ('fac_moments' in outputs_lc):
-            clean_data_eflux = erg_convert_flux_units(clean_data, units='eflux')
-            magfarr = deepcopy(magf)
-            clean_data_eflux_for_moments = deepcopy(clean_data_eflux)
-            clean_data_eflux_for_moments['data'] = np.where(clean_data_eflux_for_moments['bins'] == 0,
-                                                            0,clean_data_eflux_for_moments['data'])
-            moments = spd_pgs_moments(clean_data_eflux_for_moments)
+            if 'mu_unit' in clean_data:
+                val = clean_data['mu_unit']
+                ysubtitle = val
+            else:
+                ysubtitle = None
+
+            clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
+            prof.lap('limit')
+
+            if 'eflux' in plan['stages']:
+                clean_data_eflux = erg_convert_flux_units(clean_data, units='eflux')
+                prof.lap('eflux')
+
+            if 'moments' in plan['stages']:
+                clean_data_eflux_for_moments = erg_pgs_moments_input(clean_data_eflux)
+                moments = spd_pgs_moments(clean_data_eflux_for_moments)
 
-            if 'moments' in outputs_lc:
                 out_density[index] = moments['density']
                 out_avgtemp[index] = moments['avgtemp']
                 out_vthermal[index] = moments['vthermal']
@@ -317,76 +370,107 @@ def erg_hep_part_products(
                 out_mftens[index, :] = moments['mftens']
                 out_ptens[index, :] = moments['ptens']
                 out_ttens[index, :] = moments['ttens']
+                prof.lap('moments')
+
+            #  ;;Build theta spectrogram
+            if 'theta' in outputs_lc:
+                out_theta_y[index, :], out_theta[index, :] = erg_pgs_make_theta_spec(clean_data, no_ang_weighting=no_ang_weighting)
+                prof.lap('theta')
+
+            #  ;;Build energy spectrogram
+            if 'energy' in outputs_lc:
+                out_energy_y[index, :], out_energy[index, :] = erg_pgs_make_e_spec(clean_data)
+                prof.lap('energy')
+
+            #  ;;Build phi spectrogram
+            if 'phi' in outputs_lc:
+                out_phi_y[index, :], out_phi[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=dist['n_phi'],no_ang_weighting=no_ang_weighting)
+                prof.lap('phi')
+
+
+            #  ;;Perform transformation to FAC, regrid data, and apply limits in new coords
+
+            if fac_requested:
+
+                # ;limits were already applied to the energy-aligned bins above
+
+                # ;perform FAC transformation and interpolate onto a new, regular grid 
+                clean_data = erg_pgs_do_fac(clean_data, fac_matrix[index, :, :])
+                prof.lap('fac')
+
+                #;nearest neighbor interpolation to regular grid in FAC
+                if not no_regrid:
+                    if (not np.all(np.isnan(clean_data['theta']))) and (not np.all(np.isnan(clean_data['phi']))):
+                        clean_data = spd_pgs_regrid(clean_data, regrid)
+                        prof.lap('regrid')
+
+                clean_data['theta'] = 90.0-clean_data['theta']  #  ;pitch angle is specified in co-latitude
+
+                if limit_sets:
+                    # ;each limit set masks the FAC data before the pitch & gyro limits below
+                    erg_pgs_limit_sets_apply(limit_sets, limit_set_arrays, clean_data, index, plan['outputs'], no_ang_weighting=no_ang_weighting,
+                                             dist=dist, magf=magvec, units=units_lc, eflux_data=clean_data_eflux if plan['share_eflux'] else None)
+                    prof.lap('limit_sets')
+
+                # ;apply gyro & pitch angle limits(identical to phi & theta, just in new coords)
+                clean_data = erg_pgs_limit_range(clean_data, theta=pitch, phi=gyro, no_ang_weighting=no_ang_weighting)
+                prof.lap('fac_limit')
+
+                if 'pa' in outputs_lc:
+                    # ;Build pitch angle spectrogram
+                    out_pad_y[index, :], out_pad[index, :] = erg_pgs_make_theta_spec(clean_data, colatitude=True, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                    prof.lap('pa')
+
+                if 'pa_energy' in outputs_lc:
+                    # ;Bin the pitch angles of every energy channel at once
+                    out_pa_energy_v1[index, :], out_pa_energy_v2[index, :], out_pa_energy[index, :, :] = \
+                        erg_pgs_make_pa_energy_spec(clean_data, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                    prof.lap('pa_energy')
+
+                if 'gyro' in outputs_lc:
+                    # ;Build gyrophase spectrogram
+                    out_gyro_y[index, :], out_gyro[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=regrid[0], no_ang_weighting=no_ang_weighting,
+                                                                                 cache=not no_regrid)
+                    prof.lap('gyro')
+
+                if 'fac_energy' in outputs_lc:
+                    out_fac_energy_y[index, :], out_fac_energy[index, :] = erg_pgs_make_e_spec(clean_data)
+                    prof.lap('fac_energy')
+
+                if 'fac_moments' in outputs_lc:
+                    clean_data['theta'] = 90. - clean_data['theta'] # ;convert back to latitude for moments calc
+                    temp_dict = {'charge': dist['charge'],
+                                 'magf': magvec,
+                                 'species': dist['species'],
+                                 'sc_pot': 0.,
+                                 'units_name': units_lc}
+                    temp_dict.update(clean_data)
+                    clean_data = temp_dict
+                    del temp_dict
+                    if plan['share_eflux']:
+                        # ;same data values as the instrument-frame sample, already converted above
+                        clean_data_eflux = dict(clean_data, data=clean_data_eflux['data'],
+                                                units_name=clean_data_eflux['units_name'])
+                    else:
+                        clean_data_eflux = erg_convert_flux_units(clean_data, units='eflux')
+                    clean_data_eflux_for_moments = erg_pgs_moments_input(clean_data_eflux)
+                    fac_moments = spd_pgs_moments(clean_data_eflux_for_moments)
+
+                    out_fac_density[index] = fac_moments['density']
+                    out_fac_avgtemp[index] = fac_moments['avgtemp']
+                    out_fac_vthermal[index] = fac_moments['vthermal']
+                    out_fac_flux[index, :] = fac_moments['flux']
+                    out_fac_velocity[index, :] = fac_moments['velocity']
+                    out_fac_mftens[index, :] = fac_moments['mftens']
+                    out_fac_ptens[index, :] = fac_moments['ptens']
+                    out_fac_ttens[index, :] = fac_moments['ttens']
+                    prof.lap('fac_moments')
+
+        return {name: value[start:stop] for name, value in out_arrays.items()}
+
+    erg_pgs_run_parallel(process_samples, out_arrays, time_indices.shape[0], n_workers=n_workers)
+    prof.mark()
 
-        #  ;;Build theta spectrogram
-        if 'theta' in outputs_lc:
-            out_theta_y[index, :], out_theta[index, :] = erg_pgs_make_theta_spec(clean_data, no_ang_weighting=no_ang_weighting)
-
-        #  ;;Build energy spectrogram
-        if 'energy' in outputs_lc:
-            out_energy_y[index, :], out_energy[index, :] = erg_pgs_make_e_spec(clean_data)
-
-        #  ;;Build phi spectrogram
-        if 'phi' in outputs_lc:
-            out_phi_y[index, :], out_phi[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=dist['n_phi'],no_ang_weighting=no_ang_weighting)
-
-
-        #  ;;Perform transformation to FAC, regrid data, and apply limits in new coords
-        
-        if fac_requested:
-            
-            # ;limits will be applied to energy-aligned bins
-            clean_data['bins'] = deepcopy(pre_limit_bins)
-            clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
-
-            # ;perform FAC transformation and interpolate onto a new, regular grid 
-            clean_data = erg_pgs_do_fac(clean_data, fac_matrix[index, :, :])
-
-            #;nearest neighbor interpolation to regular grid in FAC
-            if not no_regrid:
-                if (not np.all(np.isnan(clean_data['theta']))) and (not np.all(np.isnan(clean_data['phi']))):
-                    clean_data = spd_pgs_regrid(clean_data, regrid)
-
-            clean_data['theta'] = 90.0-clean_data['theta']  #  ;pitch angle is specified in co-latitude
-
-            # ;apply gyro & pitch angle limits(identical to phi & theta, just in new coords)
-            clean_data = erg_pgs_limit_range(clean_data, theta=pitch, phi=gyro, no_ang_weighting=no_ang_weighting)
-
-            if 'pa' in outputs_lc:
-                # ;Build pitch angle spectrogram
-                out_pad_y[index, :], out_pad[index, :] = erg_pgs_make_theta_spec(clean_data, colatitude=True, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
-
-            if 'gyro' in outputs_lc:
-                # ;Build gyrophase spectrogram
-                out_gyro_y[index, :], out_gyro[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=regrid[0], no_ang_weighting=no_ang_weighting)
-
-            if 'fac_energy' in outputs_lc:
-                out_fac_energy_y[index, :], out_fac_energy[index, :] = erg_pgs_make_e_spec(clean_data)
-
-            if 'fac_moments' in outputs_lc:
-                clean_data['theta'] = 90. - clean_data['theta'] # ;convert back to latitude for moments calc
-                temp_dict = {'charge': dist['charge'],
-                             'magf': magvec,
-                             'species': dist['species'],
-                             'sc_pot': 0.,
-                             'units_name': units_lc}
-                temp_dict.update(clean_data)
-                clean_data = deepcopy(temp_dict)
-                del temp_dict
-                clean_data_eflux = erg_convert_flux_units(clean_data, units='eflux')
-                clean_data_eflux_for_moments = deepcopy(clean_data_eflux)
-                clean_data_eflux_for_moments['data'] = np.where(clean_data_eflux_for_moments['bins'] == 0,
-                                                                0,clean_data_eflux_for_moments['data'])
-                fac_moments = spd_pgs_moments(clean_data_eflux_for_moments)
-
-                out_fac_density[index] = fac_moments['density']
-                out_fac_avgtemp[index] = fac_moments['avgtemp']
-                out_fac_vthermal[index] = fac_moments['vthermal']
-                out_fac_flux[index, :] = fac_moments['flux']
-                out_fac_velocity[index, :] = fac_moments['velocity']
-                out_fac_mftens[index, :] = fac_moments['mftens']
-                out_fac_ptens[index, :] = fac_moments['ptens']
-                out_fac_ttens[index, :] = fac_moments['ttens']
 
     made_et_spec = ('energy' in outputs_lc) or ('fac_energy' in outputs_lc)
 
@@ -413,6 +497,12 @@ def erg_hep_part_products(
                             relativistic=relativistic)
         out_vars.append(output_tplot_name)
 
+    #  ;;Pitch angle x energy distributions and their per-energy slices
+    if 'pa_energy' in outputs_lc:
+        output_tplot_name = in_tvarname+'_pa_energy' + suffix
+        out_vars.extend(erg_pgs_make_pa_energy_tplot(output_tplot_name, x=times_array, energy=out_pa_energy_v1, pitch=out_pa_energy_v2, z=out_pa_energy,
+                                                     slice_prefix=in_tvarname+'_paspec_ene', units=units, data_name=dist['data_name'], relativistic=relativistic, suffix=suffix))
+
     if 'gyro' in outputs_lc:
         output_tplot_name = in_tvarname+'_gyro' + suffix
         erg_pgs_make_tplot(output_tplot_name, x=times_array, y=out_gyro_y, z=out_gyro, units=units, ylog=False, ytitle=dist['data_name'] + ' \\ gyro (deg)')
@@ -452,4 +542,30 @@ def erg_hep_part_products(
         fac_moments_vars = erg_pgs_moments_tplot(fac_moments, x=times_array, prefix=in_tvarname, suffix=fac_mom_suffix)
         out_vars.extend(fac_moments_vars)
 
-    return out_vars
+    #  ;;fac_energy/fac_moments of the limit sets, suffixed with '_mag_' and the set names
+    for limit_set in limit_sets:
+        set_name = limit_set['name']
+        set_suffix = '_mag_' + set_name + suffix
+        if 'fac_energy' in plan['outputs']:
+            output_tplot_name = in_tvarname + '_energy' + set_suffix
+            erg_pgs_make_tplot(output_tplot_name, x=times_array, y=limit_set_arrays[set_name, 'fac_energy_y'], z=limit_set_arrays[set_name, 'fac_energy'], units=units, ylog=True, ytitle=dist['data_name'] + ' \\ energy (eV)',
+                                relativistic=relativistic, ysubtitle=ysubtitle)
+            out_vars.append(output_tplot_name)
+        if 'fac_moments' in plan['outputs']:
+            set_moments_vars = erg_pgs_moments_tplot(erg_pgs_limit_set_moments(limit_set_arrays, set_name), x=times_array, prefix=in_tvarname, suffix=set_suffix)
+            out_vars.extend(set_moments_vars)
+
+    prof.lap('tplot')
+
+    if append:
+        erg_pgs_append_merge(append_previous)
+        if 'pa_energy' in outputs_lc:
+            #  ;; the slices are remade from the merged 3D variable
+            erg_pgs_pa_energy_slices(in_tvarname+'_pa_energy' + suffix, in_tvarname+'_paspec_ene', units=units, data_name=dist['data_name'], relativistic=relativistic, suffix=suffix)
+        prof.lap('append')
+
+    if cache and not append:
+        erg_pgs_cache_save(cache_key, out_vars)
+        prof.lap('cache')
+
+    return prof.finish(out_vars)
@@ -13,6 +13,58 @@ from astropy.coordinates import spherical_to_cartesian, cartesian_to_spherical
 logging.captureWarnings(True)
 logging.basicConfig(format='%(asctime)s: %(message)s',
                     datefmt='%d-%b-%y %H:%M:%S', level=logging.INFO)
+
+
+def _energy_tables(energy):
+    """
+    Returns the distinct energy tables, [table, energy], and the index of the
+    table of each time, from the per-time energy steps, [time, energy].
+    NaN steps compare equal.
+    """
+
+    energy = np.ascontiguousarray(np.where(np.isnan(energy), np.nan, energy))
+    rows = energy.view(np.dtype((np.void, energy.dtype.itemsize * energy.shape[1]))).ravel()
+    _, first, table_index = np.unique(rows, return_index=True, return_inverse=True)
+
+    return energy[first], table_index.ravel()
+
+
+def _energy_table_denergy(enec0_array):
+    """
+    Returns the energy widths of the steps of an energy table, NaN if the
+    table has fewer than 3 valid steps
+    """
+
+    de_array = enec0_array + np.nan
+    id_array = np.argwhere(np.isfinite(enec0_array))
+    if len(id_array) < 2:
+        return de_array
+    #  ;sorting and picks up only uniq elements. nominally 30, 28, 5, 4.
+    enec_array = np.sort(np.unique(enec0_array[id_array[:,0].tolist()]))
+    n_enec = enec_array.size
+    if (n_enec < 3) or (np.nansum(enec_array) < 0.):
+        return de_array  # ;; invalid energy value found
+    logenec_array = np.log10(enec_array)
+    logmn_array = (logenec_array[1:] + logenec_array[:-1]) / 2.
+    logdep_array = enec_array * 0.
+    logdem_array = enec_array * 0.
+    logdep_array[:-1] = deepcopy(logmn_array)
+    logdem_array[1:] = deepcopy(logmn_array)
+    logdem_array[0] = logenec_array[0] - (logmn_array[0] - logenec_array[0])
+    logdep_array[-1] = logenec_array[-1] + (logenec_array[-1] - logmn_array[-1])
+    de_array_i= 10.**logdep_array - 10.**logdem_array
+
+    # getting nearest neighbor indices, 'id = nn( enec, enec0 ) ' in IDL
+    enec0_array_temp = np.nan_to_num(enec0_array, copy=True,nan=np.nanmin(enec0_array))
+    enec0_array_temp_repeat= np.repeat(np.array([enec0_array_temp]).T, 2, 1)
+    enec_array_repeat= np.repeat(np.array([enec_array]).T, 2, 1)
+    tree = KDTree(enec_array_repeat, leafsize=1)
+    _, id_array = tree.query(enec0_array_temp_repeat)
+    # getting nearest neighbor indices, 'id = nn( enec, enec0 ) ' in IDL
+
+    return de_array_i[id_array]
+
+
 def erg_lepe_get_dist(tname,
                       index=None,
                       units='flux',
@@ -20,7 +72,8 @@ def erg_lepe_get_dist(tname,
                       species='e',
                       time_only=False,
                       single_time=None,
-                      trange=None):
+                      trange=None,
+                      dtype='float64'):
     if len(tnames(tname)) > 0:
         input_name = tnames(tname)[0]
     else:
@@ -145,63 +198,29 @@ def erg_lepe_get_dist(tname,
     ;; converted to [eV] by multiplying (1000 * charge number).
     """
     e0_array_raw = data_in.v1[index].T# ;; [32, time]
-    for i in range(n_times):
-        err_ad = np.where(eng_info[i,:] < -1)
-        e0_array_raw[err_ad,i]= np.nan
-        data_arr[err_ad,:,:,i] = np.nan
+    err_ad = (eng_info[index, :] < -1).T  # ;; [32, time]
+    e0_array_raw[err_ad] = np.nan
+    data_arr[np.broadcast_to(err_ad[:, np.newaxis, np.newaxis, :], data_arr.shape)] = np.nan
     dist['data'] = data_arr
-    
-    energy_reform = np.reshape(e0_array_raw, [dim_array[0], 1, 1, n_times])
-
-    energy_rebin1 = np.repeat(energy_reform, dim_array[2],
-                                axis=2)  # repeated spin phase
 
-    e0_array = np.repeat(energy_rebin1, dim_array[1],
-                                axis=1)  # repeated across apd(elevation)
-    dist['energy'] = e0_array
-    #energy_reform = np.reshape(e0_array, [dim_array[0], 1, 1, n_times])
-    #energy_rebin1 = np.repeat(energy_reform, dim_array[2],
-    #                         axis=2)  # repeated across apd(elevation)
-    #dist['energy'] = np.repeat(energy_rebin1, dim_array[1],
-    #                          axis=1)  # repeated across spin phase(azimuth)
-    
-    # denergy member
-    
-    de_array = e0_array_raw + np.nan  #  ;; initialized as [ time, 32 ]  
-    for i in range(n_times):
-        enec0_array = deepcopy(e0_array_raw[:, i])
-        id_array = np.argwhere(np.isfinite(enec0_array))
-        if len(id_array) < 2:
-            continue
-        #  ;sorting and picks up only uniq elements. nominally 30, 28, 5, 4.
-        enec_array = np.sort(np.unique(enec0_array[id_array[:,0].tolist()]))
-        n_enec = enec_array.size
-        if (n_enec < 3) or (np.nansum(enec_array) < 0.):
-            continue  # ;; invalid energy value found
-        logenec_array = np.log10(enec_array)
-        logmn_array = (logenec_array[1:] + logenec_array[:-1]) / 2.
-        logdep_array = enec_array * 0.
-        logdem_array = enec_array * 0.
-        logdep_array[:-1] = deepcopy(logmn_array)
-        logdem_array[1:] = deepcopy(logmn_array)
-        logdem_array[0] = logenec_array[0] - (logmn_array[0] - logenec_array[0])
-        logdep_array[-1] = logenec_array[-1] + (logenec_array[-1] - logmn_array[-1])
-        de_array_i= 10.**logdep_array - 10.**logdem_array
+    """
+    ;; Only a few distinct energy tables occur in a day, so energy and
+    ;; denergy are worked out once per table; energy_table_index gives the
+    ;; table of each time. Downstream, only the energy sort of
+    ;; erg_lep_part_products uses the tables (one sort order per table);
+    ;; the spectra and moments are still made sample by sample
+    """
+    energy_tables, table_index = _energy_tables(e0_array_raw.T)  # ;; [table, 32], [time]
+    dist['energy_tables'] = energy_tables
+    dist['energy_table_index'] = table_index
 
-        # getting nearest neighbor indices, 'id = nn( enec, enec0 ) ' in IDL
-        enec0_array_temp = np.nan_to_num(enec0_array, copy=True,nan=np.nanmin(enec0_array))
-        enec0_array_temp_repeat= np.repeat(np.array([enec0_array_temp]).T, 2, 1)
-        enec_array_repeat= np.repeat(np.array([enec_array]).T, 2, 1)
-        tree = KDTree(enec_array_repeat, leafsize=1)
-        _, id_array = tree.query(enec0_array_temp_repeat)
-        # getting nearest neighbor indices, 'id = nn( enec, enec0 ) ' in IDL
-        de_array[:, i] = de_array_i[id_array].T
+    denergy_tables = np.array([_energy_table_denergy(energy_table)
+                               for energy_table in energy_tables])
 
-    de_reform = np.reshape(de_array, [dim_array[0], 1, 1, n_times])
-    de_rebin1 = np.repeat(de_reform, dim_array[2],
-                         axis=2)  # repeated across apd(elevation)
-    dist['denergy'] = np.repeat(de_rebin1, dim_array[1],
-                         axis=1)  # repeated across spin phase(azimuth)
+    shape = tuple(np.insert(dim_array, dim_array.shape[0], n_times))
+    #  ;; repeated across spin phase(azimuth) and apd(elevation), without copying
+    dist['energy'] = np.broadcast_to(energy_tables[table_index].T[:, np.newaxis, np.newaxis, :], shape)
+    dist['denergy'] = np.broadcast_to(denergy_tables[table_index].T[:, np.newaxis, np.newaxis, :], shape)
 
     dist['n_energy'] = dim_array[0]
     dist['n_bins'] = dim_array[1] * dim_array[2]  #   # thetas * # phis
@@ -298,4 +317,8 @@ def erg_lepe_get_dist(tname,
 
     dist['n_theta'] = dim_array[2]
     
+    #  ;; The flux values may be kept in single precision (dtype='float32')
+    #  ;; to halve the memory; the times, energies and angles stay double
+    dist['data'] = dist['data'].astype(dtype, copy=False)
+
     return dist
\ No newline at end of file
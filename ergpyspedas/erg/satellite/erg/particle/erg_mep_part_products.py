@@ -1,28 +1,38 @@
 import numpy as np
 
-from copy import deepcopy
-
-from pyspedas import tinterpol
 from pyspedas import time_double, tnames
 from pyspedas import time_string
 
 from pyspedas.particles.moments.spd_pgs_moments import spd_pgs_moments
 from pyspedas.particles.spd_part_products.spd_pgs_regrid import spd_pgs_regrid
-from pyspedas import get_timespan, get_data, store_data
+from pyspedas import get_timespan
 
 from .erg_mepe_get_dist import erg_mepe_get_dist
 from .erg_mepi_get_dist import erg_mepi_get_dist
-from .erg_pgs_clean_data import erg_pgs_clean_data
+from .erg_pgs_dist_source import DistributionSource
+from .erg_pgs_clean_data import erg_pgs_clean_data, erg_pgs_clean_data_batch
 from .erg_pgs_limit_range import erg_pgs_limit_range
 from .erg_convert_flux_units import erg_convert_flux_units
+from .erg_pgs_moments import erg_pgs_moments, erg_pgs_moments_input
 from .erg_pgs_moments_tplot import erg_pgs_moments_tplot
-from .erg_pgs_make_fac import erg_pgs_make_fac
-from .erg_pgs_make_e_spec import erg_pgs_make_e_spec
-from .erg_pgs_make_theta_spec import erg_pgs_make_theta_spec
-from .erg_pgs_make_phi_spec import erg_pgs_make_phi_spec
-from .erg_pgs_do_fac import erg_pgs_do_fac
+from .erg_pgs_make_fac import erg_pgs_make_fac, erg_pgs_fac_att_names
+from .erg_pgs_support import erg_pgs_support_data
+from .erg_pgs_make_e_spec import erg_pgs_make_e_spec, erg_pgs_make_e_spec_batch
+from .erg_pgs_make_theta_spec import erg_pgs_make_theta_spec, erg_pgs_make_theta_spec_batch
+from .erg_pgs_make_pa_energy_spec import erg_pgs_make_pa_energy_spec, erg_pgs_make_pa_energy_spec_batch, \
+    erg_pgs_make_pa_energy_tplot, erg_pgs_pa_energy_slices
+from .erg_pgs_make_phi_spec import erg_pgs_make_phi_spec, erg_pgs_make_phi_spec_batch
+from .erg_pgs_do_fac import erg_pgs_do_fac, erg_pgs_do_fac_batch
 from .erg_pgs_progress_update import erg_pgs_progress_update
+from .erg_pgs_run_parallel import erg_pgs_run_parallel
 from .erg_pgs_make_tplot import erg_pgs_make_tplot
+from .erg_pgs_plan import erg_pgs_plan
+from .erg_pgs_result_cache import erg_pgs_cache_key, erg_pgs_cache_load, erg_pgs_cache_save
+from .erg_pgs_append import erg_pgs_output_names, erg_pgs_append_prepare, erg_pgs_append_merge
+from .erg_pgs_profile import erg_pgs_profile
+from .erg_pgs_limit_sets import erg_pgs_limit_sets_check, erg_pgs_limit_set_arrays, erg_pgs_limit_sets_apply, \
+    erg_pgs_limit_set_moments
+from .erg_pgs_species import erg_pgs_species_products
 
 def erg_mep_part_products(
     in_tvarname,
@@ -43,14 +53,28 @@ def erg_mep_part_products(
     mag_name=None,
     pos_name=None,
     relativistic=False,
-    no_regrid=False
+    no_regrid=False,
+    batch=False,
+    chunk_size=256,
+    n_workers=1,
+    plan_only=False,
+    cache=False,
+    append=False,
+    profile=None,
+    dtype='float64',
+    limit_sets=None
     ):
     """
     Parameters
     ----------
     in_tvarname:str
         The name of a tplot variable containing ERG/MEP 3dflux data
-    species: str
+    species: str or list of str
+        Ion species of MEP-i data ('hplus' by default). With a list, e.g.
+        ['proton', 'oplus'], the products of each species are made in one
+        call from the FPDU and FOPDU variables of the same instrument,
+        sharing the support data and FAC matrices; the output variables of
+        all the species are returned
     outputs:list of str
         The output quantities to generate. Valid options are::
 
@@ -59,6 +83,7 @@ def erg_mep_part_products(
             phi
             gyro
             pa
+            pa_energy (pitch angle x energy, with per-energy slices _paspec_eneXX)
             moments
             fac_energy
             fac_moments
@@ -91,13 +116,74 @@ def erg_mep_part_products(
         tplot name of the orbit position variable
     relativistic: bool
     no_regrid: bool
+    batch: bool
+        If True, the data are cleaned, limited and reduced to the energy,
+        theta and phi spectrograms for a block of samples at a time
+        instead of one sample at a time. The FAC rotation, regrid and the
+        pa, gyro and fac_energy spectrograms, and the moments/fac_moments
+        (erg_pgs_moments), are also done per block. The results agree with the
+        per-sample path to floating-point rounding. Default: False
+    chunk_size: int
+        Number of samples parsed from the tplot variable at once (and
+        processed at once when batch=True); None for all samples at once.
+        Default: 256
+    n_workers: int
+        Number of worker processes over which chunks of samples are
+        distributed. The input data are shared with the workers rather than
+        copied (requires the fork start method). Default: 1
+    plan_only: bool
+        If True, nothing is computed and the processing plan for the
+        requested outputs (see erg_pgs_plan) is returned instead.
+        Default: False
+    cache: bool
+        If True, the products are saved as compressed arrays in the
+        'pgs_cache' folder of the ERG local data directory, and a later run
+        on the same input data, time range and parameters restores them from
+        there instead of computing them again (see erg_pgs_result_cache).
+        Default: False
+    append: bool
+        If True, only the samples whose times are not in the existing output
+        variables yet are processed, and they are merged into those
+        variables, keeping their plot options. The cache is not used in this
+        mode. Default: False
+    profile: bool, function or PipelineProfile
+        If set, the wall time, number of calls and memory allocated of each
+        pipeline stage are recorded (see erg_pgs_profile), and the report is
+        returned along with the tplot variables. True records to a new
+        PipelineProfile; a function is called as function(stage, seconds,
+        peak_bytes) after each stage. Default: None
+    dtype: str
+        Floating-point type of the flux values from get_dist through the
+        cleaning, limits and spectrograms, and of the output spectrograms.
+        'float32' halves the memory of the distributions; the times,
+        energies and angles (including the spectrogram bins) stay float64
+        and the moments are accumulated in float64. The float32 spectrogram
+        values then agree with the float64 ones to a relative difference of
+        3e-7, and each moment component to 2e-7 of the largest magnitude of
+        that variable (tests/test_pgs_float32.py). Default: 'float64'
+    limit_sets: list of dict
+        Named pitch angle, gyrophase and energy windows, e.g.
+        [{'name': 'para', 'pitch': [0., 30.]}, {'name': 'perp', 'pitch':
+        [60., 120.]}, {'name': 'anti', 'pitch': [150., 180.]}], each with
+        the keys 'name' and any of 'pitch', 'gyro' and 'energy'. The FAC
+        data are computed once, and each set masks them with its own limits
+        to make the fac_energy and fac_moments outputs requested, stored
+        with '_mag_' + the set name in place of '_mag' (e.g.
+        erg_mepe_l2_3dflux_FEDU_energy_mag_para). Default: None
 
     Returns
     -------
     list of str
-        A list of tplot variables created
+        A list of tplot variables created, or (list of str, dict) with the
+        profile report if profile is set
 
     """
+    cache_params = dict(locals())
+
+    #  ;; Several ion species in one call, sharing the support data and FAC
+    if isinstance(species, (list, tuple)):
+        return erg_pgs_species_products(erg_mep_part_products, cache_params)
+
     if len(tnames(in_tvarname)) < 1:
         print('No input data, please specify tplot variable!')
         return 0
@@ -134,6 +220,10 @@ def erg_mep_part_products(
     if gyro[0] == gyro[1]:
         gyro = [0., 360.]
 
+    limit_sets = erg_pgs_limit_sets_check(limit_sets)
+    if limit_sets is None:
+        return 0
+
 
     """
     ;;Create energy spectrogram after FAC transformation if limits are not 
@@ -150,6 +240,14 @@ def erg_mep_part_products(
             idx = idx[0]
             outputs_lc[idx] = 'fac_moments'
 
+    #  ;;Work out which stages the requested outputs need
+    plan = erg_pgs_plan(outputs_lc, regrid=not no_regrid)
+    if plan_only:
+        return plan
+
+    prof = erg_pgs_profile(profile)
+    prof.start()
+
     #  ;;Preserve the original time range
     tr_org = get_timespan(in_tvarname)
 
@@ -171,32 +269,68 @@ def erg_mep_part_products(
         time_indices = np.arange(times_array.shape[0])
 
     times_array = times_array[time_indices]
+    prof.lap('times')
+
+    #  ;;Only process the samples not in the existing output variables yet
+    if append:
+        append_done, append_previous = erg_pgs_append_prepare(erg_pgs_output_names(in_tvarname, plan['outputs'], suffix=suffix,
+                                                                                     limit_sets=limit_sets))
+        new_samples = ~np.isin(times_array, append_done)
+        time_indices = time_indices[new_samples]
+        times_array = times_array[new_samples]
+        if time_indices.shape[0] < 1:
+            print(f'No new {in_tvarname} data to append')
+            return prof.finish(list(append_previous.keys()))
+
+    #  ;;Restore the products of an identical earlier run if cached
+    if cache and not append:
+        cache_tvarnames = [in_tvarname, mag_name, pos_name]
+        if 'fac_matrix' in plan['support']:
+            cache_tvarnames.extend(erg_pgs_fac_att_names(fac_type))
+        cache_key = erg_pgs_cache_key('erg_mep_part_products', cache_tvarnames,
+                                      time_indices, cache_params)
+        cached_vars = erg_pgs_cache_load(cache_key)
+        if cached_vars is not None:
+            return prof.finish(cached_vars)
 
 
 
     if instnm == 'mepe':
-        dist = erg_mepe_get_dist(in_tvarname, 0, species=species, units=units_lc)
+        get_dist = erg_mepe_get_dist
     elif instnm == 'mepi':
-        dist = erg_mepi_get_dist(in_tvarname, 0, species=species, units=units_lc)
+        get_dist = erg_mepi_get_dist
+
+    #  ;; The data are parsed once per block of samples and handed out as views
+    dist_source = DistributionSource(get_dist, in_tvarname, time_indices, chunk_size=chunk_size,
+                                     species=species, units=units_lc, dtype=dtype)
+    #  ;; blocks of the batch mode; all samples at once for chunk_size=None
+    block_size = dist_source.chunk_size
+    dist = dist_source.get(0)
+    prof.lap('get_dist')
 
     if 'energy' in outputs_lc:
-        out_energy = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_energy = np.zeros((times_array.shape[0], dist['n_energy']), dtype=dtype)
         out_energy_y = np.zeros((times_array.shape[0], dist['n_energy']))
     if 'theta' in outputs_lc:
-        out_theta = np.zeros((times_array.shape[0], dist['n_theta']))
+        out_theta = np.zeros((times_array.shape[0], dist['n_theta']), dtype=dtype)
         out_theta_y = np.zeros((times_array.shape[0], dist['n_theta']))
     if 'phi' in outputs_lc:
-        out_phi = np.zeros((times_array.shape[0], dist['n_phi']))
+        out_phi = np.zeros((times_array.shape[0], dist['n_phi']), dtype=dtype)
         out_phi_y = np.zeros((times_array.shape[0], dist['n_phi']))
 
     if 'gyro' in outputs_lc:
-        out_gyro = np.zeros((times_array.shape[0], regrid[0]))
+        out_gyro = np.zeros((times_array.shape[0], regrid[0]), dtype=dtype)
         out_gyro_y = np.zeros((times_array.shape[0], regrid[0]))
 
     if 'pa' in outputs_lc:
-        out_pad = np.zeros((times_array.shape[0], regrid[1]))
+        out_pad = np.zeros((times_array.shape[0], regrid[1]), dtype=dtype)
         out_pad_y = np.zeros((times_array.shape[0], regrid[1]))
 
+    if 'pa_energy' in outputs_lc:
+        out_pa_energy = np.zeros((times_array.shape[0], dist['n_energy'], regrid[1]), dtype=dtype)
+        out_pa_energy_v1 = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_pa_energy_v2 = np.zeros((times_array.shape[0], regrid[1]))
+
     if 'moments' in outputs_lc:
         out_density = np.zeros(times_array.shape[0])
         out_avgtemp = np.zeros(times_array.shape[0])
@@ -208,7 +342,7 @@ def erg_mep_part_products(
         out_ttens = np.zeros([times_array.shape[0], 3, 3])
 
     if 'fac_energy' in outputs_lc:
-        out_fac_energy = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_fac_energy = np.zeros((times_array.shape[0], dist['n_energy']), dtype=dtype)
         out_fac_energy_y = np.zeros((times_array.shape[0], dist['n_energy']))
 
     if 'fac_moments' in outputs_lc:
@@ -230,8 +364,7 @@ def erg_mep_part_products(
     """
     # ;;create rotation matrix to B-field aligned coordinates if needed
     
-    fac_outputs = ['pa','gyro','fac_energy', 'fac_moments']
-    fac_requested = len(set(outputs_lc).intersection(fac_outputs)) > 0
+    fac_requested = 'fac_matrix' in plan['support']
     if fac_requested:
         """
         ;; Create magnetic field data with times shifted by half of spin
@@ -239,20 +372,14 @@ def erg_mep_part_products(
         """
         if (mag_name is None) or (len(tnames(mag_name)) < 1):
             print('Cannot find the magnetic field data given by keyword mag_name! EXIT!')
-            return
-        mag_data = get_data(mag_name)
-        dt_array = mag_data[0][1:] - mag_data[0][:-1]
-        dt_array = np.insert(dt_array, dt_array.shape[0], dt_array[-1])  # ;; Note that the last value might not be correct.
-        mag_name_sftd = mag_name + '_shifted'
-        store_data(mag_name_sftd, data={'x':mag_data[0] + dt_array/2.,
-                                        'y':mag_data[1]})
+            return prof.finish(None)
         """
-        ;;The time shift applied above assumes that the time labels of MGF
+        ;;The time shift (shift_mag) assumes that the time labels of MGF
         ;;data correspond to the spin start times. Otherwise this should
         ;;be modified properly.
         """
 
-        fac_matrix = erg_pgs_make_fac(times_array, mag_name_sftd, pos_name, fac_type=fac_type)
+        fac_matrix = erg_pgs_make_fac(times_array, mag_name, pos_name, fac_type=fac_type, shift_mag=True)
 
         if fac_matrix is None:
             # problem creating the FAC matrices
@@ -262,7 +389,7 @@ def erg_mep_part_products(
     magf = np.array([0., 0., 0.])
     no_mag_for_moments = False
 
-    if ('moments' in outputs_lc) or ('fac_moments' in outputs_lc):
+    if 'magf' in plan['support']:
 
         no_mag = mag_name is None
         magnm = tnames(mag_name)
@@ -277,56 +404,163 @@ def erg_mep_part_products(
             ;; periods
             """
 
-            mag_data = get_data(magnm)
-            dt_array = mag_data[0][1:] - mag_data[0][:-1]
-            dt_array = np.insert(dt_array, 
-            dt_array.shape[0], dt_array[-1])#;; Note that the last value might not be correct.
-            magnm_sftd = magnm + '_shifted'
-            store_data(magnm_sftd, data={'x':mag_data[0] + dt_array / 2.,
-                                         'y':mag_data[1]})
-            tinterpol(magnm_sftd, times_array, newname=magnm_sftd)
-            magf = get_data(magnm_sftd)[1]  #  ;; [ time, 3] nT
+            magf = erg_pgs_support_data(times_array, magnm, shift=True)  #  ;; [ time, 3] nT
+
+    prof.lap('support')
+
+    #  ;; Output arrays filled sample by sample, gathered for the parallel run
+    out_arrays = {name: value for name, value in locals().items()
+                  if name.startswith('out_') and isinstance(value, np.ndarray)}
+
+    #  ;; The limit sets make their fac_energy/fac_moments from the same FAC data
+    if not fac_requested:
+        limit_sets = []
+    limit_set_arrays = erg_pgs_limit_set_arrays(limit_sets, plan['outputs'], times_array.shape[0], dist['n_energy'], dtype=dtype)
+    out_arrays.update(limit_set_arrays)
 
     """
     ;;-------------------------------------------------
     ;; Loop over time to build spectrograms and/or moments
     ;;-------------------------------------------------
     """
-    for index in range(time_indices.shape[0]):
-
-        last_update_time = erg_pgs_progress_update(last_update_time=last_update_time,
-             current_sample=index, total_samples=time_indices.shape[0], type_string=in_tvarname)
-
-        #  ;; Get the data structure for this sample
-
-        if instnm == 'mepe':
-
-            dist = erg_mepe_get_dist(in_tvarname, time_indices[index], species=species, units=units_lc)
-
-        elif instnm == 'mepi':
-            dist = erg_mepi_get_dist(in_tvarname, time_indices[index], species=species, units=units_lc)
-
-        if magf.ndim == 2:
-            magvec = magf[index]
-        elif magf.ndim == 1:
-            magvec = magf
+    def process_samples(start, stop):
+        nonlocal last_update_time
+
+        if batch:
+            #  ;; Clean, limit and reduce a block of samples at a time
+            for block_start in range(start, stop, block_size):
+                block = slice(block_start, min(block_start + block_size, stop))
+
+                last_update_time = erg_pgs_progress_update(last_update_time=last_update_time,
+                     current_sample=block_start, total_samples=time_indices.shape[0], type_string=in_tvarname)
+                prof.mark()
+
+                dist = dist_source.get_block(block.start, block.stop)
+                prof.lap('get_dist')
+
+                if magf.ndim == 2:
+                    block_magf = magf[block]
+                else:
+                    block_magf = magf
+
+                clean_block = erg_pgs_clean_data_batch(dist, units=units_lc, relativistic=relativistic, magf=block_magf)
+                prof.lap('clean')
+
+                clean_block = erg_pgs_limit_range(clean_block, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
+                prof.lap('limit')
+
+                if 'theta' in outputs_lc:
+                    out_theta_y[block, :], out_theta[block, :] = erg_pgs_make_theta_spec_batch(clean_block, resolution=dist['n_theta'], no_ang_weighting=no_ang_weighting)
+                    prof.lap('theta')
+
+                if 'energy' in outputs_lc:
+                    out_energy_y[block, :], out_energy[block, :] = erg_pgs_make_e_spec_batch(clean_block)
+                    prof.lap('energy')
+
+                if 'phi' in outputs_lc:
+                    out_phi_y[block, :], out_phi[block, :] = erg_pgs_make_phi_spec_batch(clean_block, resolution=dist['n_phi'], no_ang_weighting=no_ang_weighting)
+                    prof.lap('phi')
+
+                if 'eflux' in plan['stages']:
+                    clean_block_eflux = erg_convert_flux_units(clean_block, units='eflux')
+                    prof.lap('eflux')
+
+                if 'moments' in plan['stages']:
+                    moments = erg_pgs_moments(clean_block_eflux)
+
+                    out_density[block] = moments['density']
+                    out_avgtemp[block] = moments['avgtemp']
+                    out_vthermal[block] = moments['vthermal']
+                    out_flux[block, :] = moments['flux']
+                    out_velocity[block, :] = moments['velocity']
+                    out_mftens[block, :] = moments['mftens']
+                    out_ptens[block, :] = moments['ptens']
+                    out_ttens[block, :] = moments['ttens']
+                    prof.lap('moments')
+
+                if fac_requested:
+                    #  ;; Rotate (and regrid) the whole block to FAC, then apply pitch & gyro limits
+                    fac_block = erg_pgs_do_fac_batch(clean_block, fac_matrix[block], regrid=None if no_regrid else regrid)
+                    prof.lap('fac')
+                    fac_block['theta'] = 90.0-fac_block['theta']  #  ;pitch angle is specified in co-latitude
+                    if limit_sets:
+                        erg_pgs_limit_sets_apply(limit_sets, limit_set_arrays, fac_block, block, plan['outputs'], no_ang_weighting=no_ang_weighting,
+                                                 eflux_data=clean_block_eflux if plan['share_eflux'] else None, batch=True)
+                        prof.lap('limit_sets')
+                    fac_block = erg_pgs_limit_range(fac_block, theta=pitch, phi=gyro, no_ang_weighting=no_ang_weighting)
+                    prof.lap('fac_limit')
+
+                    if 'pa' in outputs_lc:
+                        out_pad_y[block, :], out_pad[block, :] = erg_pgs_make_theta_spec_batch(fac_block, colatitude=True, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                        prof.lap('pa')
+
+                    if 'pa_energy' in outputs_lc:
+                        out_pa_energy_v1[block, :], out_pa_energy_v2[block, :], out_pa_energy[block, :, :] = \
+                            erg_pgs_make_pa_energy_spec_batch(fac_block, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                        prof.lap('pa_energy')
+
+                    if 'gyro' in outputs_lc:
+                        out_gyro_y[block, :], out_gyro[block, :] = erg_pgs_make_phi_spec_batch(fac_block, resolution=regrid[0], no_ang_weighting=no_ang_weighting,
+                                                                                           cache=not no_regrid)
+                        prof.lap('gyro')
+
+                    if 'fac_energy' in outputs_lc:
+                        out_fac_energy_y[block, :], out_fac_energy[block, :] = erg_pgs_make_e_spec_batch(fac_block)
+                        prof.lap('fac_energy')
+
+                    if 'fac_moments' in outputs_lc:
+                        fac_block_lat = dict(fac_block)
+                        fac_block_lat['theta'] = 90. - fac_block['theta'] # ;convert back to latitude for moments calc
+                        if plan['share_eflux']:
+                            # ;same data values as the instrument-frame block, already converted above
+                            fac_block_lat['data'] = clean_block_eflux['data']
+                            fac_block_lat['units_name'] = clean_block_eflux['units_name']
+                        else:
+                            fac_block_lat = erg_convert_flux_units(fac_block_lat, units='eflux')
+                        fac_moments = erg_pgs_moments(fac_block_lat)
+
+                        out_fac_density[block] = fac_moments['density']
+                        out_fac_avgtemp[block] = fac_moments['avgtemp']
+                        out_fac_vthermal[block] = fac_moments['vthermal']
+                        out_fac_flux[block, :] = fac_moments['flux']
+                        out_fac_velocity[block, :] = fac_moments['velocity']
+                        out_fac_mftens[block, :] = fac_moments['mftens']
+                        out_fac_ptens[block, :] = fac_moments['ptens']
+                        out_fac_ttens[block, :] = fac_moments['ttens']
+                        prof.lap('fac_moments')
+
+            return {name: value[start:stop] for name, value in out_arrays.items()}
+
+        for index in range(start, stop):
+
+            last_update_time = erg_pgs_progress_update(last_update_time=last_update_time,
+                 current_sample=index, total_samples=time_indices.shape[0], type_string=in_tvarname)
+            prof.mark()
+
+            #  ;; Get the data structure for this sample
+
+            if magf.ndim == 2:
+                magvec = magf[index]
+            elif magf.ndim == 1:
+                magvec = magf
+
+            dist = dist_source.get(index)
+            prof.lap('get_dist')
+
+            clean_data = erg_pgs_clean_data(dist, units=units_lc,relativistic=relativistic, magf=magvec)
+            prof.lap('clean')
 
-        clean_data = erg_pgs_clean_data(dist, units=units_lc,relativistic=relativistic, magf=magvec)
-
-        if fac_requested:
-            pre_limit_bins = deepcopy(clean_data['bins'])
+            clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
+            prof.lap('limit')
 
-        clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
+            if 'eflux' in plan['stages']:
+                clean_data_eflux = erg_convert_flux_units(clean_data, units='eflux')
+                prof.lap('eflux')
 
-        if ('moments' in outputs_lc) or ('fac_moments' in outputs_lc):
-            clean_data_eflux = erg_convert_flux_units(clean_data, units='eflux')
-            magfarr = deepcopy(magf)
-            clean_data_eflux_for_moments = deepcopy(clean_data_eflux)
-            clean_data_eflux_for_moments['data'] = np.where(clean_data_eflux_for_moments['bins'] == 0,
-                                                            0,clean_data_eflux_for_moments['data'])
-            moments = spd_pgs_moments(clean_data_eflux_for_moments)
+            if 'moments' in plan['stages']:
+                clean_data_eflux_for_moments = erg_pgs_moments_input(clean_data_eflux)
+                moments = spd_pgs_moments(clean_data_eflux_for_moments)
 
-            if 'moments' in outputs_lc:
                 out_density[index] = moments['density']
                 out_avgtemp[index] = moments['avgtemp']
                 out_vthermal[index] = moments['vthermal']
@@ -335,75 +569,106 @@ def erg_mep_part_products(
                 out_mftens[index, :] = moments['mftens']
                 out_ptens[index, :] = moments['ptens']
                 out_ttens[index, :] = moments['ttens']
+                prof.lap('moments')
+
+            #  ;;Build theta spectrogram
+            if 'theta' in outputs_lc:
+                out_theta_y[index, :], out_theta[index, :] = erg_pgs_make_theta_spec(clean_data, resolution=dist['n_theta'],no_ang_weighting=no_ang_weighting)
+                prof.lap('theta')
+
+            #  ;;Build energy spectrogram
+            if 'energy' in outputs_lc:
+                out_energy_y[index, :], out_energy[index, :] = erg_pgs_make_e_spec(clean_data)
+                prof.lap('energy')
+
+            #  ;;Build phi spectrogram
+            if 'phi' in outputs_lc:
+                out_phi_y[index, :], out_phi[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=dist['n_phi'],no_ang_weighting=no_ang_weighting)
+                prof.lap('phi')
+
+            #  ;;Perform transformation to FAC, (regrid data), and apply limits in new coords
+
+            if fac_requested:
+
+                # ;limits were already applied to the energy-aligned bins above
+
+                # ;perform FAC transformation and interpolate onto a new, regular grid 
+                clean_data = erg_pgs_do_fac(clean_data, fac_matrix[index, :, :])
+                prof.lap('fac')
+
+                #;nearest neighbor interpolation to regular grid in FAC
+                if not no_regrid:
+                    if (not np.all(np.isnan(clean_data['theta']))) and (not np.all(np.isnan(clean_data['phi']))):
+                        clean_data = spd_pgs_regrid(clean_data, regrid)
+                        prof.lap('regrid')
+
+                clean_data['theta'] = 90.0-clean_data['theta']  #  ;pitch angle is specified in co-latitude
+
+                if limit_sets:
+                    # ;each limit set masks the FAC data before the pitch & gyro limits below
+                    erg_pgs_limit_sets_apply(limit_sets, limit_set_arrays, clean_data, index, plan['outputs'], no_ang_weighting=no_ang_weighting,
+                                             dist=dist, magf=magvec, units=units_lc, eflux_data=clean_data_eflux if plan['share_eflux'] else None)
+                    prof.lap('limit_sets')
+
+                # ;apply gyro & pitch angle limits(identical to phi & theta, just in new coords)
+                clean_data = erg_pgs_limit_range(clean_data, theta=pitch, phi=gyro, no_ang_weighting=no_ang_weighting)
+                prof.lap('fac_limit')
+
+                if 'pa' in outputs_lc:
+                    # ;Build pitch angle spectrogram
+                    out_pad_y[index, :], out_pad[index, :] = erg_pgs_make_theta_spec(clean_data, colatitude=True, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                    prof.lap('pa')
+
+                if 'pa_energy' in outputs_lc:
+                    # ;Bin the pitch angles of every energy channel at once
+                    out_pa_energy_v1[index, :], out_pa_energy_v2[index, :], out_pa_energy[index, :, :] = \
+                        erg_pgs_make_pa_energy_spec(clean_data, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                    prof.lap('pa_energy')
+
+                if 'gyro' in outputs_lc:
+                    # ;Build gyrophase spectrogram
+                    out_gyro_y[index, :], out_gyro[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=regrid[0], no_ang_weighting=no_ang_weighting,
+                                                                                 cache=not no_regrid)
+                    prof.lap('gyro')
+
+                if 'fac_energy' in outputs_lc:
+                    out_fac_energy_y[index, :], out_fac_energy[index, :] = erg_pgs_make_e_spec(clean_data)
+                    prof.lap('fac_energy')
+
+                if 'fac_moments' in outputs_lc:
+                    clean_data['theta'] = 90. - clean_data['theta'] # ;convert back to latitude for moments calc
+                    temp_dict = {'charge': dist['charge'],
+                                 'magf': magvec,
+                                 'species': dist['species'],
+                                 'sc_pot': 0.,
+                                 'units_name': units_lc}
+                    temp_dict.update(clean_data)
+                    clean_data = temp_dict
+                    del temp_dict
+                    if plan['share_eflux']:
+                        # ;same data values as the instrument-frame sample, already converted above
+                        clean_data_eflux = dict(clean_data, data=clean_data_eflux['data'],
+                                                units_name=clean_data_eflux['units_name'])
+                    else:
+                        clean_data_eflux = erg_convert_flux_units(clean_data, units='eflux')
+                    clean_data_eflux_for_moments = erg_pgs_moments_input(clean_data_eflux)
+                    fac_moments = spd_pgs_moments(clean_data_eflux_for_moments)
+
+                    out_fac_density[index] = fac_moments['density']
+                    out_fac_avgtemp[index] = fac_moments['avgtemp']
+                    out_fac_vthermal[index] = fac_moments['vthermal']
+                    out_fac_flux[index, :] = fac_moments['flux']
+                    out_fac_velocity[index, :] = fac_moments['velocity']
+                    out_fac_mftens[index, :] = fac_moments['mftens']
+                    out_fac_ptens[index, :] = fac_moments['ptens']
+                    out_fac_ttens[index, :] = fac_moments['ttens']
+                    prof.lap('fac_moments')
+
+        return {name: value[start:stop] for name, value in out_arrays.items()}
+
+    erg_pgs_run_parallel(process_samples, out_arrays, time_indices.shape[0], n_workers=n_workers, chunk_size=chunk_size)
+    prof.mark()
 
-        #  ;;Build theta spectrogram
-        if 'theta' in outputs_lc:
-            out_theta_y[index, :], out_theta[index, :] = erg_pgs_make_theta_spec(clean_data, resolution=dist['n_theta'],no_ang_weighting=no_ang_weighting)
-
-        #  ;;Build energy spectrogram
-        if 'energy' in outputs_lc:
-            out_energy_y[index, :], out_energy[index, :] = erg_pgs_make_e_spec(clean_data)
-
-        #  ;;Build phi spectrogram
-        if 'phi' in outputs_lc:
-            out_phi_y[index, :], out_phi[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=dist['n_phi'],no_ang_weighting=no_ang_weighting)
-
-        #  ;;Perform transformation to FAC, (regrid data), and apply limits in new coords
-        
-        if fac_requested:
-            
-            # ;limits will be applied to energy-aligned bins
-            clean_data['bins'] = deepcopy(pre_limit_bins)
-            clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
-
-            # ;perform FAC transformation and interpolate onto a new, regular grid 
-            clean_data = erg_pgs_do_fac(clean_data, fac_matrix[index, :, :])
-
-            #;nearest neighbor interpolation to regular grid in FAC
-            if not no_regrid:
-                if (not np.all(np.isnan(clean_data['theta']))) and (not np.all(np.isnan(clean_data['phi']))):
-                    clean_data = spd_pgs_regrid(clean_data, regrid)
-
-            clean_data['theta'] = 90.0-clean_data['theta']  #  ;pitch angle is specified in co-latitude
-
-            # ;apply gyro & pitch angle limits(identical to phi & theta, just in new coords)
-            clean_data = erg_pgs_limit_range(clean_data, theta=pitch, phi=gyro, no_ang_weighting=no_ang_weighting)
-
-            if 'pa' in outputs_lc:
-                # ;Build pitch angle spectrogram
-                out_pad_y[index, :], out_pad[index, :] = erg_pgs_make_theta_spec(clean_data, colatitude=True, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
-
-            if 'gyro' in outputs_lc:
-                # ;Build gyrophase spectrogram
-                out_gyro_y[index, :], out_gyro[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=regrid[0], no_ang_weighting=no_ang_weighting)
-
-            if 'fac_energy' in outputs_lc:
-                out_fac_energy_y[index, :], out_fac_energy[index, :] = erg_pgs_make_e_spec(clean_data)
-
-            if 'fac_moments' in outputs_lc:
-                clean_data['theta'] = 90. - clean_data['theta'] # ;convert back to latitude for moments calc
-                temp_dict = {'charge': dist['charge'],
-                             'magf': magvec,
-                             'species': dist['species'],
-                             'sc_pot': 0.,
-                             'units_name': units_lc}
-                temp_dict.update(clean_data)
-                clean_data = deepcopy(temp_dict)
-                del temp_dict
-                clean_data_eflux = erg_convert_flux_units(clean_data, units='eflux')
-                clean_data_eflux_for_moments = deepcopy(clean_data_eflux)
-                clean_data_eflux_for_moments['data'] = np.where(clean_data_eflux_for_moments['bins'] == 0,
-                                                            0,clean_data_eflux_for_moments['data'])
-                fac_moments = spd_pgs_moments(clean_data_eflux_for_moments)
-
-                out_fac_density[index] = fac_moments['density']
-                out_fac_avgtemp[index] = fac_moments['avgtemp']
-                out_fac_vthermal[index] = fac_moments['vthermal']
-                out_fac_flux[index, :] = fac_moments['flux']
-                out_fac_velocity[index, :] = fac_moments['velocity']
-                out_fac_mftens[index, :] = fac_moments['mftens']
-                out_fac_ptens[index, :] = fac_moments['ptens']
-                out_fac_ttens[index, :] = fac_moments['ttens']
 
 
 
@@ -426,6 +691,12 @@ def erg_mep_part_products(
         erg_pgs_make_tplot(output_tplot_name, x=times_array, y=out_pad_y, z=out_pad, units=units, ylog=False, ytitle=dist['data_name'] + ' \\ PA (deg)',relativistic=relativistic)
         out_vars.append(output_tplot_name)
 
+    #  ;;Pitch angle x energy distributions and their per-energy slices
+    if 'pa_energy' in outputs_lc:
+        output_tplot_name = in_tvarname+'_pa_energy' + suffix
+        out_vars.extend(erg_pgs_make_pa_energy_tplot(output_tplot_name, x=times_array, energy=out_pa_energy_v1, pitch=out_pa_energy_v2, z=out_pa_energy,
+                                                     slice_prefix=in_tvarname+'_paspec_ene', units=units, data_name=dist['data_name'], relativistic=relativistic, suffix=suffix))
+
     if 'gyro' in outputs_lc:
         output_tplot_name = in_tvarname+'_gyro' + suffix
         erg_pgs_make_tplot(output_tplot_name, x=times_array, y=out_gyro_y, z=out_gyro, units=units, ylog=False, ytitle=dist['data_name'] + ' \\ gyro (deg)',relativistic=relativistic)
@@ -465,4 +736,29 @@ def erg_mep_part_products(
         fac_moments_vars = erg_pgs_moments_tplot(fac_moments, x=times_array, prefix=in_tvarname, suffix=fac_mom_suffix)
         out_vars.extend(fac_moments_vars)
 
-    return out_vars
+    #  ;;fac_energy/fac_moments of the limit sets, suffixed with '_mag_' and the set names
+    for limit_set in limit_sets:
+        set_name = limit_set['name']
+        set_suffix = '_mag_' + set_name + suffix
+        if 'fac_energy' in plan['outputs']:
+            output_tplot_name = in_tvarname + '_energy' + set_suffix
+            erg_pgs_make_tplot(output_tplot_name, x=times_array, y=limit_set_arrays[set_name, 'fac_energy_y'], z=limit_set_arrays[set_name, 'fac_energy'], units=units, ylog=True, ytitle=dist['data_name'] + ' \\ energy (eV)',relativistic=relativistic)
+            out_vars.append(output_tplot_name)
+        if 'fac_moments' in plan['outputs']:
+            set_moments_vars = erg_pgs_moments_tplot(erg_pgs_limit_set_moments(limit_set_arrays, set_name), x=times_array, prefix=in_tvarname, suffix=set_suffix)
+            out_vars.extend(set_moments_vars)
+
+    prof.lap('tplot')
+
+    if append:
+        erg_pgs_append_merge(append_previous)
+        if 'pa_energy' in outputs_lc:
+            #  ;; the slices are remade from the merged 3D variable
+            erg_pgs_pa_energy_slices(in_tvarname+'_pa_energy' + suffix, in_tvarname+'_paspec_ene', units=units, data_name=dist['data_name'], relativistic=relativistic, suffix=suffix)
+        prof.lap('append')
+
+    if cache and not append:
+        erg_pgs_cache_save(cache_key, out_vars)
+        prof.lap('cache')
+
+    return prof.finish(out_vars)
@@ -8,6 +8,7 @@ from pyspedas import time_string
 from pyspedas import get_data
 from scipy import interpolate
 
+from .erg_pgs_time_broadcast import erg_pgs_time_broadcast
 from .get_mepe_flux_angle_in_sga import get_mepe_flux_angle_in_sga
 
 logging.captureWarnings(True)
@@ -22,7 +23,8 @@ def erg_mepe_get_dist(tname,
                       species='e',
                       time_only=False,
                       single_time=None,
-                      trange=None):
+                      trange=None,
+                      dtype='float64'):
 
     if len(tnames(tname)) > 0:
         input_name = tnames(tname)[0]
@@ -172,8 +174,7 @@ def erg_mepe_get_dist(tname,
                              axis=2)  # repeated across apd(elevation)
     energy_rebin2 = np.repeat(energy_rebin1, dim_array[1],
                               axis=1)  # repeated across spin phase(azimuth)
-    dist['energy'] = np.repeat(energy_rebin2, n_times,
-                              axis=3)  # repeated across n_times
+    dist['energy'] = erg_pgs_time_broadcast(energy_rebin2, n_times)  # shared across n_times
 
     #  ;; Energy bin width
     e0bnd = np.sqrt(e0_array[:-1] * e0_array[1:])
@@ -192,8 +193,7 @@ def erg_mepe_get_dist(tname,
                          axis=2)  # repeated across apd(elevation)
     de_rebin2 = np.repeat(de_rebin1, dim_array[1],
                          axis=1)  # repeated across spin phase(azimuth)
-    dist['denergy'] = np.repeat(de_rebin2, n_times,
-                         axis=3)  # repeated across n_times
+    dist['denergy'] = erg_pgs_time_broadcast(de_rebin2, n_times)  # shared across n_times
 
     dist['n_energy'] = dim_array[0]
 
@@ -211,16 +211,14 @@ def erg_mepe_get_dist(tname,
 
     phi0_1_rebin2 = np.repeat(phi0_1_rebin1, dim_array[0],
                              axis=0)  # repeated across energy
-    phi0_1 = np.repeat(phi0_1_rebin2,     n_times,
-                              axis=3)  # repeated across n_times
+    phi0_1 = phi0_1_rebin2  # time-invariant, [.., 1]
     phi0_2_reform = np.reshape(spinph_ofst, [1, dim_array[1], 1, 1])
     phi0_2_rebin1 = np.repeat(phi0_2_reform, dim_array[2],
                              axis=2)  # repeated across apd(elevation)
    
     phi0_2_rebin2 = np.repeat(phi0_2_rebin1, dim_array[0],
                              axis=0)  # repeated across energy
-    phi0_2 = np.repeat(phi0_2_rebin2, n_times,
-                              axis=3)  # repeated across n_times
+    phi0_2 = phi0_2_rebin2  # time-invariant, [.., 1]
     phi0 = phi0_1 + phi0_2
 
     ofst_sv = (np.arange(dim_array[0]) + 0.5) * \
@@ -233,17 +231,16 @@ def erg_mepe_get_dist(tname,
     phi_ofst_for_sv_rebin2 = np.repeat(
         phi_ofst_for_sv_rebin1,dim_array[1],
                                  axis=1)  # repeated across spin phase(azimuth)
-    phi_ofst_for_sv = np.repeat(phi_ofst_for_sv_rebin2,         n_times,
-                                 axis=3)  # repeated across n_times
+    phi_ofst_for_sv = phi_ofst_for_sv_rebin2  # time-invariant, [.., 1]
     """
     ;;  phi angle for the start of each spin phase
     ;;    + offset angle foreach sv step
     """
-    dist['phi'] = np.fmod((phi0 + phi_ofst_for_sv + 360.), 360.)
-    dist['dphi'] = np.full(shape=np.insert(dim_array, dim_array.shape[0],
-                                           n_times), fill_value=11.25)
-
-    del phi0, phi_ofst_for_sv  # ;; Clean huge arrays
+    dist['phi'] = erg_pgs_time_broadcast(np.fmod((phi0 + phi_ofst_for_sv + 360.), 360.),
+                                         n_times)
+    dist['dphi'] = erg_pgs_time_broadcast(
+        np.full(shape=np.insert(dim_array, dim_array.shape[0], 1), fill_value=11.25),
+        n_times)
 
     dist['n_phi'] = dim_array[1]
 
@@ -254,12 +251,16 @@ def erg_mepe_get_dist(tname,
                              axis=1)  # repeated across spin phase(azimuth)
     elev_rebin2 = np.repeat(elev_rebin1, dim_array[0],
                              axis=0)  # repeated across energy
-    dist['theta'] = np.repeat(elev_rebin2, n_times,
-                             axis=3)  # repeated across n_times
+    dist['theta'] = erg_pgs_time_broadcast(elev_rebin2, n_times)  # shared across n_times
 
-    dist['dtheta'] = np.full(shape=np.insert(dim_array, dim_array.shape[0],
-                                             n_times), fill_value=11.25)  # ;; 11.25 deg is set for the moment calculation
+    dist['dtheta'] = erg_pgs_time_broadcast(
+        np.full(shape=np.insert(dim_array, dim_array.shape[0], 1), fill_value=11.25),
+        n_times)  # ;; 11.25 deg is set for the moment calculation
 
     dist['n_theta'] = dim_array[2]
 
+    #  ;; The flux values may be kept in single precision (dtype='float32')
+    #  ;; to halve the memory; the times, energies and angles stay double
+    dist['data'] = dist['data'].astype(dtype, copy=False)
+
     return dist
\ No newline at end of file
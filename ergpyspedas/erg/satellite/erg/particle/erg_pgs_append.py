@@ -0,0 +1,130 @@
+import numpy as np
+from pyspedas import get_data
+
+from .erg_pgs_result_cache import erg_pgs_restore_tplot
+
+# moments stored by erg_pgs_moments_tplot()
+_moment_names = ['density', 'flux', 'mftens', 'velocity', 'ptens', 'ttens',
+                 'vthermal', 'avgtemp']
+
+
+def erg_pgs_output_names(in_tvarname, outputs, suffix='', limit_sets=None):
+    """
+    Returns the names of the tplot variables the part_products routines
+    create for the given outputs (for pa_energy, only the 3D variable; the
+    per-energy slices are made from it)
+
+    Input:
+        in_tvarname: str
+            Name of the input tplot variable
+
+        outputs: list of str
+            Requested outputs (lower case)
+
+    Parameters:
+        suffix: str
+            Suffix appended to the output variable names
+
+        limit_sets: list of dict
+            Limit sets (erg_pgs_limit_sets_check), whose fac_energy and
+            fac_moments variables are named with '_mag_' + the set name
+
+    Returns:
+        list of str
+    """
+
+    names = []
+    for output in ['energy', 'theta', 'phi', 'pa', 'gyro', 'pa_energy']:
+        if output in outputs:
+            names.append(in_tvarname + '_' + output + suffix)
+
+    if 'moments' in outputs:
+        names.extend([in_tvarname + '_' + key + suffix for key in _moment_names])
+
+    if 'fac_energy' in outputs:
+        names.append(in_tvarname + '_energy_mag' + suffix)
+
+    if 'fac_moments' in outputs:
+        names.extend([in_tvarname + '_' + key + '_mag' + suffix for key in _moment_names])
+
+    for limit_set in (limit_sets or []):
+        set_suffix = '_mag_' + limit_set['name'] + suffix
+        if 'fac_energy' in outputs:
+            names.append(in_tvarname + '_energy' + set_suffix)
+        if 'fac_moments' in outputs:
+            names.extend([in_tvarname + '_' + key + set_suffix for key in _moment_names])
+
+    return names
+
+
+def erg_pgs_append_prepare(tvarnames):
+    """
+    Reads the existing output variables before new samples are appended
+
+    Input:
+        tvarnames: list of str
+            Output variables of the run
+
+    Returns:
+        Tuple of:
+            numpy.ndarray of the times present in all the variables (empty if
+            any of them doesn't exist yet), and
+            dict of {name: (values, metadata)} of the existing variables, to
+            be passed to erg_pgs_append_merge()
+    """
+
+    previous = {}
+    times_done = None
+    for tvarname in tvarnames:
+        values = get_data(tvarname)
+        if values is None:
+            times_done = np.array([])
+            continue
+        previous[tvarname] = (values, get_data(tvarname, metadata=True))
+        if times_done is None:
+            times_done = values[0]
+        else:
+            times_done = np.intersect1d(times_done, values[0])
+
+    if times_done is None:
+        times_done = np.array([])
+
+    return times_done, previous
+
+
+def erg_pgs_append_merge(previous):
+    """
+    Merges the samples of the previous contents of output variables, as
+    returned by erg_pgs_append_prepare(), into the variables created by the
+    current run. Samples of the current run replace those at the same times,
+    the samples are sorted by time, and the plot options of the previous
+    variables are kept.
+
+    Input:
+        previous: dict
+            {name: (values, metadata)}
+    """
+
+    for tvarname, (old_values, metadata) in previous.items():
+        new_values = get_data(tvarname)
+        if new_values is None:
+            continue
+
+        if (len(old_values) != len(new_values)) \
+                or (old_values[1].shape[1:] != new_values[1].shape[1:]):
+            print(f'Cannot append to {tvarname}: the bins differ from the existing ones; the existing samples are discarded')
+            continue
+
+        keep = ~np.isin(old_values[0], new_values[0])
+        times = np.concatenate([old_values[0][keep], new_values[0]])
+        order = np.argsort(times, kind='stable')
+
+        values = [times[order], np.concatenate([old_values[1][keep], new_values[1]])[order]]
+        for old_bins, new_bins in zip(old_values[2:], new_values[2:]):
+            if new_bins.ndim > 1:
+                #  ;; time-varying bins
+                values.append(np.concatenate([old_bins[keep], new_bins])[order])
+            else:
+                values.append(new_bins)
+
+        erg_pgs_restore_tplot(tvarname, values, metadata)
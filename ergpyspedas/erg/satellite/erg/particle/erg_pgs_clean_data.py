@@ -1,23 +1,41 @@
 import numpy as np
 
 from .erg_convert_flux_units import erg_convert_flux_units
+from .erg_pgs_particle_dist import ParticleDist
 
 
-def erg_pgs_clean_data(data_in,
-                       units='flux',
-                       relativistic=False,
-                       for_moments=False,
-                       magf=np.array([0., 0., 0.]),
-                       muconv=False
-                       ):
+def _erg_pgs_clean_members(data_in, converted_data, reshape, dims, magf, for_moments):
+    """
+    Builds the members of a cleaned particle data structure and flags the
+    bins without valid data. Shared by erg_pgs_clean_data() and
+    erg_pgs_clean_data_batch(); the flagging and filling are elementwise,
+    so they work on any leading shape.
 
-    converted_data = erg_convert_flux_units(input_dist=data_in,
-                                            units=units,
-                                            relativistic=relativistic)
+    Input:
+        data_in: dict
+            Particle data structure before the unit conversion
 
-    dims = np.array(converted_data['data'].shape)
-    angdims = converted_data['data'][0, :].size
+        converted_data: dict
+            Output of erg_convert_flux_units() for data_in
+
+        reshape: function
+            Reshapes a [energy, angles...(, time)] array to the output
+            layout, [energy, angle] or [time, energy, angle]
+
+        dims: numpy.ndarray
+            Dimensions of a single sample
+
+        magf: numpy.ndarray
+            Magnetic field vector(s)
 
+        for_moments: bool
+            Fill invalid bins with values suitable for moment calculations
+
+    Returns:
+        Dict of the members
+    """
+
+    data = reshape(converted_data['data'])
     output = {
         'dims': dims,
         'time': converted_data['time'],
@@ -27,17 +45,17 @@ def erg_pgs_clean_data(data_in,
         'species': converted_data['species'],
         'magf': magf,
         'sc_pot': 0.,
-        'scaling': np.ones(shape=(dims[0], angdims)),
+        'scaling': np.ones(shape=data.shape, dtype=data.dtype),
         'units_name': data_in['units_name'],
-        'psd': data_in['data'].reshape(dims[0], angdims),
-        'data': converted_data['data'].reshape(dims[0], angdims),
-        'bins': converted_data['bins'].reshape(dims[0], angdims),
-        'energy': converted_data['energy'].reshape(dims[0], angdims),
-        'denergy': converted_data['denergy'].reshape(dims[0], angdims),
-        'phi': converted_data['phi'].reshape(dims[0], angdims),
-        'dphi': converted_data['dphi'].reshape(dims[0], angdims),
-        'theta': converted_data['theta'].reshape(dims[0], angdims),
-        'dtheta': converted_data['dtheta'].reshape(dims[0], angdims),
+        'psd': reshape(data_in['data']),
+        'data': data,
+        'bins': reshape(converted_data['bins']),
+        'energy': reshape(converted_data['energy']),
+        'denergy': reshape(converted_data['denergy']),
+        'phi': reshape(converted_data['phi']),
+        'dphi': reshape(converted_data['dphi']),
+        'theta': reshape(converted_data['theta']),
+        'dtheta': reshape(converted_data['dtheta']),
     }
 
     # Exclude f_nan values from further calculations
@@ -47,7 +65,7 @@ def erg_pgs_clean_data(data_in,
                               | (np.isnan(output['data']) == True)
                               | (np.isinf(output['energy']) == True)
                               | (np.isnan(output['energy']) == True),
-                              0, 1)
+                              np.int8(0), np.int8(1))
 
     # Fill invalid values with zero for moment calculations
     if for_moments:
@@ -61,3 +79,113 @@ def erg_pgs_clean_data(data_in,
         output['orig_energy'] = converted_data['orig_energy']
 
     return output
+
+
+def erg_pgs_clean_data(data_in,
+                       units='flux',
+                       relativistic=False,
+                       for_moments=False,
+                       magf=np.array([0., 0., 0.]),
+                       muconv=False
+                       ):
+    """
+    Converts the units of a single sample, reshapes it to [energy, angle]
+    and flags the bins without valid data
+
+    Returns:
+        ParticleDist; its arrays may be shared with data_in. The data keep
+        the floating-point type of data_in and bins is int8.
+    """
+
+    converted_data = erg_convert_flux_units(input_dist=data_in,
+                                            units=units,
+                                            relativistic=relativistic)
+
+    dims = np.array(converted_data['data'].shape)
+    angdims = converted_data['data'][0, :].size
+
+    def to_sample(array):
+        return array.reshape(dims[0], angdims)
+
+    return ParticleDist(**_erg_pgs_clean_members(data_in, converted_data, to_sample,
+                                                 dims, magf, for_moments))
+
+
+def erg_pgs_clean_data_batch(data_in,
+                             units='flux',
+                             relativistic=False,
+                             for_moments=False,
+                             magf=np.array([0., 0., 0.])
+                             ):
+    """
+    Batched counterpart of erg_pgs_clean_data(), cleaning a block of
+    samples at once
+
+    Input:
+        data_in: dict
+            Particle data structure containing several samples, with the time
+            on the last axis of each array, i.e. [energy, phi, theta, time]
+            (or [energy, phi, time] for XEP)
+
+    Parameters:
+        units: str
+            Output units
+
+        relativistic: bool
+            Relativistic unit conversion (electrons only)
+
+        for_moments: bool
+            Fill invalid bins with values suitable for moment calculations
+
+        magf: numpy.ndarray
+            Magnetic field vectors, [time, 3] or a single [3] vector
+
+    Returns:
+        Dict with the same members as the output of erg_pgs_clean_data(),
+        where the array members are shaped [time, energy, angle]
+    """
+
+    converted_data = erg_convert_flux_units(input_dist=data_in,
+                                            units=units,
+                                            relativistic=relativistic)
+
+    dims = np.array(converted_data['data'].shape)
+    n_times = dims[-1]
+    angdims = converted_data['data'][0, ..., 0].size
+
+    def to_batch(array):
+        # [energy, angles..., time] --> [time, energy, angle]
+        return np.ascontiguousarray(np.moveaxis(array, -1, 0)).reshape(n_times, dims[0], angdims)
+
+    return _erg_pgs_clean_members(data_in, converted_data, to_batch,
+                                  dims[:-1], magf, for_moments)
+
+
+def erg_pgs_batch_sample(data_in, index):
+    """
+    Extracts a single sample from a structure made by erg_pgs_clean_data_batch()
+
+    Input:
+        data_in: dict
+            Batched particle data structure
+
+        index: int
+            Index of the sample within the block
+
+    Returns:
+        Dict in the format returned by erg_pgs_clean_data(). The array
+        members are views into the batched structure.
+    """
+
+    output = {}
+    for key, value in data_in.items():
+        if key in ['time', 'end_time']:
+            output[key] = value[index]
+        elif key == 'magf':
+            output[key] = value[index] if value.ndim == 2 else value
+        elif isinstance(value, np.ndarray) and value.ndim == 3:
+            output[key] = value[index]
+        else:
+            output[key] = value
+
+    return output
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+# members of the particle data structure that have time as their last dimension
+_time_keys = ['time', 'end_time', 'data', 'bins', 'energy', 'denergy',
+              'phi', 'dphi', 'theta', 'dtheta', 'energy_table_index']
+
+
+class DistributionSource(object):
+    """
+    Parses a tplot variable of 3D/2D flux data into a particle data
+    structure once and hands out per-sample or per-block views of it
+
+    The data are parsed by the instrument's *_get_dist routine in blocks of
+    chunk_size samples. Requests falling in the block already parsed are
+    served as views without copying (hits); any other request parses the
+    block starting at the requested sample (misses).
+
+    Input:
+        get_dist: function
+            erg_mepe_get_dist, erg_mepi_get_dist, erg_lepe_get_dist, etc.
+
+        tname: str
+            Name of the tplot variable
+
+        index: numpy.ndarray
+            Indices of the time samples to use; positions within this array
+            are used when requesting samples
+
+    Parameters:
+        chunk_size: int
+            Number of samples parsed at once; all samples by default
+
+        **kwargs:
+            Passed on to get_dist (species, units, etc.)
+    """
+
+    def __init__(self, get_dist, tname, index, chunk_size=None, **kwargs):
+        self.get_dist = get_dist
+        self.tname = tname
+        self.index = np.asarray(index)
+        self.n_samples = self.index.shape[0]
+        if chunk_size is None:
+            chunk_size = max(self.n_samples, 1)
+        self.chunk_size = chunk_size
+        self.kwargs = kwargs
+
+        self.hits = 0
+        self.misses = 0
+
+        self._block = None
+        self._block_start = 0
+        self._block_stop = 0
+
+    def _load(self, start, stop):
+        stop = min(max(stop, start + self.chunk_size), self.n_samples)
+        self._block = self.get_dist(self.tname, self.index[start:stop], **self.kwargs)
+        self._block_start = start
+        self._block_stop = stop
+
+    def get_block(self, start, stop):
+        """
+        Returns the particle data structure for samples start through stop-1,
+        with time as the last dimension as returned by get_dist
+        """
+
+        stop = min(stop, self.n_samples)
+        if (self._block is not None) and (self._block_start <= start) \
+                and (stop <= self._block_stop):
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._load(start, stop)
+
+        if (start == self._block_start) and (stop == self._block_stop):
+            return self._block
+
+        pos = slice(start - self._block_start, stop - self._block_start)
+        dist = {}
+        for key, value in self._block.items():
+            if key in _time_keys:
+                dist[key] = value[..., pos]
+            else:
+                dist[key] = value
+
+        return dist
+
+    def get(self, sample):
+        """
+        Returns the particle data structure for a single sample, in the same
+        form as get_dist(tname, index) with a scalar index. The arrays are
+        read-only views into the parsed block.
+        """
+
+        dist = self.get_block(sample, sample + 1)
+        out = {}
+        for key, value in dist.items():
+            if key in _time_keys:
+                value = value.view()
+                value.flags.writeable = False
+            out[key] = value
+
+        return out
+
+    def unique(self, key):
+        """
+        Returns the unique values of the member key over all samples. The
+        data are parsed one block at a time, so only one block is held in
+        memory.
+        """
+
+        values = [np.unique(self.get_block(start, start + self.chunk_size)[key])
+                  for start in range(0, self.n_samples, self.chunk_size)]
+        if len(values) == 0:
+            return np.array([])
+
+        return np.unique(np.concatenate(values))
+
+    def stats(self):
+        """
+        Returns the hit/miss counters as a dict
+        """
+
+        return {'hits': self.hits, 'misses': self.misses}
@@ -1,24 +1,28 @@
-from copy import deepcopy
+from copy import copy
 
 import numpy as np
 from astropy.coordinates import spherical_to_cartesian, cartesian_to_spherical
 
+from .erg_pgs_regrid_batch import erg_pgs_regrid_batch
+
+
 def erg_pgs_do_fac(data_in, mat, by_spin_phase =False):
     """
     Applies field aligned coordinate transformation to input data
 
     Input:
-        data_in: dict
+        data_in: dict or ParticleDist
             Particle data structure to be rotated
 
         mat: numpy.ndarray
             The 3x3 field-aligned rotation matrix to apply to the data
 
     Returns:
-        Rotated particle data structure
+        Rotated particle data structure; only theta and phi are new, the
+        other arrays are shared with data_in
     """
 
-    data_out = deepcopy(data_in)
+    data_out = copy(data_in)
     rvals = np.ones(data_in['data'].shape)
     cart_data = spherical_to_cartesian(rvals, data_in['theta']*np.pi/180.0, data_in['phi']*np.pi/180.0)
 
@@ -31,4 +35,46 @@ def erg_pgs_do_fac(data_in, mat, by_spin_phase =False):
     data_out['theta'] = sphere_data[1].value*180.0/np.pi
     data_out['phi'] = sphere_data[2].value*180.0/np.pi
 
-    return data_out
\ No newline at end of file
+    return data_out
+
+
+def erg_pgs_do_fac_batch(data_in, mat, regrid=None):
+    """
+    Applies field aligned coordinate transformation to a block of samples
+    at once, optionally followed by a nearest neighbor regrid in FAC
+
+    Input:
+        data_in: dict
+            Batched particle data structure ([time, energy, angle] arrays)
+            from erg_pgs_clean_data_batch()
+
+        mat: numpy.ndarray
+            [time, 3, 3] field-aligned rotation matrices
+
+    Parameters:
+        regrid: list of int
+            [n_phi, n_theta] of the regular FAC grid to interpolate onto, as
+            in spd_pgs_regrid(); no regridding by default
+
+    Returns:
+        Batched particle data structure whose theta/phi are the FAC
+        latitude/gyrophase of each bin. The input structure is not modified.
+    """
+
+    if regrid is not None:
+        return erg_pgs_regrid_batch(data_in, mat, regrid)
+
+    data_out = dict(data_in)
+    data_out['bins'] = np.array(data_in['bins'])
+
+    theta = data_in['theta']*np.pi/180.0
+    phi = data_in['phi']*np.pi/180.0
+    cart_data = np.stack((np.cos(theta)*np.cos(phi), np.cos(theta)*np.sin(phi), np.sin(theta)), axis=-1)
+
+    # rotate all look directions of all samples at once
+    x, y, z = np.moveaxis(np.einsum('tij,tkaj->tkai', mat, cart_data), -1, 0)
+
+    data_out['theta'] = np.arctan2(z, np.hypot(x, y))*180.0/np.pi
+    data_out['phi'] = np.mod(np.arctan2(y, x), 2.*np.pi)*180.0/np.pi
+
+    return data_out
@@ -0,0 +1,244 @@
+import numpy as np
+
+from pyspedas.cotrans_tools.cotrans_lib import subcotrans
+
+from ..common.cotrans.cart_trans_matrix_make import cart_trans_matrix_make
+from ..common.cotrans.erg_interpolate_att import erg_interpolate_att
+
+_valid_types = ['mphigeo', 'phigeo', 'xgse', 'phism', 'mphism', 'xdsi']
+
+
+def _normalize(vectors):
+    # ;; same as tnormalize(return_data=True)
+    return vectors / np.sqrt(np.nansum(vectors**2, axis=1))[:, np.newaxis]
+
+
+def erg_pgs_j2000_to_dsi(times, vectors, pos):
+    """
+    Transforms vectors from J2000 to DSI, as erg_cotrans(in_coord='j2000',
+    out_coord='dsi') does for a tplot variable
+
+    The DSI-Z axis is the spin axis from the attitude data (loaded if not
+    present), and the sun direction defining DSI-X is taken from the
+    spacecraft position given here instead of reloading the orbit data.
+
+    Input:
+        times: numpy.ndarray
+            Times (s)
+
+        vectors: numpy.ndarray
+            [time, 3] vectors in J2000
+
+        pos: numpy.ndarray
+            [time, 3] spacecraft position in GSE (km)
+
+    Returns:
+        numpy.ndarray of [time, 3] vectors in DSI
+    """
+
+    dsiz = erg_interpolate_att(time_array=times)['sgiz_j2000']['y']
+
+    sundir = _normalize(np.array([1.496e+08, 0., 0.]) - pos)
+    sundir = subcotrans(times, sundir, 'gse', 'j2000')
+
+    dsiy = np.cross(dsiz, sundir)
+    dsix = np.cross(dsiy, dsiz)
+    mat = cart_trans_matrix_make(dsix, dsiy, dsiz)
+
+    return np.einsum('ijk,ik->ij', mat, vectors)
+
+
+# ;so we don't have one long routine of doom, all transforms should be separate helper functions
+def erg_pgs_xgse(times, mag, pos):
+
+    # xaxis of this system is X of the gse system. Z is mag field
+    x_axis = np.zeros((len(times), 3))
+    x_axis[:, 0] = 1
+
+    x_axis = subcotrans(times, x_axis, 'gse', 'j2000')
+    x_axis = erg_pgs_j2000_to_dsi(times, x_axis, pos)
+
+    # ;create orthonormal basis set
+    z_basis = _normalize(mag)
+    y_basis = _normalize(np.cross(z_basis, x_axis))
+    x_basis = np.cross(y_basis, z_basis)
+
+    return (x_basis, y_basis, z_basis)
+
+
+def erg_pgs_phigeo(times, mag, pos):
+
+    pos_geo = subcotrans(times, pos, 'gse', 'geo')
+
+    # transformation to generate other_dim dim for phigeo from thm_fac_matrix_make
+    # The conversion swaps the x & y components of position, reflects over x=0,z=0 then projects into the xy plane
+    pos_conv = np.stack((-pos_geo[:, 1], pos_geo[:, 0], np.zeros(len(times))), axis=1)
+
+    # ;transform into dsl because particles are in dmpa
+    pos_conv = subcotrans(times, pos_conv, 'geo', 'j2000')
+    pos_conv = erg_pgs_j2000_to_dsi(times, pos_conv, pos)
+
+    # ;create orthonormal basis set
+    z_basis = _normalize(mag)
+    x_basis = _normalize(np.cross(pos_conv, z_basis))
+    y_basis = np.cross(z_basis, x_basis)
+
+    return (x_basis, y_basis, z_basis)
+
+
+def erg_pgs_mphigeo(times, mag, pos):
+
+    pos_geo = subcotrans(times, pos, 'gse', 'geo')
+
+    # the following is heisted from the IDL version
+    # The conversion swaps the x & y components of position, reflects over x=0,z=0 then projects into the xy plane
+    pos_conv = np.stack((pos_geo[:, 1], -pos_geo[:, 0], np.zeros(len(times))), axis=1)
+
+    # ;transform into dsl because particles are in dmpa
+    pos_conv = subcotrans(times, pos_conv, 'geo', 'j2000')
+    pos_conv = erg_pgs_j2000_to_dsi(times, pos_conv, pos)
+
+    # ;create orthonormal basis set
+    z_basis = _normalize(mag)
+    x_basis = _normalize(np.cross(z_basis, pos_conv))
+    y_basis = np.cross(z_basis, x_basis)
+
+    return (x_basis, y_basis, z_basis)
+
+
+"""
+;; ERG_PGS_PHISM
+;; To get unit vectors for FAC-phi_sm coordinate system
+;; Z axis: local B-vector dir, usually taken from spin-averaged MGF data
+;; X axis: phi_sm vector x Z, where the phi_sm lies in the azimuthally
+;;         eastward direction at a spacecraft position in the SM coordinate
+;;         system. In a dipole B-field geometry, X axis roughly points
+;;         radially outward.
+;; Y axis: Z axis x X axis, roughly pointing azimuthally eastward
+;;
+;; Common to the other procedures here, pos is the spacecraft's position
+;; coordinates in GSE and mag the local magnetic field vectors in DSI.
+"""
+
+def erg_pgs_phism(times, mag, pos):
+
+    pos_sm = subcotrans(times, pos, 'gse', 'sm')
+
+    """
+    ;; The conversion swaps the x & y components of position, reflects
+    ;; over x=0,z=0 then projects into the xy plane. In other words, the
+    ;; position vectors projected on the SM-X-Y plane are rotated by +90
+    ;; degrees around the SM-Z axis to get the phi_sm vectors.
+    """
+    phism = np.stack((-pos_sm[:, 1], pos_sm[:, 0], np.zeros(len(times))), axis=1)
+    #   SM to DSI
+    phism = subcotrans(times, phism, 'sm', 'j2000')
+    phism = erg_pgs_j2000_to_dsi(times, phism, pos)
+
+    # ;; create orthonormal basis set
+    z_basis = _normalize(mag)
+    x_basis = _normalize(np.cross(phism, z_basis))
+    y_basis = np.cross(z_basis, x_basis)
+
+    return (x_basis, y_basis, z_basis)
+
+
+"""
+;; ERG_PGS_MPHISM
+;; To get unit vectors for FAC-(minus phi_sm) coordinate system
+;; Z axis: local B-vector dir, usually taken from spin-averaged MGF data
+;; X axis: minus phi_sm vector x Z, where the minus phi_sm lies in the azimuthally
+;;         westward direction at a spacecraft position in the SM coordinate
+;;         system. In a dipole B-field geometry, X axis roughly points
+;;         radially inward.
+;; Y axis: Z axis x X axis, roughly pointing azimuthally westward
+"""
+
+def erg_pgs_mphism(times, mag, pos):
+
+    pos_sm = subcotrans(times, pos, 'gse', 'sm')
+
+    #  ;; the minus phi_sm vectors: the opposite of those in erg_pgs_phism()
+    mphism = np.stack((pos_sm[:, 1], -pos_sm[:, 0], np.zeros(len(times))), axis=1)
+    #  ;; SM to DSI
+    mphism = subcotrans(times, mphism, 'sm', 'j2000')
+    mphism = erg_pgs_j2000_to_dsi(times, mphism, pos)
+
+    # ;; create orthonormal basis set
+    z_basis = _normalize(mag)
+    x_basis = _normalize(np.cross(mphism, z_basis))
+    y_basis = np.cross(z_basis, x_basis)
+
+    return (x_basis, y_basis, z_basis)
+
+
+def erg_pgs_xdsi(times, mag, pos=None):
+
+    # xaxis of this system is X of the dsi system. Z is mag field
+    x_axis = np.zeros((len(times), 3))
+    x_axis[:, 0] = 1.
+
+    # ;create orthonormal basis set
+    z_basis = _normalize(mag)
+    y_basis = _normalize(np.cross(z_basis, x_axis))
+    x_basis = np.cross(y_basis, z_basis)
+
+    return (x_basis, y_basis, z_basis)
+
+
+_basis_functions = {'mphigeo': erg_pgs_mphigeo,
+                    'phigeo': erg_pgs_phigeo,
+                    'xgse': erg_pgs_xgse,
+                    'phism': erg_pgs_phism,
+                    'mphism': erg_pgs_mphism,
+                    'xdsi': erg_pgs_xdsi}
+
+
+def erg_pgs_fac_matrix(times, mag, pos, fac_type='mphism'):
+    """
+    Builds the rotation matrices from DSI to a field-aligned coordinate
+    system from arrays, without tplot variables
+
+    Input:
+        times: numpy.ndarray
+            Times (s) of the samples
+
+        mag: numpy.ndarray
+            [time, 3] magnetic field in DSI at the times
+
+        pos: numpy.ndarray
+            [time, 3] spacecraft position in GSE (km) at the times; not used
+            by 'xdsi'
+
+    Parameters:
+        fac_type: str
+            'mphism' (default), 'phism', 'mphigeo', 'phigeo', 'xgse' or 'xdsi'
+
+    Returns:
+        numpy.ndarray of [time, 3, 3] matrices whose rows are the FAC X, Y
+        and Z axes in DSI, or None for an invalid fac_type
+    """
+
+    if fac_type not in _valid_types:
+        print(f'Invalid FAC type "{fac_type}"; valid types: {_valid_types}')
+        return
+
+    times = np.asarray(times, dtype=np.float64)
+    mag = np.asarray(mag, dtype=np.float64)
+    if pos is not None:
+        pos = np.asarray(pos, dtype=np.float64)
+
+    basis = _basis_functions[fac_type](times, mag, pos)
+
+    """
+    ;;--------------------------------------------------------------------
+    ;;create rotation matrix
+    ;;--------------------------------------------------------------------
+    """
+
+    fac_output = np.zeros((len(times), 3, 3))
+    fac_output[:, 0, :] = basis[0]
+    fac_output[:, 1, :] = basis[1]
+    fac_output[:, 2, :] = basis[2]
+
+    return fac_output
@@ -9,7 +9,7 @@ def erg_pgs_limit_range(data_in, phi=None, theta=None, energy=None,
     turning off the corresponding bin flags.
 
     Input:
-        data: dict
+        data: dict or ParticleDist
             Particle data structure
 
     Parameters:
@@ -23,9 +23,13 @@ def erg_pgs_limit_range(data_in, phi=None, theta=None, energy=None,
             Minimum and maximum values for energy
 
     Returns:
-        Data structure with limits applied (to the bins array)
+        Data structure with limits applied (to the bins array). The bins
+        array is replaced rather than modified in place, so arrays shared
+        with other structures are left untouched.
     """
 
+    in_range_all = None
+
     # Apply phi limits
 
     if phi is not None:
@@ -60,7 +64,7 @@ def erg_pgs_limit_range(data_in, phi=None, theta=None, energy=None,
             in_range = ((phi_min < phi_in[1]) & (phi_max > phi_in[0]))\
                         | (wrapped & ((phi_min < phi_in[1]) | (phi_max > phi_in[0])))
 
-        data_in['bins'][in_range == False] = 0
+        in_range_all = in_range
 
     # ;Apply theta limits
     if theta is not None:
@@ -78,11 +82,14 @@ def erg_pgs_limit_range(data_in, phi=None, theta=None, energy=None,
         # ;determine which bins intersect the specified range
         in_range = ((theta_min < theta_min_max[1]) \
                     & (theta_max > theta_min_max[0]))
-        data_in['bins'][in_range == False] = 0
+        in_range_all = in_range if in_range_all is None else in_range_all & in_range
 
     # ;Apply energy limits
     if energy is not None:
-        data_in['bins'][data_in['energy'] < energy[0]] = 0
-        data_in['bins'][data_in['energy'] > energy[1]] = 0
+        in_range = ~((data_in['energy'] < energy[0]) | (data_in['energy'] > energy[1]))
+        in_range_all = in_range if in_range_all is None else in_range_all & in_range
+
+    if in_range_all is not None:
+        data_in['bins'] = np.where(in_range_all, data_in['bins'], 0)
 
     return data_in
@@ -0,0 +1,222 @@
+import numpy as np
+from pyspedas.particles.moments.spd_pgs_moments import spd_pgs_moments
+
+from .erg_convert_flux_units import erg_convert_flux_units
+from .erg_pgs_limit_range import erg_pgs_limit_range
+from .erg_pgs_make_e_spec import erg_pgs_make_e_spec, erg_pgs_make_e_spec_batch
+from .erg_pgs_moments import erg_pgs_moments, erg_pgs_moments_input
+
+_limit_keys = ['name', 'pitch', 'gyro', 'energy']
+
+#  ;; moments stored for fac_moments, and the shape of each per sample
+_moment_shapes = {'density': (), 'flux': (3,), 'mftens': (6,), 'velocity': (3,),
+                  'ptens': (6,), 'ttens': (3, 3), 'vthermal': (), 'avgtemp': ()}
+
+
+def erg_pgs_limit_sets_check(limit_sets):
+    """
+    Checks the limit_sets keyword of the part_products routines
+
+    Input:
+        limit_sets: list of dict
+            Named pitch angle, gyrophase and energy windows, e.g.
+            [{'name': 'para', 'pitch': [0., 30.]},
+             {'name': 'perp', 'pitch': [60., 120.], 'energy': [1e3, 1e4]}];
+            'pitch' defaults to [0, 180], 'gyro' to [0, 360] and 'energy'
+            to no limit
+
+    Returns:
+        List of dicts with all of 'name', 'pitch', 'gyro' and 'energy'
+        (an empty list for None), or None if the sets are invalid
+    """
+
+    if limit_sets is None:
+        return []
+    if isinstance(limit_sets, dict):
+        limit_sets = [limit_sets]
+
+    checked = []
+    for limit_set in limit_sets:
+        if (not isinstance(limit_set, dict)) or (not limit_set.get('name')) \
+                or (not isinstance(limit_set['name'], str)):
+            print('ERROR: each of limit_sets must be a dict with a "name"')
+            return None
+
+        unknown = [key for key in limit_set if key not in _limit_keys]
+        if len(unknown) > 0:
+            print(f'ERROR: unknown keys in limit set "{limit_set["name"]}": {" ".join(unknown)}')
+            return None
+
+        if limit_set['name'] in [previous['name'] for previous in checked]:
+            print(f'ERROR: limit set name "{limit_set["name"]}" is used more than once')
+            return None
+
+        gyro = list(limit_set.get('gyro', [0., 360.]))
+        if abs(gyro[1] - gyro[0]) > 360.:
+            print('ERROR: Gyro restrictions must have range no larger than 360 deg')
+            return None
+        if gyro[0] == gyro[1]:
+            gyro = [0., 360.]
+
+        checked.append({'name': limit_set['name'],
+                        'pitch': list(limit_set.get('pitch', [0., 180.])),
+                        'gyro': gyro,
+                        'energy': limit_set.get('energy')})
+
+    return checked
+
+
+def erg_pgs_limit_set_arrays(limit_sets, outputs, n_times, n_energy, dtype='float64'):
+    """
+    Allocates the output arrays of the limit sets
+
+    Input:
+        limit_sets: list of dict
+            Checked limit sets (erg_pgs_limit_sets_check)
+
+        outputs: list of str
+            Requested outputs; arrays are made for 'fac_energy' and
+            'fac_moments'
+
+        n_times: int
+            Number of time samples
+
+        n_energy: int
+            Number of energy channels
+
+    Returns:
+        Dict of arrays keyed (set name, 'fac_energy' or 'fac_energy_y' or
+        moment name), with time as the first dimension
+    """
+
+    arrays = {}
+    for limit_set in limit_sets:
+        name = limit_set['name']
+        if 'fac_energy' in outputs:
+            arrays[name, 'fac_energy'] = np.zeros((n_times, n_energy), dtype=dtype)
+            arrays[name, 'fac_energy_y'] = np.zeros((n_times, n_energy))
+        if 'fac_moments' in outputs:
+            for key, shape in _moment_shapes.items():
+                arrays[name, key] = np.zeros((n_times,) + shape)
+
+    return arrays
+
+
+def erg_pgs_fac_moments(fac_data, dist, magf, units, eflux_data=None):
+    """
+    Calculates the moments of a single sample in FAC, as done for the
+    fac_moments output
+
+    Input:
+        fac_data: dict
+            FAC data with the pitch & gyro limits applied; theta is the
+            pitch angle (co-latitude)
+
+        dist: dict
+            Particle data structure the sample comes from (charge, species)
+
+        magf: numpy.ndarray
+            Magnetic field vector of the sample
+
+        units: str
+            Units of fac_data
+
+    Parameters:
+        eflux_data: dict
+            The sample converted to eflux in the instrument frame, whose
+            data values are used if given (the data aren't regridded)
+
+    Returns:
+        dict of the moments
+    """
+
+    data = {'charge': dist['charge'],
+            'magf': magf,
+            'species': dist['species'],
+            'sc_pot': 0.,
+            'units_name': units}
+    data.update(fac_data)
+    data['theta'] = 90. - fac_data['theta']  # ;convert back to latitude for moments calc
+    if eflux_data is not None:
+        data = dict(data, data=eflux_data['data'], units_name=eflux_data['units_name'])
+    else:
+        data = erg_convert_flux_units(data, units='eflux')
+
+    return spd_pgs_moments(erg_pgs_moments_input(data))
+
+
+def erg_pgs_limit_sets_apply(limit_sets, arrays, fac_data, index, outputs, no_ang_weighting=False,
+                             dist=None, magf=None, units=None, eflux_data=None, batch=False):
+    """
+    Fills the fac_energy and fac_moments arrays of the limit sets for one
+    sample, or for a block of samples
+
+    Each set only masks the bins of the FAC data with its own pitch,
+    gyro and energy limits; the FAC rotation (and regridding) is shared.
+
+    Input:
+        limit_sets: list of dict
+            Checked limit sets
+
+        arrays: dict
+            Output arrays (erg_pgs_limit_set_arrays)
+
+        fac_data: dict
+            FAC data of the sample(s) before the pitch & gyro limits; theta
+            is the pitch angle (co-latitude)
+
+        index: int or slice
+            Time index, or the range of samples of the block
+
+        outputs: list of str
+            Requested outputs
+
+    Parameters:
+        no_ang_weighting: bool
+            Passed to erg_pgs_limit_range
+
+        dist, magf, units:
+            Particle data structure, magnetic field vector and units of a
+            single sample, for the moments (not used with batch)
+
+        eflux_data: dict
+            The sample(s) converted to eflux in the instrument frame, whose
+            data values are used for the moments if given
+
+        batch: bool
+            If True, fac_data is a block of samples with time as the first
+            dimension
+    """
+
+    for limit_set in limit_sets:
+        name = limit_set['name']
+        set_data = erg_pgs_limit_range(dict(fac_data), theta=limit_set['pitch'], phi=limit_set['gyro'],
+                                       energy=limit_set['energy'], no_ang_weighting=no_ang_weighting)
+
+        if 'fac_energy' in outputs:
+            make_e_spec = erg_pgs_make_e_spec_batch if batch else erg_pgs_make_e_spec
+            arrays[name, 'fac_energy_y'][index], arrays[name, 'fac_energy'][index] = make_e_spec(set_data)
+
+        if 'fac_moments' in outputs:
+            if batch:
+                set_data['theta'] = 90. - set_data['theta']  # ;convert back to latitude for moments calc
+                if eflux_data is not None:
+                    set_data['data'] = eflux_data['data']
+                    set_data['units_name'] = eflux_data['units_name']
+                else:
+                    set_data = erg_convert_flux_units(set_data, units='eflux')
+                moments = erg_pgs_moments(set_data)
+            else:
+                moments = erg_pgs_fac_moments(set_data, dist, magf, units, eflux_data=eflux_data)
+
+            for key in _moment_shapes:
+                arrays[name, key][index] = moments[key]
+
+
+def erg_pgs_limit_set_moments(arrays, name):
+    """
+    Returns the fac_moments arrays of a limit set, as passed to
+    erg_pgs_moments_tplot
+    """
+
+    return {key: arrays[name, key] for key in _moment_shapes}
@@ -1,6 +1,5 @@
 
 import numpy as np
-from copy import deepcopy
 
 # use nanmean from bottleneck if it's installed, otherwise use the numpy one
 try:
@@ -14,7 +13,7 @@ def erg_pgs_make_e_spec(data_in):
     Builds energy spectrogram from the particle data structure
     
     Input:
-        data_in: dict
+        data_in: dict or ParticleDist
             Particle data structure
 
     Returns:
@@ -22,13 +21,96 @@ def erg_pgs_make_e_spec(data_in):
 
     """
 
-    data = deepcopy(data_in)
+    # zero inactive bins to ensure areas with no data are represented as NaN
+    data_array = np.where(data_in['bins'] == 0,0,data_in['data'])
+    ave = data_array.sum(axis=1) / data_in['bins'].sum(axis=1)
+
+    y = data_in['energy'][:, 0]
+
+    return (y, ave)
+
+
+def erg_pgs_make_e_spec_batch(data_in):
+    """
+    Builds energy spectrograms for a block of samples at once
+
+    Input:
+        data_in: dict
+            Batched particle data structure from erg_pgs_clean_data_batch()
+
+    Returns:
+        Tuple containing: (energy values for the y-axis, spectrogram values),
+        both shaped [time, energy]
+
+    """
 
-    data_array = deepcopy(data['data'])
     # zero inactive bins to ensure areas with no data are represented as NaN
-    data_array = np.where(data['bins'] == 0,0,data['data'])
-    ave = data_array.sum(axis=1) / data['bins'].sum(axis=1)
+    data_array = np.where(data_in['bins'] == 0, 0, data_in['data'])
+    ave = data_array.sum(axis=2) / data_in['bins'].sum(axis=2)
 
-    y = data['energy'][:, 0]
+    y = data_in['energy'][:, :, 0]
 
     return (y, ave)
+
+
+def erg_pgs_energy_sort_order(dist, sort_orders):
+    """
+    Returns the order of the energy channels of a LEP-e sample sorted by
+    energy, with the energies of its table in that order. Both are worked
+    out once per energy table.
+
+    Input:
+        dist: dict
+            Single-sample particle data structure with 'energy_tables' and
+            'energy_table_index' (erg_lepe_get_dist)
+
+        sort_orders: dict
+            Sort orders of the energy tables seen so far, keyed by the table;
+            new tables are added
+
+    Returns:
+        Tuple containing: (channel indices in order of increasing energy,
+        table energies in that order); the invalid, NaN, channels are last
+    """
+
+    table = dist['energy_tables'][dist['energy_table_index'][0]]
+    key = table.tobytes()
+    if key not in sort_orders:
+        order = np.argsort(table)
+        sort_orders[key] = (order, table[order])
+
+    return sort_orders[key]
+
+
+def erg_pgs_sort_e_spec(arrays, y_arrays, order, energy):
+    """
+    Sorts energy spectra, in place, by the per-sample channel orders from
+    erg_pgs_energy_sort_order()
+
+    The energy values are taken from the energy tables rather than from
+    the sorted y values, which hold placeholders for the invalid bins
+    (erg_pgs_clean_data(for_moments=True) sets them to 1 eV). The channels
+    without a table energy are set to NaN.
+
+    Input:
+        arrays: list of numpy.ndarray
+            Spectrogram values shaped [time, energy] or [time, energy, ...]
+
+        y_arrays: list of numpy.ndarray
+            Energy values shaped [time, energy], overwritten with energy
+
+        order: numpy.ndarray
+            Channel orders, shaped [time, energy]
+
+        energy: numpy.ndarray
+            Table energies in the order of order, shaped [time, energy]
+    """
+
+    invalid = np.isnan(energy)
+    for array in arrays:
+        index = np.reshape(order, order.shape + (1,)*(array.ndim - 2))
+        array[...] = np.take_along_axis(array, index, axis=1)
+        array[invalid] = np.nan
+
+    for array in y_arrays:
+        array[...] = energy
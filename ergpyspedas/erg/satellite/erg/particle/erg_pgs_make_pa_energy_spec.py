@@ -0,0 +1,182 @@
+import numpy as np
+from pyspedas import get_data, store_data, options
+
+from .erg_pgs_make_theta_spec import erg_pgs_theta_spec_kernel
+from .erg_pgs_make_tplot import erg_pgs_make_tplot
+from .erg_units_string import erg_units_string
+
+
+def erg_pgs_make_pa_energy_spec(data_in, resolution=None, no_ang_weighting=False):
+    """
+    Builds the pitch angle distribution of every energy channel of a sample
+    in FAC. The energy channels are stacked in place of the samples of
+    erg_pgs_theta_spec_kernel(), so all of them are binned in one pass.
+
+    Input:
+        data_in: dict
+            FAC particle data structure; theta is the pitch angle
+            (co-latitude)
+
+    Parameters:
+        resolution: int
+            Number of pitch angle points to include in the output
+
+        no_ang_weighting: bool
+            Passed to erg_pgs_theta_spec_kernel()
+
+    Returns:
+        Tuple containing: (energy values, pitch angle values, spectrogram
+        values shaped [energy, resolution])
+
+    """
+
+    # get number of pitch angle values
+    if resolution is None:
+        n_theta = len(np.unique(data_in['theta']))
+    else:
+        n_theta = resolution
+
+    y, ave = erg_pgs_theta_spec_kernel(data_in['theta'], data_in['dtheta'], data_in['dphi'],
+                                       data_in['data'], data_in['bins'], n_theta,
+                                       colatitude=True, no_ang_weighting=no_ang_weighting)
+
+    return (data_in['energy'][:, 0], y, ave)
+
+
+def erg_pgs_make_pa_energy_spec_batch(data_in, resolution=None, no_ang_weighting=False):
+    """
+    Builds the pitch angle distributions of every energy channel for a block
+    of samples at once; the [time, energy] pairs are all stacked into a
+    single call of erg_pgs_theta_spec_kernel().
+
+    Input:
+        data_in: dict
+            Batched FAC particle data structure; theta is the pitch angle
+            (co-latitude)
+
+    Parameters:
+        resolution: int
+            Number of pitch angle points to include in the output
+
+        no_ang_weighting: bool
+            Passed to erg_pgs_theta_spec_kernel()
+
+    Returns:
+        Tuple containing: (energy values shaped [time, energy], pitch angle
+        values shaped [time, resolution], spectrogram values shaped
+        [time, energy, resolution])
+
+    """
+
+    n_times, n_energy = data_in['data'].shape[0:2]
+
+    # get number of pitch angle values
+    if resolution is None:
+        n_theta = len(np.unique(data_in['theta']))
+    else:
+        n_theta = resolution
+
+    stacked = [np.reshape(data_in[key], (n_times*n_energy, -1))
+               for key in ['theta', 'dtheta', 'dphi', 'data', 'bins']]
+    y, ave = erg_pgs_theta_spec_kernel(*stacked, n_theta,
+                                       colatitude=True, no_ang_weighting=no_ang_weighting)
+
+    return (data_in['energy'][:, :, 0], np.tile(y, (n_times, 1)),
+            np.reshape(ave, (n_times, n_energy, n_theta)))
+
+
+def erg_pgs_pa_energy_slices(name, slice_prefix, units='flux', data_name='', relativistic=False, suffix=''):
+    """
+    Creates the pitch angle spectrograms of each energy channel from a
+    pitch angle x energy tplot variable, in the same way as the
+    FEDU_L_paspec_eneXX variables of hep() for the L3 data
+
+    Input:
+        name: str
+            Name of the [time, energy, pitch angle] tplot variable
+
+        slice_prefix: str
+            Name of the slice variables before the 2-digit energy index
+
+    Parameters:
+        units: str
+            Units of the data
+
+        data_name: str
+            Instrument name shown in the y-axis titles
+
+        relativistic: bool
+            Passed to erg_units_string()
+
+        suffix: str
+            Suffix appended to the slice variable names
+
+    Returns:
+        List of the slice variable names
+    """
+
+    values = get_data(name)
+    if values is None:
+        return []
+    times, data, energy, pitch = values
+
+    slice_names = []
+    for i in range(data.shape[1]):
+        slice_name = slice_prefix + str(i).zfill(2) + suffix
+        if energy.ndim > 1:
+            energy_i = np.nanmedian(energy[:, i])
+        else:
+            energy_i = energy[i]
+        pitch_y = np.tile(pitch, (times.shape[0], 1))
+        erg_pgs_make_tplot(slice_name, x=times, y=pitch_y, z=data[:, i, :], units=units, ylog=False,
+                           ytitle=f'{data_name} \\ Ene{str(i).zfill(2)} \\ {energy_i:.4g} eV',
+                           relativistic=relativistic, ysubtitle='PA (deg)')
+        options(slice_name, 'yrange', [0., 180.])
+        slice_names.append(slice_name)
+
+    return slice_names
+
+
+def erg_pgs_make_pa_energy_tplot(name, x, energy, pitch, z, slice_prefix, units='flux', data_name='',
+                                 relativistic=False, suffix=''):
+    """
+    Stores the pitch angle x energy distributions as a 3D tplot variable
+    ('v1': energy, 'v2': pitch angle) and creates its per-energy slices
+    with erg_pgs_pa_energy_slices()
+
+    Input:
+        name: str
+            Name of the 3D tplot variable
+
+        x: numpy.ndarray
+            Times
+
+        energy: numpy.ndarray
+            Energy values, shaped [time, energy]
+
+        pitch: numpy.ndarray
+            Pitch angle values, shaped [time, pitch angle]
+
+        z: numpy.ndarray
+            Data values, shaped [time, energy, pitch angle]
+
+        slice_prefix: str
+            Name of the slice variables before the 2-digit energy index
+
+    Parameters:
+        units, data_name, relativistic, suffix:
+            Passed to erg_pgs_pa_energy_slices()
+
+    Returns:
+        List of the variable names: the 3D variable followed by the slices
+    """
+
+    store_data(name, data={'x': x, 'y': z, 'v1': energy, 'v2': pitch[0]})
+    options(name, 'spec', 1)
+    options(name, 'yrange', [0., 180.])
+    options(name, 'zlog', True)
+    options(name, 'ytitle', data_name + ' \\ PA (deg)')
+    options(name, 'ztitle', erg_units_string(units, units_only=True, relativistic=relativistic))
+
+    return [name] + erg_pgs_pa_energy_slices(name, slice_prefix, units=units, data_name=data_name,
+                                             relativistic=relativistic, suffix=suffix)
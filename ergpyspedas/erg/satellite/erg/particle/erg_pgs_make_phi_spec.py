@@ -1,10 +1,9 @@
-
 import math
+import hashlib
 import numpy as np
+from scipy import sparse
 from scipy.ndimage.interpolation import shift
 
-from copy import deepcopy
-
 # use nansum from bottleneck if it's installed, otherwise use the numpy one
 try:
     import bottleneck as bn
@@ -12,128 +11,261 @@ try:
 except ImportError:
     nansum = np.nansum
 
-def erg_pgs_make_phi_spec(data_in, resolution=None, no_ang_weighting=False):
+# weighted-average operators keyed on the data bin geometry, see
+# erg_pgs_phi_spec_operator()
+_operator_cache = {}
+_operator_cache_size = 16
+
+
+def _operator_key(phi, dphi, theta, dtheta, n_phi, no_ang_weighting):
+    # identifies the bin geometry the operator is made from
+    phi = np.ravel(phi)
+    hasher = hashlib.sha1(phi.tobytes())
+    if not no_ang_weighting:
+        for array in (dphi, theta, dtheta):
+            hasher.update(np.ravel(array).tobytes())
+    return (n_phi, bool(no_ang_weighting), phi.size, hasher.hexdigest())
+
+
+def erg_pgs_phi_spec_operator(phi, dphi, theta, dtheta, n_phi, no_ang_weighting=False, cache=True):
+    """
+    Builds the operator that averages the data bins into the phi bins of the
+    spectrogram, as a sparse [n_phi, n_data_bins] matrix
+
+    The matrix only depends on the bin geometry, so it is cached and reused
+    for all samples with identical phi/theta bins (e.g., the whole run for
+    the non-FAC phi spectrogram). Geometries that change with every sample
+    (the gyrophase of FAC data that are not regridded) should not be
+    cached, as they would only evict the operators used by the whole run.
+
+    Input:
+        phi, dphi, theta, dtheta: numpy.ndarray
+            Data bin centers and widths (deg), of any shape; the bins are
+            taken in flattened order
+
+        n_phi: int
+            Number of phi bins in the output
+
+    Parameters:
+        no_ang_weighting: bool
+            If True, each data bin whose center lies in a phi bin is given a
+            weight of 1; otherwise the weight is the solid angle of the
+            overlap between the data bin and the phi bin
+
+        cache: bool
+            If False, the operator is neither looked up in nor added to the
+            cache
+
+    Returns:
+        scipy.sparse.csr_matrix of the (unnormalized) weights
+    """
+
+    phi = np.ravel(phi)
+    if cache:
+        key = _operator_key(phi, dphi, theta, dtheta, n_phi, no_ang_weighting)
+        if key in _operator_cache:
+            return _operator_cache[key]
+
+    # form grid specifying the spectrogram's phi bins
+    phi_grid = np.linspace(0, 360.0, n_phi+1)
+    lower = phi_grid[:-1, np.newaxis]
+    upper = phi_grid[1:, np.newaxis]
+
+    if no_ang_weighting:
+        weight = ((phi > lower) & (phi < upper)).astype(np.float64)
+    else:
+        dr = math.pi/180.
+        phi_grid_width = np.nanmedian(phi_grid - shift(phi_grid, 1))
+        dphi = np.ravel(dphi)
+        theta = np.ravel(theta)
+        dtheta = np.ravel(dtheta)
+
+        # get min/max of all data bins
+        # keep phi in [0, 360]
+        phi_min = (phi - 0.5*dphi)
+        phi_max = (phi + 0.5*dphi) % 360.0
+
+        # algorithm below assumes maximums at 360 not wrapped to 0
+        phi_max[phi_max == 0] = 360.0
+
+        # keep phi in [0, 360]
+        phi_min[phi_min < 0] = phi_min[phi_min < 0] + 360
+
+        # keep track of bins that span phi=0
+        wrapped = phi_min > phi_max
+
+        # When averaging data bins will be weighted by the solid angle of their overlap,
+        # with the given spectrogram bin.  Since each spectrogram bin spans all theta
+        # values the theta portion of that calculation can be done in advance.  These
+        # values will later be multiplied by the overlap along phi to get the total
+        # solid angle.
+        omega_part = np.abs(np.sin(dr * (theta + .5*dtheta)) - np.sin(dr * (theta - .5*dtheta)))
+
+        # data bins whose maximum/minimum overlaps each spectrogram bin
+        in_max = (phi_max > lower) & (phi_max < upper)
+        in_min = (phi_min > lower) & (phi_min < upper)
+
+        # data bins that completely cover each spectrogram bin
+        in_all = ((phi_min <= lower) & (phi_max >= upper)) |\
+                 (wrapped & ((phi_min > upper) & (phi_max > upper))) |\
+                 (wrapped & ((phi_min < lower) & (phi_max < lower)))
+
+        # later assignments take precedence
+        weight = np.zeros(in_max.shape)
+        weight = np.where(in_max, (phi_max - lower) * omega_part, weight)
+        weight = np.where(in_min, (upper - phi_min) * omega_part, weight)
+        weight = np.where(in_max & in_min, dphi * omega_part, weight)
+        weight = np.where(in_all, phi_grid_width * omega_part, weight)
+
+        # bins with undefined geometry don't contribute
+        weight[~np.isfinite(weight)] = 0.
+
+    operator = sparse.csr_matrix(weight)
+
+    if cache:
+        if len(_operator_cache) >= _operator_cache_size:
+            del _operator_cache[next(iter(_operator_cache))]
+        _operator_cache[key] = operator
+
+    return operator
+
+
+def erg_pgs_apply_phi_spec_operator(operator, data, bins, no_ang_weighting=False):
+    """
+    Applies an operator from erg_pgs_phi_spec_operator() to a block of samples
+
+    Input:
+        operator: scipy.sparse.csr_matrix
+            [n_phi, n_data_bins] weights
+
+        data: numpy.ndarray
+            [time, n_data_bins] data values
+
+        bins: numpy.ndarray
+            [time, n_data_bins] flags marking the active bins
+
+    Returns:
+        [time, n_phi] weighted averages; 0 where no active bin contributes
+    """
+
+    valid = np.isfinite(data) & (bins != 0)
+    total = (operator @ np.where(valid, data, 0.).T).T
+
+    if no_ang_weighting:
+        norm = (operator @ valid.T.astype(np.float64)).T
+    else:
+        # normalize weighting to selected, active bins
+        norm = (operator @ (bins.T != 0).astype(np.float64)).T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ave = np.where(norm > 0, total / norm, 0.)
+
+    return ave
+
+
+def erg_pgs_make_phi_spec(data_in, resolution=None, no_ang_weighting=False, cache=True):
     """
     Builds phi (longitudinal) spectrogram from the particle data structure
 
     Input:
-        data_in: dict
+        data_in: dict or ParticleDist
             Particle data structure
 
     Parameters:
         resolution: int
             Number of phi bins in the output
 
+        cache: bool
+            Passed to erg_pgs_phi_spec_operator(); False for bin geometries
+            that change with every sample
+
     Returns:
         Tuple containing: (phi values for y-axis, spectrogram values)
     """
 
-    dr = math.pi/180.
+    # get number of phi values
+    if resolution is None:
+        # method taken from the IDL code
+        idx = np.nanargmin(np.abs((data_in['theta'][0, :])))
+        n_phi = len(np.argwhere(data_in['theta'][0, :] == np.abs((data_in['theta'][0, :]))[idx]))
+    else:
+        n_phi = resolution
 
-    data = deepcopy(data_in)
+    # form grid specifying the spectrogram's phi bins
+    phi_grid = np.linspace(0, 360.0, n_phi+1)
 
-    # zero inactive bins to ensure areas with no data are represented as NaN
-    data['data'] = np.where(data['bins'] == 0,0.,data['data'])
+    # Each phi bin of the spectrogram is the average of the data bins overlapping it,
+    # weighted by the solid angle of their intersection.
+    operator = erg_pgs_phi_spec_operator(data_in['phi'], data_in['dphi'], data_in['theta'], data_in['dtheta'],
+                                         n_phi, no_ang_weighting=no_ang_weighting, cache=cache)
+    ave = erg_pgs_apply_phi_spec_operator(operator, np.ravel(data_in['data'])[np.newaxis, :],
+                                          np.ravel(data_in['bins'])[np.newaxis, :],
+                                          no_ang_weighting=no_ang_weighting)[0]
+
+    # get y axis
+    y = (phi_grid+shift(phi_grid, 1))/2.0
+    y = y[1:]
+
+    return (y, ave)
+
+
+def erg_pgs_make_phi_spec_batch(data_in, resolution=None, no_ang_weighting=False, cache=True):
+    """
+    Builds phi (longitudinal) spectrograms for a block of samples at once.
+    The bin overlaps and weights are the same as in erg_pgs_make_phi_spec(),
+    but evaluated over the whole [time, energy, angle] block.
+
+    Input:
+        data_in: dict
+            Batched particle data structure from erg_pgs_clean_data_batch()
+
+    Parameters:
+        resolution: int
+            Number of phi bins in the output
+
+        cache: bool
+            Passed to erg_pgs_phi_spec_operator(); samples of the block
+            with the same bin geometry share one operator either way
+
+    Returns:
+        Tuple containing: (phi values for y-axis, spectrogram values),
+        both shaped [time, resolution]
+    """
+
+    n_times = data_in['data'].shape[0]
 
     # get number of phi values
     if resolution is None:
         # method taken from the IDL code
-        idx = np.nanargmin(np.abs((data['theta'][0, :])))
-        n_phi = len(np.argwhere(data['theta'][0, :] == np.abs((data['theta'][0, :]))[idx]))
+        theta_0 = data_in['theta'][0, 0, :]
+        idx = np.nanargmin(np.abs(theta_0))
+        n_phi = len(np.argwhere(theta_0 == np.abs(theta_0)[idx]))
     else:
         n_phi = resolution
 
-    # init this sample's piece of the spectrogram
-    ave = np.zeros(n_phi)
+    ave = np.zeros((n_times, n_phi))
 
     # form grid specifying the spectrogram's phi bins
     phi_grid = np.linspace(0, 360.0, n_phi+1)
-    phi_grid_width = np.nanmedian(phi_grid - shift(phi_grid, 1))
-
-    # get min/max of all data bins
-    # keep phi in [0, 360]
-    phi_min = (data['phi'] - 0.5*data['dphi']) 
-    phi_max = (data['phi'] + 0.5*data['dphi']) % 360.0
-    phi_array = deepcopy(data['phi'])
-
-    # algorithm below assumes maximums at 360 not wrapped to 0
-    phi_max[phi_max == 0] = 360.0
-
-    # keep phi in [0, 360]
-    phi_min[phi_min < 0] = phi_min[phi_min < 0] + 360
-
-    # keep track of bins that span phi=0
-    wrapped = phi_min > phi_max
-
-    # When averaging data bins will be weighted by the solid angle of their overlap,
-    # with the given spectrogram bin.  Since each spectrogram bin spans all theta 
-    # values the theta portion of that calculation can be done in advance.  These
-    # values will later be multiplied by the overlap along phi to get the total 
-    # solid angle. 
-    omega_part = np.abs(np.sin(dr * (data['theta'] + .5*data['dtheta'])) - np.sin(dr * (data['theta'] - .5*data['dtheta'])))
-
-    omega_part_flat = omega_part.flatten(order='F')
-    phi_max_flat = phi_max.flatten(order='F')
-    phi_min_flat = phi_min.flatten(order='F')
-    wrapped_flat = wrapped.flatten(order='F')
-    data_flat = data['data'].flatten(order='F')
-    bins_flat = data['bins'].flatten(order='F')
-    dphi_flat = data['dphi'].flatten(order='F')
-
-    # Loop over each phi bin in the spectrogram and determine which data bins
-    # overlap.  All overlapping bins will be weighted according to the solid 
-    # angle of their intersection and averaged.
-    for i in range(0, n_phi):
-
-        if not no_ang_weighting:
-            weight = np.zeros(phi_min_flat.shape)
-
-            # data bins whose maximum overlaps the current spectrogram bin
-            idx_max = np.argwhere((phi_max_flat > phi_grid[i]) & (phi_max_flat < phi_grid[i+1]))
-            if idx_max.size != 0:
-                weight[idx_max] = (phi_max_flat[idx_max] - phi_grid[i]) * omega_part_flat[idx_max]
-
-            # data bins whose minimum overlaps the current spectrogram bin
-            idx_min = np.argwhere((phi_min_flat > phi_grid[i]) & (phi_min_flat < phi_grid[i+1]))
-            if idx_min.size != 0:
-                weight[idx_min] = (phi_grid[i+1] - phi_min_flat[idx_min]) * omega_part_flat[idx_min]
-
-            # data bins contained within the current spectrogram bin
-            contained = np.intersect1d(idx_max, idx_min)
-            if contained.size != 0:
-                weight[contained] = dphi_flat[contained] * omega_part_flat[contained]
-            
-            # data bins that completely cover the current spectrogram bin 
-            idx_all = np.argwhere(((phi_min_flat <= phi_grid[i]) & (phi_max_flat >= phi_grid[i+1])) |
-                                (wrapped_flat & ((phi_min_flat > phi_grid[i+1]) & (phi_max_flat > phi_grid[i+1]))) |
-                                (wrapped_flat & ((phi_min_flat < phi_grid[i]) & (phi_max_flat < phi_grid[i]))))
-            if idx_all.size != 0:
-                weight[idx_all] = phi_grid_width * omega_part_flat[idx_all]
-
-            # combine indices
-            idx = np.unique(np.concatenate((idx_min, idx_max, idx_all)))
-
-            # assign a weighted average to this bin
-            if idx_max.size + idx_min.size + idx_all.size > 0:
-                # normalize weighting to selected, active bins
-                weight[idx] = weight[idx] * bins_flat[idx]
-                weight = weight/nansum(weight)
-
-                # average
-                ave[i] = nansum(data_flat[idx]*weight[idx])
-
-        else: # ;;wighout weighting by dphi and dtheta
-            id_array = np.argwhere(np.isfinite(data['data'])\
-                     & (data['bins'] == 1)\
-                     & (phi_array > phi_grid[i])\
-                     & (phi_array < phi_grid[i+1]))
-
-            if len(id_array) > 0:
-                ave[i] = np.nanmean(data['data'][id_array[:, 0].tolist(), id_array[:, 1].tolist()])
 
+    data = data_in['data'].reshape(n_times, -1)
+    bins = data_in['bins'].reshape(n_times, -1)
+
+    # samples sharing the same bin geometry are averaged with one operator
+    geometry = [data_in[key] for key in ['phi', 'dphi', 'theta', 'dtheta']]
+    groups = {}
+    for index in range(n_times):
+        key = _operator_key(*[array[index] for array in geometry], n_phi, no_ang_weighting)
+        groups.setdefault(key, []).append(index)
+
+    for indices in groups.values():
+        operator = erg_pgs_phi_spec_operator(*[array[indices[0]] for array in geometry], n_phi,
+                                             no_ang_weighting=no_ang_weighting, cache=cache)
+        ave[indices] = erg_pgs_apply_phi_spec_operator(operator, data[indices], bins[indices],
+                                                       no_ang_weighting=no_ang_weighting)
 
     # get y axis
     y = (phi_grid+shift(phi_grid, 1))/2.0
-    y = y[1:]
+    y = np.tile(y[1:], (n_times, 1))
 
     return (y, ave)
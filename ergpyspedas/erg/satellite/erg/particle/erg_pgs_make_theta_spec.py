@@ -2,7 +2,6 @@
 import math
 import numpy as np
 from scipy.ndimage.interpolation import shift
-from copy import deepcopy
 
 # use nansum from bottleneck if it's installed, otherwise use the numpy one
 try:
@@ -11,38 +10,51 @@ try:
 except ImportError:
     nansum = np.nansum
 
-def erg_pgs_make_theta_spec(data_in, resolution=None, colatitude=False, no_ang_weighting=False):
+def erg_pgs_theta_spec_kernel(theta, dtheta, dphi, data, bins, n_theta,
+                              colatitude=False, no_ang_weighting=False):
     """
-    Builds theta (latitudinal) spectrogram from simplified particle data structure.
+    Builds theta (or pitch angle) spectrograms for a stack of samples in one
+    call. Used by erg_pgs_make_theta_spec() and erg_pgs_make_theta_spec_batch().
 
     Input:
-        data_in: dict
-            Particle data structure
+        theta, dtheta, dphi: numpy.ndarray
+            Data bin centers and widths (deg), shaped [time, energy, angle]
 
-    Parameters:
-        resolution: int
+        data: numpy.ndarray
+            Data values, shaped [time, energy, angle]
+
+        bins: numpy.ndarray
+            Flags marking the active bins, shaped [time, energy, angle]
+
+        n_theta: int
             Number of theta points to include in the output
 
+    Parameters:
         colatitude: bool
             Flag to specify that data is in co-latitude (0, 180); if this is
             set to False (default), the data are assumed to be (-90, 90)
 
-    Returns:
-        Tuple containing: (theta values for y-axis, spectrogram values)
+        no_ang_weighting: bool
+            If True, the data bins whose centers lie in each theta bin are
+            simply averaged; otherwise they are weighted by the solid angle of
+            their overlap with the theta bin
 
+    Returns:
+        Tuple containing: (theta values for y-axis, spectrogram values
+        shaped [time, n_theta])
     """
 
     dr = math.pi/180.
 
-    data = deepcopy(data_in)
+    n_times = np.shape(data)[0]
+    theta = np.reshape(theta, (n_times, -1))
+    dtheta = np.reshape(dtheta, (n_times, -1))
+    dphi = np.reshape(dphi, (n_times, -1))
+    bins = np.reshape(bins, (n_times, -1))
 
     # zero inactive bins to ensure areas with no data are represented as NaN
-    data['data'] = np.where(data['bins'] == 0,np.nan,data['data'])
-    # get number of theta values
-    if resolution is None:
-        n_theta = len(np.unique(data['theta']))
-    else:
-        n_theta = resolution
+    data = np.where(bins == 0, np.nan, np.reshape(data, (n_times, -1)))
+    finite = np.isfinite(data)
 
     if colatitude:
         theta_range = [0, 180]
@@ -50,63 +62,52 @@ def erg_pgs_make_theta_spec(data_in, resolution=None, colatitude=False, no_ang_w
         theta_range = [-90, 90]
 
     theta_grid = np.linspace(theta_range[0], theta_range[1], n_theta+1)
+    sin_grid = np.sin(dr * theta_grid)
 
-    # init this sample's piece of the spectrogram
-    ave = np.zeros(n_theta)
+    ave = np.zeros((n_times, n_theta))
 
-    theta_min = data['theta'] - 0.5*data['dtheta']
-    theta_max = data['theta'] + 0.5*data['dtheta']
-    theta_array = deepcopy(data['theta'])
+    theta_min = theta - 0.5*dtheta
+    theta_max = theta + 0.5*dtheta
+    sin_min = np.sin(dr * theta_min)
+    sin_max = np.sin(dr * theta_max)
 
-    # loop over output grid to sum all active data and bin flags
+    # loop over output grid; every sample in the stack is handled at once
     for i in range(0, n_theta):
-       
+
         if not no_ang_weighting:
-           
-            weight = np.zeros(theta_min.shape)
 
-            # data bins whose maximum overlaps the current spectrogram bin
-            idx_max = np.argwhere((theta_max > theta_grid[i]) & (theta_max < theta_grid[i+1]))
-            if idx_max.size != 0:
-                weight[idx_max[:, 0].tolist(), idx_max[:, 1].tolist()] = (np.sin(dr * theta_max[idx_max[:, 0].tolist(), idx_max[:, 1].tolist()]) - np.sin(dr * theta_grid[i])) * data['dphi'][idx_max[:, 0].tolist(), idx_max[:, 1].tolist()]
+            # data bins whose maximum/minimum overlaps the current spectrogram bin
+            in_max = (theta_max > theta_grid[i]) & (theta_max < theta_grid[i+1])
+            in_min = (theta_min > theta_grid[i]) & (theta_min < theta_grid[i+1])
 
-            # data bins whose minimum overlaps the current spectrogram bin
-            idx_min = np.argwhere((theta_min > theta_grid[i]) & (theta_min < theta_grid[i+1]))
-            if idx_min.size != 0:
-                weight[idx_min[:, 0].tolist(), idx_min[:, 1].tolist()] = (np.sin(dr * theta_grid[i+1]) - np.sin(dr * theta_min[idx_min[:, 0].tolist(), idx_min[:, 1].tolist()])) * data['dphi'][idx_min[:, 0].tolist(), idx_min[:, 1].tolist()]
+            # data bins that completely cover the current spectrogram bin
+            in_all = (theta_min <= theta_grid[i]) & (theta_max >= theta_grid[i+1])
 
-            # data bins contained within the current spectrogram bin
-            max_set = set([tuple(m) for m in idx_max])
-            min_set = set([tuple(m) for m in idx_min])
-            contained = np.array([m for m in max_set & min_set])
-            if contained.size != 0:
-                weight[contained[:, 0].tolist(), contained[:, 1].tolist()] = (np.sin(dr * theta_max[contained[:, 0].tolist(), contained[:, 1].tolist()]) - np.sin(dr * theta_min[contained[:, 0].tolist(), contained[:, 1].tolist()])) * data['dphi'][contained[:, 0].tolist(), contained[:, 1].tolist()]
+            # later assignments take precedence; bins contained within the
+            # current spectrogram bin get their full width
+            weight = np.zeros(theta_min.shape)
+            weight = np.where(in_max, (sin_max - sin_grid[i]) * dphi, weight)
+            weight = np.where(in_min, (sin_grid[i+1] - sin_min) * dphi, weight)
+            weight = np.where(in_max & in_min, (sin_max - sin_min) * dphi, weight)
+            weight = np.where(in_all, (sin_grid[i+1] - sin_grid[i]) * dphi, weight)
 
-            # data bins that completely cover the current spectrogram bin
-            idx_all = np.argwhere((theta_min <= theta_grid[i]) & (theta_max >= theta_grid[i+1]))
-            if idx_all.size != 0:
-                weight[idx_all[:, 0].tolist(), idx_all[:, 1].tolist()] = (np.sin(dr * theta_grid[i+1]) - np.sin(dr * theta_grid[i])) * data['dphi'][idx_all[:, 0].tolist(), idx_all[:, 1].tolist()]
-
-            # combine indices
-            idx = np.concatenate((idx_min, idx_max, idx_all))
-
-            if idx_max.size + idx_min.size + idx_all.size > 0:
-                # normalize weighting to selected, active bins
-                weight[idx[:, 0].tolist(), idx[:, 1].tolist()] = weight[idx[:, 0].tolist(), idx[:, 1].tolist()] * data['bins'][idx[:, 0].tolist(), idx[:, 1].tolist()]\
-                                                                * np.isfinite(data['data'][idx[:, 0].tolist(), idx[:, 1].tolist()])
-                weight = weight/nansum(weight)
-
-                # average
-                ave[i] = nansum(data['data'][idx[:, 0].tolist(), idx[:, 1].tolist()]*weight[idx[:, 0].tolist(), idx[:, 1].tolist()])
-       
-        else: # ;;without weighting by dtheta and dphi
-            id_array = np.argwhere(np.isfinite(data['data'])\
-                     & (data['bins'] == 1)\
-                     & (theta_array > theta_grid[i])\
-                     & (theta_array < theta_grid[i+1]))
+            # normalize weighting to selected, active bins
+            weight = weight * bins * finite
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weight = weight / nansum(weight, axis=1)[:, np.newaxis]
 
-            if len(id_array) > 0:
-                ave[i] = np.nanmean(data['data'][id_array[:, 0].tolist(), id_array[:, 1].tolist()])
+            # Contained bins are selected by both the minimum and the maximum
+            # test, and are counted once per test in the average.
+            n_listed = in_min.astype(int) + in_max.astype(int) + in_all.astype(int)
+            ave[:, i] = nansum(data * weight * n_listed, axis=1)
+
+        else: # ;;without weighting by dtheta and dphi
+            in_bin = finite & (bins == 1)\
+                     & (theta > theta_grid[i])\
+                     & (theta < theta_grid[i+1])
+            n_in_bin = in_bin.sum(axis=1)
+            total = np.where(in_bin, data, 0.).sum(axis=1)
+            ave[:, i] = np.where(n_in_bin > 0, total / np.maximum(n_in_bin, 1), 0.)
 
     # get y axis
     y = (theta_grid+shift(theta_grid, 1))/2.0
@@ -114,3 +115,76 @@ def erg_pgs_make_theta_spec(data_in, resolution=None, colatitude=False, no_ang_w
 
     return (y, ave)
 
+
+def erg_pgs_make_theta_spec(data_in, resolution=None, colatitude=False, no_ang_weighting=False):
+    """
+    Builds theta (latitudinal) spectrogram from simplified particle data structure.
+
+    Input:
+        data_in: dict or ParticleDist
+            Particle data structure
+
+    Parameters:
+        resolution: int
+            Number of theta points to include in the output
+
+        colatitude: bool
+            Flag to specify that data is in co-latitude (0, 180); if this is
+            set to False (default), the data are assumed to be (-90, 90)
+
+    Returns:
+        Tuple containing: (theta values for y-axis, spectrogram values)
+
+    """
+
+    # get number of theta values
+    if resolution is None:
+        n_theta = len(np.unique(data_in['theta']))
+    else:
+        n_theta = resolution
+
+    y, ave = erg_pgs_theta_spec_kernel(data_in['theta'][np.newaxis], data_in['dtheta'][np.newaxis],
+                                       data_in['dphi'][np.newaxis], data_in['data'][np.newaxis],
+                                       data_in['bins'][np.newaxis], n_theta,
+                                       colatitude=colatitude, no_ang_weighting=no_ang_weighting)
+
+    return (y, ave[0])
+
+
+def erg_pgs_make_theta_spec_batch(data_in, resolution=None, colatitude=False, no_ang_weighting=False):
+    """
+    Builds theta (latitudinal) spectrograms for a block of samples at once.
+    The bin overlaps and weights are the same as in erg_pgs_make_theta_spec(),
+    but evaluated over the whole [time, energy, angle] block.
+
+    Input:
+        data_in: dict
+            Batched particle data structure from erg_pgs_clean_data_batch()
+
+    Parameters:
+        resolution: int
+            Number of theta points to include in the output
+
+        colatitude: bool
+            Flag to specify that data is in co-latitude (0, 180); if this is
+            set to False (default), the data are assumed to be (-90, 90)
+
+    Returns:
+        Tuple containing: (theta values for y-axis, spectrogram values),
+        both shaped [time, resolution]
+
+    """
+
+    n_times = data_in['data'].shape[0]
+
+    # get number of theta values
+    if resolution is None:
+        n_theta = len(np.unique(data_in['theta']))
+    else:
+        n_theta = resolution
+
+    y, ave = erg_pgs_theta_spec_kernel(data_in['theta'], data_in['dtheta'], data_in['dphi'],
+                                       data_in['data'], data_in['bins'], n_theta,
+                                       colatitude=colatitude, no_ang_weighting=no_ang_weighting)
+
+    return (np.tile(y, (n_times, 1)), ave)
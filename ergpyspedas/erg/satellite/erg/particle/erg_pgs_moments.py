@@ -0,0 +1,146 @@
+import hashlib
+
+import numpy as np
+from pyspedas.particles.moments.moments_3d_omega_weights import moments_3d_omega_weights
+
+# angular integration weights keyed on the bin geometry of a sample
+_omega_cache = {}
+_omega_cache_size = 16
+
+
+def _omega_weights(theta, phi, dtheta, dphi):
+    """
+    Returns the first 10 moments_3d() angular weights, [10, energy, angle],
+    for the bin geometry of a single sample
+    """
+
+    key = hashlib.sha1(b''.join(np.ascontiguousarray(value).tobytes()
+                                for value in (theta, phi, dtheta, dphi))).hexdigest()
+    if key in _omega_cache:
+        return _omega_cache[key]
+
+    omega = moments_3d_omega_weights(theta, phi, dtheta, dphi)[0:10]
+
+    if len(_omega_cache) >= _omega_cache_size:
+        del _omega_cache[next(iter(_omega_cache))]
+    _omega_cache[key] = omega
+
+    return omega
+
+
+def erg_pgs_moments_input(data_in):
+    """
+    Returns the particle data structure passed to the moment calculations,
+    with the data of inactive bins set to 0. The data are promoted to
+    float64 so that the moments of float32 data are accumulated in double
+    precision.
+
+    Input:
+        data_in: dict
+            Particle data structure in eflux
+
+    Returns:
+        Dict sharing all the members but 'data' with data_in
+    """
+
+    data_out = dict(data_in)
+    data_out['data'] = np.where(data_in['bins'] == 0, 0.,
+                                np.asarray(data_in['data'], dtype=np.float64))
+
+    return data_out
+
+
+def erg_pgs_moments(data_in, sc_pot=0.):
+    """
+    Calculates plasma moments for a block of samples at once, with the same
+    definitions as spd_pgs_moments() (moments_3d)
+
+    The angular weights are computed once per bin geometry and the
+    integrals are array reductions over the energy and angle dimensions.
+
+    Input:
+        data_in: dict
+            Batched particle data structure in eflux, with [time, energy,
+            angle] arrays as made by erg_pgs_clean_data_batch(). 'magf' is
+            either [time, 3] or a single [3] vector.
+
+    Parameters:
+        sc_pot: float
+            Spacecraft potential
+
+    Returns:
+        Dict of [time, ...] arrays:
+            'density', 'flux', 'mftens', 'velocity', 'ptens', 'ttens',
+            'vthermal', 'avgtemp', 'magt3'
+    """
+
+    charge = data_in['charge']
+    mass = data_in['mass']
+
+    data = erg_pgs_moments_input(data_in)['data']
+    n_times = data.shape[0]
+
+    energy = np.where(data_in['energy'] <= 0.0, 0.1, data_in['energy'])
+    de_e = data_in['denergy']/energy
+
+    e_inf = np.maximum(energy + charge*sc_pot, 0.0)
+
+    weight = np.clip((energy + charge*sc_pot)/data_in['denergy'] + 0.5, 0.0, 1.0)
+
+    # energy integrands of density, flux and momentum flux
+    data_de = data*de_e*weight/energy
+    dens_de = np.sqrt(mass/2.0)*1e-5*data_de*np.sqrt(e_inf)
+    flux_de = data_de*e_inf
+    vf_de = data_de*e_inf**1.5
+
+    density = np.zeros(n_times)
+    flux = np.zeros((n_times, 3))
+    vftens = np.zeros((n_times, 6))
+
+    # samples sharing the same bin geometry share their angular weights
+    groups = {}
+    for index in range(n_times):
+        omega = _omega_weights(data_in['theta'][index], data_in['phi'][index],
+                               data_in['dtheta'][index], data_in['dphi'][index])
+        groups.setdefault(id(omega), (omega, []))[1].append(index)
+
+    for omega, indices in groups.values():
+        density[indices] = np.nansum(dens_de[indices]*omega[0], axis=(1, 2))
+        for i in range(3):
+            flux[indices, i] = np.nansum(flux_de[indices]*omega[1 + i], axis=(1, 2))
+        for i in range(6):
+            vftens[indices, i] = np.nansum(vf_de[indices]*omega[4 + i], axis=(1, 2))
+
+    vftens = vftens*np.sqrt(2.0/mass)*1e5
+    mftens = vftens*mass/1e10
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity = flux/density[:, np.newaxis]/1e5  # km/s
+
+        mf3x3 = mftens[:, [[0, 3, 4], [3, 1, 5], [4, 5, 2]]]
+        pt3x3 = mf3x3 - velocity[:, :, np.newaxis]*flux[:, np.newaxis, :]*mass/1e5
+        ptens = pt3x3.reshape(n_times, 9)[:, [0, 4, 8, 1, 2, 5]]
+
+        t3x3 = pt3x3/density[:, np.newaxis, np.newaxis]
+        avgtemp = np.trace(t3x3, axis1=1, axis2=2)/3.0
+
+        vthermal = np.sqrt(2.0*avgtemp/mass)
+
+        # temperature tensor diagonal in the frame of magf and velocity
+        magf = np.broadcast_to(data_in['magf'], (n_times, 3))
+        a = magf/np.linalg.norm(magf, axis=1)[:, np.newaxis]
+        b = np.cross(a, velocity)
+        b = b/np.linalg.norm(b, axis=1)[:, np.newaxis]
+        c = np.cross(b, a)
+        rot = np.stack((c, b, a), axis=-1)
+        magt3 = np.einsum('tji,tjk,tki->ti', rot, t3x3, rot)
+
+    return {'density': density,
+            'flux': flux,
+            'mftens': mftens,
+            'velocity': velocity,
+            'ptens': ptens,
+            'ttens': t3x3,
+            'vthermal': vthermal,
+            'avgtemp': avgtemp,
+            'magt3': magt3}
@@ -0,0 +1,79 @@
+class ParticleDist(object):
+    """
+    Particle data structure of a single sample as used by the pgs pipeline
+    (erg_pgs_clean_data, erg_pgs_limit_range, erg_pgs_do_fac and the
+    spectrogram builders)
+
+    The members are the same as those of the dict returned by
+    erg_pgs_clean_data() and are accessed the same way (dist['bins'],
+    'theta' in dist, dist.keys(), dict(dist), ...), so routines written
+    for the dict, including the pyspedas ones, accept this object as well.
+
+    The structures of the pipeline share their arrays with one another and
+    with the data parsed by get_dist (which are read-only views); the
+    routines replace members (dist['bins'] = ...) rather than modifying
+    arrays in place, so a shared array is never changed.
+    """
+
+    __slots__ = ('dims', 'time', 'end_time', 'charge', 'mass', 'species',
+                 'magf', 'sc_pot', 'units_name', 'scaling', 'psd', 'data',
+                 'bins', 'energy', 'denergy', 'phi', 'dphi', 'theta',
+                 'dtheta', 'orig_energy')
+
+    _fields = __slots__
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def copy(self):
+        """
+        Returns a new structure sharing all the members with this one (as
+        erg_pgs_do_fac() makes through copy.copy())
+        """
+
+        out = ParticleDist.__new__(ParticleDist)
+        for key in self.keys():
+            setattr(out, key, getattr(self, key))
+
+        return out
+
+    __copy__ = copy
+
+    def keys(self):
+        return [key for key in self._fields if hasattr(self, key)]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self._fields else default
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return (key in self._fields) and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
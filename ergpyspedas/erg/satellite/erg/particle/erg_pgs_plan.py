@@ -0,0 +1,87 @@
+# stages of the per-sample pipeline of the part_products routines and the
+# stages each of them needs, in execution order
+_stage_deps = {
+    'clean': [],
+    'limit': ['clean'],
+    'energy': ['limit'],
+    'theta': ['limit'],
+    'phi': ['limit'],
+    'eflux': ['limit'],
+    'moments': ['eflux'],
+    'fac': ['limit'],
+    'regrid': ['fac'],
+    'fac_limit': ['fac'],
+    'pa': ['fac_limit'],
+    'pa_energy': ['fac_limit'],
+    'gyro': ['fac_limit'],
+    'fac_energy': ['fac_limit'],
+    'fac_eflux': ['fac_limit'],
+    'fac_moments': ['fac_eflux'],
+}
+
+# support data needed by the stages
+_stage_support = {
+    'moments': ['magf'],
+    'fac': ['fac_matrix'],
+    'fac_moments': ['magf'],
+}
+
+
+def erg_pgs_plan(outputs, regrid=False):
+    """
+    Works out which stages of the part_products pipeline are needed for
+    the requested outputs
+
+    Input:
+        outputs: list of str
+            Requested outputs ('energy', 'theta', 'phi', 'pa', 'gyro',
+            'pa_energy', 'moments', 'fac_energy', 'fac_moments'); unknown names are
+            ignored
+
+    Parameters:
+        regrid: bool
+            Whether the FAC data are interpolated onto a regular grid
+
+    Returns:
+        dict:
+            'outputs': the requested outputs the pipeline produces
+            'stages': the stages to run, in execution order
+            'graph': {stage: [stages it needs]} for the stages to run
+            'support': support data to prepare ('magf', 'fac_matrix')
+            'share_eflux': True if the FAC moments reuse the eflux data
+                converted for the moments, which is the case unless the
+                FAC data are regridded
+    """
+
+    outputs = [output for output in outputs if output in _stage_deps]
+
+    graph = {}
+    if regrid:
+        deps = dict(_stage_deps, fac_limit=['regrid'])
+    else:
+        deps = dict(_stage_deps, fac_eflux=['fac_limit', 'eflux'])
+
+    def add(stage):
+        if stage in graph:
+            return
+        graph[stage] = deps[stage]
+        for dep in deps[stage]:
+            add(dep)
+
+    add('limit')
+    for output in outputs:
+        add(output)
+
+    stages = [stage for stage in _stage_deps if stage in graph]
+
+    support = []
+    for stage in stages:
+        for name in _stage_support.get(stage, []):
+            if name not in support:
+                support.append(name)
+
+    return {'outputs': outputs,
+            'stages': stages,
+            'graph': {stage: graph[stage] for stage in stages},
+            'support': support,
+            'share_eflux': 'eflux' in graph.get('fac_eflux', [])}
@@ -0,0 +1,163 @@
+import contextlib
+import time
+import tracemalloc
+
+
+class PipelineProfile(object):
+    """
+    Per-stage profile of a part_products run
+
+    The run calls lap(stage) at the end of each pipeline stage (get_dist,
+    clean, limit, energy, fac, regrid, moments, ...); the time and memory
+    since the previous lap or mark are attributed to that stage. Code
+    outside the part_products routines can time a block with the stage()
+    context manager.
+
+    Parameters:
+        callback: function
+            Called as callback(stage, seconds, peak_bytes) after each stage
+
+        memory: bool
+            If True (default), the memory allocated by each stage is
+            tracked with tracemalloc, which slows the run down
+
+    Notes:
+        With n_workers > 1, the per-sample stages run in the worker
+        processes and are not recorded.
+    """
+
+    def __init__(self, callback=None, memory=True):
+        self.callback = callback
+        self.memory = memory
+        self.stages = {}
+        self._started_tracing = False
+        self._last_time = None
+        self._last_bytes = 0
+
+    def start(self):
+        """
+        Starts the profile; tracemalloc is started if memory is tracked and
+        it isn't tracing already
+        """
+
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.mark()
+
+    def mark(self):
+        """
+        Starts timing the next stage without attributing the time since the
+        last lap to any stage
+        """
+
+        if self.memory:
+            self._last_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._last_time = time.perf_counter()
+
+    def lap(self, stage):
+        """
+        Attributes the time and memory since the last lap or mark to stage
+        """
+
+        elapsed = time.perf_counter() - self._last_time
+        peak_bytes = 0
+        if self.memory:
+            peak_bytes = max(tracemalloc.get_traced_memory()[1] - self._last_bytes, 0)
+
+        record = self.stages.setdefault(stage, {'calls': 0, 'time': 0., 'peak_bytes': 0})
+        record['calls'] += 1
+        record['time'] += elapsed
+        record['peak_bytes'] = max(record['peak_bytes'], peak_bytes)
+
+        if self.callback is not None:
+            self.callback(stage, elapsed, peak_bytes)
+
+        self.mark()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager recording the enclosed block as stage name
+        """
+
+        self.mark()
+        yield self
+        self.lap(name)
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self):
+        """
+        Returns the profile as a dict:
+            'stages': {stage: {'calls': number of calls,
+                               'time': total wall time (s),
+                               'peak_bytes': largest memory allocated
+                                             within one call}}
+                      in the order the stages were first run
+            'total_time': sum of the stage times (s)
+        """
+
+        return {'stages': {stage: dict(record) for stage, record in self.stages.items()},
+                'total_time': sum(record['time'] for record in self.stages.values())}
+
+    def finish(self, out_vars):
+        """
+        Stops the profile and returns (out_vars, report()), the return value
+        of a profiled part_products run
+        """
+
+        self.stop()
+        return out_vars, self.report()
+
+
+class _NullProfile(object):
+    """
+    Profile that records nothing, used when profiling is off
+    """
+
+    def start(self):
+        pass
+
+    def mark(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def finish(self, out_vars):
+        return out_vars
+
+
+def erg_pgs_profile(profile=None):
+    """
+    Returns the profile object for the profile keyword of the part_products
+    routines
+
+    Input:
+        profile: None, bool, function or PipelineProfile
+            None or False: no profiling
+            True: a new PipelineProfile
+            function: a new PipelineProfile with the function as callback
+            PipelineProfile: used as is
+
+    Returns:
+        PipelineProfile, or an object with the same interface that records
+        nothing
+    """
+
+    if isinstance(profile, PipelineProfile):
+        return profile
+    if (profile is None) or (profile is False):
+        return _NullProfile()
+    if profile is True:
+        return PipelineProfile()
+    if callable(profile):
+        return PipelineProfile(callback=profile)
+
+    print('profile must be True, a callback function or a PipelineProfile; profiling is off')
+    return _NullProfile()
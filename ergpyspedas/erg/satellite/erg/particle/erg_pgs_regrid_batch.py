@@ -0,0 +1,130 @@
+import hashlib
+
+import numpy as np
+from scipy.spatial import KDTree
+
+# spatial indexes of the data bin look directions keyed on the bin geometry
+_tree_cache = {}
+_tree_cache_size = 16
+
+
+def _look_direction_trees(theta, phi):
+    """
+    Returns one spatial index per energy for the look directions of a single
+    sample ([energy, angle] arrays in deg), built once per bin geometry
+    """
+
+    key = hashlib.sha1(np.ascontiguousarray(theta).tobytes() + np.ascontiguousarray(phi).tobytes()).hexdigest()
+    if key in _tree_cache:
+        return _tree_cache[key]
+
+    dr = np.pi/180.0
+    trees = []
+    for i in range(theta.shape[0]):
+        valid = np.where(np.isfinite(theta[i]) & np.isfinite(phi[i]))[0]
+        if valid.size == 0:
+            trees.append(None)
+            continue
+        points = np.stack((np.cos(theta[i, valid]*dr)*np.cos(phi[i, valid]*dr),
+                           np.cos(theta[i, valid]*dr)*np.sin(phi[i, valid]*dr),
+                           np.sin(theta[i, valid]*dr)), axis=-1)
+        trees.append((KDTree(points), valid))
+
+    if len(_tree_cache) >= _tree_cache_size:
+        del _tree_cache[next(iter(_tree_cache))]
+    _tree_cache[key] = trees
+
+    return trees
+
+
+def erg_pgs_regrid_batch(data_in, mat, regrid_dimen):
+    """
+    Rotates a block of samples to field aligned coordinates and interpolates
+    them onto a regular FAC grid by nearest neighbor, like erg_pgs_do_fac()
+    followed by spd_pgs_regrid()
+
+    Rather than rotating the data bins of every sample and building a new
+    interpolator from them, the grid points are rotated back into the
+    instrument frame, where the nearest data bins are looked up in a spatial
+    index that is built once per bin geometry. Rotations preserve distances,
+    so the nearest neighbors are the same.
+
+    Input:
+        data_in: dict
+            Batched particle data structure ([time, energy, angle] arrays)
+            from erg_pgs_clean_data_batch(), in instrument coordinates
+
+        mat: numpy.ndarray
+            [time, 3, 3] field-aligned rotation matrices
+
+        regrid_dimen: list of int
+            [n_phi, n_theta] of the regular grid
+
+    Returns:
+        Batched particle data structure on the [time, energy, n_phi*n_theta]
+        grid, with theta/phi being the FAC latitude/gyrophase
+    """
+
+    n_times, n_energy = data_in['data'].shape[0:2]
+
+    n_phi_grid = int(regrid_dimen[0])
+    n_theta_grid = int(regrid_dimen[1])
+    n_bins_grid = n_phi_grid*n_theta_grid
+
+    d_phi_grid = 360.0/n_phi_grid
+    d_theta_grid = 180.0/n_theta_grid
+
+    # same grid as spd_pgs_regrid()
+    phi_angles = (np.arange(n_bins_grid) % n_phi_grid)*d_phi_grid+d_phi_grid/2.0
+    theta_angles = np.fix(np.arange(n_bins_grid)/n_phi_grid)*d_theta_grid+d_theta_grid/2.0 - 90
+
+    dr = np.pi/180.0
+    grid_cart = np.stack((np.cos(theta_angles*dr)*np.cos(phi_angles*dr),
+                          np.cos(theta_angles*dr)*np.sin(phi_angles*dr),
+                          np.sin(theta_angles*dr)), axis=-1)
+
+    # samples without a valid rotation (e.g. in magnetic field data gaps) are
+    # left empty, as the per-sample path does
+    finite_mat = np.all(np.isfinite(mat), axis=(1, 2))
+
+    # grid points in the instrument frame of each sample, [time, grid, 3]
+    grid_inst = np.full((n_times, n_bins_grid, 3), np.nan)
+    grid_inst[finite_mat] = np.einsum('tij,gj->tgi', np.linalg.inv(mat[finite_mat]), grid_cart)
+
+    data_grid = np.full((n_times, n_energy, n_bins_grid), np.nan, dtype=data_in['data'].dtype)
+    bins_grid = np.zeros((n_times, n_energy, n_bins_grid), dtype=data_in['bins'].dtype)
+
+    # samples sharing the same bin geometry share their spatial indexes
+    groups = {}
+    for index in np.where(finite_mat)[0]:
+        trees = _look_direction_trees(data_in['theta'][index], data_in['phi'][index])
+        groups.setdefault(id(trees), (trees, []))[1].append(index)
+
+    for trees, indices in groups.values():
+        for i in range(n_energy):
+            if trees[i] is None:
+                continue
+            tree, valid = trees[i]
+            nearest = valid[tree.query(grid_inst[indices])[1]]
+            data_grid[indices, i, :] = np.take_along_axis(data_in['data'][indices, i, :], nearest, axis=1)
+            bins_grid[indices, i, :] = np.take_along_axis(data_in['bins'][indices, i, :], nearest, axis=1)
+
+    data_out = {}
+    for key in ['time', 'end_time', 'charge', 'mass', 'species', 'magf', 'sc_pot', 'units_name', 'orig_energy']:
+        if key in data_in:
+            data_out[key] = data_in[key]
+
+    data_out['data'] = data_grid
+    data_out['scaling'] = data_grid
+    data_out['bins'] = bins_grid
+    data_out['phi'] = np.broadcast_to(phi_angles, data_grid.shape).copy()
+    data_out['theta'] = np.broadcast_to(theta_angles, data_grid.shape).copy()
+    data_out['dphi'] = np.full(data_grid.shape, d_phi_grid)
+    # spd_pgs_regrid() fills dtheta with the phi bin width as well
+    data_out['dtheta'] = np.full(data_grid.shape, d_phi_grid)
+
+    # assumes energies are constant across angle
+    data_out['energy'] = np.repeat(data_in['energy'][:, :, 0:1], n_bins_grid, axis=2)
+    data_out['denergy'] = np.repeat(data_in['denergy'][:, :, 0:1], n_bins_grid, axis=2)
+
+    return data_out
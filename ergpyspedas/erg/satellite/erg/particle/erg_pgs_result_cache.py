@@ -0,0 +1,259 @@
+import datetime
+import hashlib
+import json
+import os
+from importlib import metadata
+
+import numpy as np
+from pyspedas import get_data, store_data, options
+
+from ergpyspedas.erg.satellite.erg.config import CONFIG
+
+# parameters of the part_products routines that do not change the results
+_ignored_params = ['n_workers', 'chunk_size', 'plan_only', 'cache', 'profile']
+
+# version of the cache entries, part of the key with the package versions;
+# increase it when the layout of the entries or the products change, so
+# that entries written by older code are not restored
+_cache_format = 1
+
+# upper limit of the total size of the cache directory
+_cache_max_bytes = 2 * 1024**3
+
+
+def _cache_dir():
+    return os.path.join(CONFIG['local_data_dir'], 'pgs_cache')
+
+
+def _package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def erg_pgs_restore_tplot(name, values, metadata):
+    """
+    Stores a tplot variable from the values returned by get_data() and the
+    metadata returned by get_data(metadata=True), keeping the plot options
+
+    Input:
+        name: str
+            Name of the tplot variable
+
+        values: tuple of numpy.ndarray
+            (times, y), (times, y, v) or (times, y, v1, v2)
+
+        metadata: dict
+            Metadata including 'plot_options'
+    """
+
+    data = {'x': values[0], 'y': values[1]}
+    if len(values) > 3:
+        data['v1'] = values[2]
+        data['v2'] = values[3]
+    elif len(values) > 2:
+        data['v'] = values[2]
+    store_data(name, data=data, attr_dict=metadata)
+
+    # ;; store_data() resets the y range to that of the data
+    plot_options = metadata.get('plot_options', {})
+    for axis in ['y', 'z']:
+        axis_opt = plot_options.get(axis + 'axis_opt', {})
+        if axis_opt.get(axis + '_range_user'):
+            options(name, axis + 'range', axis_opt[axis + '_range'])
+
+
+def _json_value(value):
+    # ;; numpy values and times in the plot options, tagged so that
+    # ;; _json_object() restores their types
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist(), 'dtype': value.dtype.str}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f'{type(value).__name__} is not stored in the cache')
+
+
+def _json_object(value):
+    if '__ndarray__' in value:
+        return np.array(value['__ndarray__'], dtype=value['dtype'])
+    if '__datetime__' in value:
+        return datetime.datetime.fromisoformat(value['__datetime__'])
+    return value
+
+
+def erg_pgs_cache_key(routine, tvarnames, time_indices, params):
+    """
+    Returns the content-addressed key of a part_products run
+
+    The key is a hash of the cache format, the ergpyspedas and pyspedas
+    versions, the routine name, the data and CDF attributes of the tplot
+    variables the run reads, the time indices and the parameters, so it
+    changes whenever any of the inputs, or the code making the products,
+    changes.
+
+    Input:
+        routine: str
+            Name of the part_products routine
+
+        tvarnames: list of str
+            tplot variables read by the run (particle data, magnetic field,
+            position, attitude, ...); None and names of missing variables are hashed
+            by name only
+
+        time_indices: numpy.ndarray
+            Indices of the time samples processed
+
+        params: dict
+            Keyword arguments of the run
+
+    Returns:
+        str
+    """
+
+    key = hashlib.sha1()
+    key.update(repr((_cache_format, _package_version('ergpyspedas'),
+                     _package_version('pyspedas'))).encode())
+    key.update(routine.encode())
+
+    for tvarname in tvarnames:
+        key.update(repr(tvarname).encode())
+        if tvarname is None:
+            continue
+
+        data = get_data(tvarname)
+        if data is None:
+            continue
+        for value in data:
+            value = np.ascontiguousarray(value)
+            key.update(repr((value.dtype.str, value.shape)).encode())
+            key.update(value.view(np.uint8).reshape(-1))
+
+        metadata = get_data(tvarname, metadata=True)
+        key.update(repr(metadata.get('CDF')).encode())
+
+    key.update(np.ascontiguousarray(time_indices, dtype=np.int64).view(np.uint8))
+
+    params = {name: value for name, value in params.items()
+              if name not in _ignored_params}
+    key.update(repr(sorted(params.items())).encode())
+
+    return key.hexdigest()
+
+
+def erg_pgs_cache_load(key, cache_dir=None):
+    """
+    Restores the tplot variables cached under key
+
+    Input:
+        key: str
+            Key returned by erg_pgs_cache_key()
+
+    Parameters:
+        cache_dir: str
+            Cache directory; 'pgs_cache' in the ERG local data directory
+            by default
+
+    Returns:
+        List of the tplot variables restored, or None if nothing is cached
+        under key
+    """
+
+    if cache_dir is None:
+        cache_dir = _cache_dir()
+
+    file_name = os.path.join(cache_dir, key + '.npz')
+    if not os.path.isfile(file_name):
+        return None
+
+    try:
+        with np.load(file_name, allow_pickle=False) as cached:
+            meta = json.loads(cached['meta'].tobytes().decode(), object_hook=_json_object)
+            arrays = [[cached['%d_%d' % (i, j)] for j in range(n_values)]
+                      for i, n_values in enumerate(meta['n_values'])]
+    except Exception:
+        print('Cannot read the cached products in ' + file_name + ', recomputing')
+        return None
+
+    for name, values, attrs in zip(meta['names'], arrays, meta['attrs']):
+        erg_pgs_restore_tplot(name, values, attrs)
+
+    # ;; mark as recently used
+    os.utime(file_name)
+
+    return list(meta['names'])
+
+
+def erg_pgs_cache_save(key, tvarnames, cache_dir=None, max_bytes=None):
+    """
+    Saves tplot variables under key as compressed arrays and evicts the least
+    recently used entries if the cache grows beyond max_bytes
+
+    Input:
+        key: str
+            Key returned by erg_pgs_cache_key()
+
+        tvarnames: list of str
+            tplot variables created by the run
+
+    Parameters:
+        cache_dir: str
+            Cache directory; 'pgs_cache' in the ERG local data directory
+            by default
+
+        max_bytes: int
+            Upper limit of the total size of the cache directory (default: 2 GiB)
+    """
+
+    if cache_dir is None:
+        cache_dir = _cache_dir()
+    if max_bytes is None:
+        max_bytes = _cache_max_bytes
+
+    arrays = {}
+    meta = {'names': [], 'n_values': [], 'attrs': []}
+    for tvarname in tvarnames:
+        data = get_data(tvarname)
+        if data is None:
+            continue
+        for j, value in enumerate(data):
+            arrays['%d_%d' % (len(meta['names']), j)] = np.asarray(value)
+        meta['names'].append(tvarname)
+        meta['n_values'].append(len(data))
+        metadata = get_data(tvarname, metadata=True)
+        meta['attrs'].append({'plot_options': metadata['plot_options']})
+
+    #  ;; the metadata are stored as JSON text, never as pickles, so that
+    #  ;; reading an entry cannot run code
+    try:
+        meta_text = json.dumps(meta, default=_json_value)
+    except (TypeError, ValueError) as error:
+        print('Cannot cache the products: ' + str(error))
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    file_name = os.path.join(cache_dir, key + '.npz')
+
+    # ;; write to a temporary file first so that a partial entry is never read
+    temp_name = file_name + '.%d.tmp' % os.getpid()
+    with open(temp_name, 'wb') as file:
+        np.savez_compressed(file, meta=np.frombuffer(meta_text.encode(), dtype=np.uint8), **arrays)
+    os.replace(temp_name, file_name)
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path == file_name:
+            continue
+        os.remove(path)
+        total -= size
@@ -0,0 +1,71 @@
+import math
+import multiprocessing
+
+# function run by the pool workers; set by erg_pgs_run_parallel() before
+# the workers are forked so that it doesn't have to be pickled
+_process_samples = None
+
+
+def _run_chunk(bounds):
+    return _process_samples(bounds[0], bounds[1])
+
+
+def erg_pgs_run_parallel(process_samples, out_arrays, n_samples, n_workers=1, chunk_size=None):
+    """
+    Runs the per-sample loop of the part_products routines, optionally split
+    into chunks of samples processed by a pool of worker processes
+
+    The workers are started with the 'fork' method, so the input data (tplot
+    variables, parsed distributions, FAC matrices, etc.) are shared with the
+    parent process instead of being copied to each worker.
+
+    Input:
+        process_samples: function
+            process_samples(start, stop) fills the output arrays for samples
+            start through stop-1 and returns those slices in a dict keyed like
+            out_arrays
+
+        out_arrays: dict
+            Output arrays, with time as the first dimension
+
+        n_samples: int
+            Total number of samples
+
+    Parameters:
+        n_workers: int
+            Number of worker processes; the loop is run in this process if
+            n_workers is 1 or less
+
+        chunk_size: int
+            Number of samples per chunk; by default the samples are split
+            into 4 chunks per worker
+
+    Returns:
+        None; out_arrays are filled in place
+    """
+
+    global _process_samples
+
+    if (n_workers is None) or (n_workers <= 1) or (n_samples < 2):
+        process_samples(0, n_samples)
+        return
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print('Parallel processing requires the fork start method; running in a single process.')
+        process_samples(0, n_samples)
+        return
+
+    if chunk_size is None:
+        chunk_size = int(math.ceil(n_samples / (4. * n_workers)))
+
+    chunks = [(start, min(start + chunk_size, n_samples))
+              for start in range(0, n_samples, chunk_size)]
+
+    _process_samples = process_samples
+    try:
+        with multiprocessing.get_context('fork').Pool(processes=min(n_workers, len(chunks))) as pool:
+            for (start, stop), result in zip(chunks, pool.imap(_run_chunk, chunks)):
+                for name, value in result.items():
+                    out_arrays[name][start:stop] = value
+    finally:
+        _process_samples = None
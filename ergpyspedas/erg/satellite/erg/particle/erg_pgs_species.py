@@ -0,0 +1,100 @@
+from pyspedas import tnames
+
+from .erg_pgs_profile import erg_pgs_profile, PipelineProfile
+
+#  ;; flux variable (the last part of the tplot name) of each ion species
+_species_arrays = {
+    'lepi': {'proton': 'FPDU', 'hplus': 'FPDU', 'heplus': 'FHEDU', 'oplus': 'FODU'},
+    'mepi': {'proton': 'FPDU', 'hplus': 'FPDU', 'oplus': 'FOPDU'},
+}
+
+
+def erg_pgs_species_tvarnames(in_tvarname, species):
+    """
+    Returns the tplot variables of the 3dflux data of several ion species
+    of the instrument of in_tvarname
+
+    Input:
+        in_tvarname: str
+            tplot variable of one of the species, e.g.
+            erg_lepi_l2_3dflux_FPDU
+
+        species: list of str
+            'proton' (or 'hplus'), 'heplus' (LEP-i only) and/or 'oplus'
+
+    Returns:
+        List of (species, tplot variable) for the species whose data are
+        loaded, or None if in_tvarname isn't LEP-i or MEP-i 3dflux data
+    """
+
+    vn_info = in_tvarname.split('_')
+    instnm = vn_info[1] if len(vn_info) > 4 else None
+    if instnm not in _species_arrays:
+        print('species can be a list only for LEP-i and MEP-i 3dflux data')
+        return None
+
+    targets = []
+    for species_name in species:
+        arrnm = _species_arrays[instnm].get(species_name.lower())
+        if arrnm is None:
+            print(f'Species {species_name} not supported for {instnm}; '
+                  f'species supported: {" ".join(_species_arrays[instnm])}')
+            continue
+
+        tvarname = '_'.join(vn_info[0:4] + [arrnm] + vn_info[5:])
+        if len(tnames(tvarname)) < 1:
+            print(f'Variable: {tvarname} not found! skipping {species_name}')
+            continue
+        targets.append((species_name.lower(), tvarname))
+
+    return targets
+
+
+def erg_pgs_species_products(part_products, params):
+    """
+    Runs a part_products routine for each of several ion species
+
+    The flux arrays of the species differ, while the times, the magnetic
+    field, the FAC matrices and the angular geometry are the same; the
+    runs share the latter through the support data, FAC matrix, regrid
+    and operator caches, so that only the unit conversion and the
+    reductions are repeated per species.
+
+    Input:
+        part_products: function
+            erg_lep_part_products or erg_mep_part_products
+
+        params: dict
+            Keyword arguments of the call, including in_tvarname and the
+            list of species
+
+    Returns:
+        List of the tplot variables created for all the species, or (list,
+        dict) with the profile report of all the runs if profile is set;
+        the plan of the first species if plan_only is set
+    """
+
+    targets = erg_pgs_species_tvarnames(params['in_tvarname'], params['species'])
+    if not targets:
+        return 0
+
+    #  ;; one profile records the stages of all the species
+    prof = erg_pgs_profile(params['profile'])
+    profiled = isinstance(prof, PipelineProfile)
+
+    kwargs = dict(params)
+    kwargs['profile'] = prof if profiled else None
+
+    out_vars = []
+    for species_name, tvarname in targets:
+        kwargs['in_tvarname'] = tvarname
+        kwargs['species'] = species_name
+        result = part_products(**kwargs)
+        if params['plan_only']:
+            return result
+        if profiled and isinstance(result, tuple):
+            result = result[0]
+        if isinstance(result, list):
+            out_vars.extend(result)
+
+    return prof.finish(out_vars)
@@ -0,0 +1,131 @@
+import hashlib
+
+import numpy as np
+from pyspedas import get_data, tnames
+
+# support data interpolated to the particle times, keyed on the variable
+# name, the half-spin shift and the time grid; the digest of the variable
+# is kept to tell whether its data have been replaced or modified since
+_support_cache = {}
+_support_cache_size = 8
+
+
+def erg_pgs_tvar_digest(tvar):
+    """
+    Returns a hash of the times and values of a tplot variable, so that
+    cached results derived from it can be checked against its current
+    contents (including values modified in place)
+
+    Input:
+        tvar: str
+            tplot variable name
+
+    Returns:
+        str, or None if the variable doesn't exist
+    """
+
+    if (tvar is None) or (tvar not in tnames()):
+        return None
+
+    hasher = hashlib.sha1()
+    for value in get_data(tvar):
+        value = np.ascontiguousarray(value)
+        hasher.update(repr((value.dtype.str, value.shape)).encode())
+        hasher.update(value.view(np.uint8).reshape(-1))
+
+    return hasher.hexdigest()
+
+
+def erg_pgs_shift_times(times):
+    """
+    Returns the times shifted by half of the interval to the next sample,
+    the centers of the spins for MGF data time-labelled at the spin starts
+
+    The last interval is taken to be the same as the previous one.
+    """
+
+    dt_array = times[1:] - times[:-1]
+    dt_array = np.insert(dt_array, dt_array.shape[0], dt_array[-1])  # ;; Note that the last value might not be correct.
+    return times + dt_array / 2.
+
+
+def erg_pgs_interpol_support(tvar, times_array, shift=False):
+    """
+    Linearly interpolates a support data variable to the particle times,
+    as tinterpol does but without storing a new tplot variable
+
+    Input:
+        tvar: str
+            tplot variable name
+
+        times_array: numpy.ndarray
+            Times (s) to interpolate to
+
+    Parameters:
+        shift: bool
+            If True, the times of the variable are shifted by half of the
+            sample interval (erg_pgs_shift_times) before interpolating
+
+    Returns:
+        numpy.ndarray of the interpolated data, NaN outside the time range
+        of the variable
+    """
+
+    data_quant = get_data(tvar, xarray=True)
+    if shift:
+        times_sftd = erg_pgs_shift_times(get_data(tvar)[0])
+        data_quant = data_quant.assign_coords(time=np.array(times_sftd * 1e9, dtype='datetime64[ns]'))
+
+    times_ns = np.array(np.asarray(times_array, dtype=np.float64) * 1e9, dtype='datetime64[ns]')
+    return data_quant.interp({'time': times_ns}, method='linear', kwargs={}).values
+
+
+def erg_pgs_support_data(times_array, tvar, shift=False):
+    """
+    Returns a support data variable (magnetic field, position) interpolated
+    to the particle times
+
+    The result is cached for the variable, the shift and the time grid, so
+    that the FAC matrices and the moments of a run, and later runs on the
+    same times, share it.
+
+    Input:
+        times_array: numpy.ndarray
+            Times (s) of the particle data
+
+        tvar: str
+            tplot variable name
+
+    Parameters:
+        shift: bool
+            If True, the times of the variable are shifted by half of the
+            sample interval before interpolating, as done for the MGF
+            spin-averaged field with the MEP data
+
+    Returns:
+        Read-only numpy.ndarray of [time, 3], or None if the variable
+        doesn't exist
+    """
+
+    names = tnames(tvar) if tvar is not None else []
+    if len(names) < 1:
+        return None
+    tvar = names[0]
+
+    digest = erg_pgs_tvar_digest(tvar)
+    times_array = np.ascontiguousarray(times_array, dtype=np.float64)
+    key = (tvar, shift, times_array.tobytes())
+
+    cached = _support_cache.get(key)
+    if (cached is not None) and (cached[0] == digest):
+        return cached[1]
+
+    values = erg_pgs_interpol_support(tvar, times_array, shift=shift)
+    values.setflags(write=False)
+
+    _support_cache.pop(key, None)
+    if len(_support_cache) >= _support_cache_size:
+        del _support_cache[next(iter(_support_cache))]
+    _support_cache[key] = (digest, values)
+
+    return values
@@ -0,0 +1,25 @@
+import numpy as np
+
+
+def erg_pgs_time_broadcast(array, n_times):
+    """
+    Expands a time-invariant array across the time (last) dimension
+    without copying it
+
+    Input:
+        array: numpy.ndarray
+            Array whose last dimension has length 1, e.g.,
+            [energy, phi, theta, 1]
+
+        n_times: int
+            Number of time samples
+
+    Returns:
+        Read-only view shaped [..., n_times]. Every time sample shares the
+        memory of the input array; copy it with numpy.array() before
+        writing to it.
+    """
+
+    array = np.asarray(array)
+    return np.broadcast_to(array, array.shape[:-1] + (n_times,))
+
@@ -9,6 +9,8 @@ from pyspedas import time_string
 from pyspedas import get_data
 from scipy import interpolate
 
+from .erg_pgs_time_broadcast import erg_pgs_time_broadcast
+
 
 logging.captureWarnings(True)
 logging.basicConfig(format='%(asctime)s: %(message)s',
@@ -22,7 +24,8 @@ def erg_xep_get_dist(tname,
                       species='e',
                       time_only=False,
                       single_time=None,
-                      trange=None):
+                      trange=None,
+                      dtype='float64'):
 
     if len(tnames(tname)) > 0:
         input_name = tnames(tname)[0]
@@ -183,8 +186,7 @@ def erg_xep_get_dist(tname,
     energy_reform = np.reshape(e0_array, [dim_array[0], 1, 1])
     energy_rebin1 = np.repeat(energy_reform, dim_array[1],
                              axis=1)  # repeated across apd(elevation)
-    dist['energy'] =  np.repeat(energy_rebin1, n_times,
-                              axis=2)  # repeated across n_times
+    dist['energy'] = erg_pgs_time_broadcast(energy_rebin1, n_times)  # shared across n_times
 
     #  ;; Energy bin width
     e0bnd = np.sqrt(e0_array[:-1] * e0_array[1:])  # ;;[8]
@@ -201,8 +203,7 @@ def erg_xep_get_dist(tname,
     de_reform = np.reshape(de_array, [dim_array[0], 1, 1])
     de_rebin1 = np.repeat(de_reform, dim_array[1],
                          axis=1)  # repeated across spin phase(azimuth)
-    dist['denergy'] = np.repeat(de_rebin1, n_times,
-                         axis=2)  # repeated across n_times
+    dist['denergy'] = erg_pgs_time_broadcast(de_rebin1, n_times)  # shared across n_times
 
     dist['n_energy'] = dim_array[0]
 
@@ -230,8 +231,7 @@ def erg_xep_get_dist(tname,
                              axis=1)  # repeated across spin phase(azimuth)
     phi0_1_rebin2 = np.repeat(phi0_1_rebin1, dim_array[0],
                              axis=0)  # repeated across energy
-    phi0_1 = np.repeat(phi0_1_rebin2,     n_times,
-                              axis=2)  # repeated across n_times
+    phi0_1 = phi0_1_rebin2  # time-invariant, [.., 1]
     phi0_2_reform = np.reshape(spinph_ofst, [1, dim_array[1], n_times])
     phi0_2 = np.repeat(phi0_2_reform, dim_array[0],
                              axis=0)  # repeated across energy
@@ -242,8 +242,9 @@ def erg_xep_get_dist(tname,
     ;;    + offset angle for each spin phase
     """
     dist['phi'] = np.fmod((phi0 + 360.), 360.)
-    dist['dphi'] = np.full(shape=np.insert(dim_array, dim_array.shape[0],
-                                           n_times), fill_value=22.5)
+    dist['dphi'] = erg_pgs_time_broadcast(
+        np.full(shape=np.insert(dim_array, dim_array.shape[0], 1), fill_value=22.5),
+        n_times)
     #  ;; 22.5 deg as a constant
 
     del phi0  # ;; Clean huge arrays
@@ -257,12 +258,16 @@ def erg_xep_get_dist(tname,
                              axis=1)  # repeated across spin phase(azimuth)
     elev_rebin2 = np.repeat(elev_rebin1, dim_array[0],
                              axis=0)  # repeated across energy
-    dist['theta'] = np.repeat(elev_rebin2, n_times,
-                             axis=2)  # repeated across n_times
+    dist['theta'] = erg_pgs_time_broadcast(elev_rebin2, n_times)  # shared across n_times
 
-    dist['dtheta'] = np.full(shape=np.insert(dim_array, dim_array.shape[0],
-                                             n_times), fill_value=20.)  # ;; 20 deg (+/- 10 deg)  as a constant
+    dist['dtheta'] = erg_pgs_time_broadcast(
+        np.full(shape=np.insert(dim_array, dim_array.shape[0], 1), fill_value=20.),
+        n_times)  # ;; 20 deg (+/- 10 deg)  as a constant
 
     dist['n_theta'] = 1
 
+    #  ;; The flux values may be kept in single precision (dtype='float32')
+    #  ;; to halve the memory; the times, energies and angles stay double
+    dist['data'] = dist['data'].astype(dtype, copy=False)
+
     return dist
\ No newline at end of file
@@ -1,7 +1,5 @@
 import numpy as np
 
-from copy import deepcopy
-
 from pyspedas import tinterpol
 from pyspedas import time_double
 from pyspedas import time_string
@@ -12,17 +10,26 @@ from pyspedas.particles.spd_part_products.spd_pgs_regrid import spd_pgs_regrid
 from pyspedas import get_timespan, get_data, store_data
 
 from .erg_xep_get_dist import erg_xep_get_dist
+from .erg_pgs_dist_source import DistributionSource
 from .erg_pgs_clean_data import erg_pgs_clean_data
 from .erg_pgs_limit_range import erg_pgs_limit_range
 from .erg_convert_flux_units import erg_convert_flux_units
 from .erg_pgs_moments_tplot import erg_pgs_moments_tplot
-from .erg_pgs_make_fac import erg_pgs_make_fac
+from .erg_pgs_make_fac import erg_pgs_make_fac, erg_pgs_fac_att_names
 from .erg_pgs_make_e_spec import erg_pgs_make_e_spec
 from .erg_pgs_make_theta_spec import erg_pgs_make_theta_spec
+from .erg_pgs_make_pa_energy_spec import erg_pgs_make_pa_energy_spec, erg_pgs_make_pa_energy_tplot, erg_pgs_pa_energy_slices
 from .erg_pgs_make_phi_spec import erg_pgs_make_phi_spec
 from .erg_pgs_do_fac import erg_pgs_do_fac
 from .erg_pgs_progress_update import erg_pgs_progress_update
+from .erg_pgs_run_parallel import erg_pgs_run_parallel
 from .erg_pgs_make_tplot import erg_pgs_make_tplot
+from .erg_pgs_plan import erg_pgs_plan
+from .erg_pgs_result_cache import erg_pgs_cache_key, erg_pgs_cache_load, erg_pgs_cache_save
+from .erg_pgs_append import erg_pgs_output_names, erg_pgs_append_prepare, erg_pgs_append_merge
+from .erg_pgs_profile import erg_pgs_profile
+from .erg_pgs_limit_sets import erg_pgs_limit_sets_check, erg_pgs_limit_set_arrays, erg_pgs_limit_sets_apply, \
+    erg_pgs_limit_set_moments
 
 def erg_xep_part_products(
     in_tvarname,
@@ -43,8 +50,16 @@ def erg_xep_part_products(
     mag_name=None,
     pos_name=None,
     relativistic=False,
-    no_regrid=False
+    no_regrid=False,
+    n_workers=1,
+    plan_only=False,
+    cache=False,
+    append=False,
+    profile=None,
+    dtype='float64',
+    limit_sets=None
     ):
+    cache_params = dict(locals())
 
     if len(tnames(in_tvarname)) < 1:
         print('No input data, please specify tplot variable!')
@@ -86,6 +101,10 @@ def erg_xep_part_products(
     if gyro[0] == gyro[1]:
         gyro = [0., 360.]
 
+    limit_sets = erg_pgs_limit_sets_check(limit_sets)
+    if limit_sets is None:
+        return 0
+
 
     """
     ;;Create energy spectrogram after FAC transformation if limits are not 
@@ -102,6 +121,15 @@ def erg_xep_part_products(
             idx = idx[0]
             outputs_lc[idx] = 'fac_moments'
 
+    #  ;;Work out which stages the requested outputs need
+    plan = erg_pgs_plan([output for output in outputs_lc if output in ['energy', 'phi', 'pa', 'pa_energy', 'fac_energy']],
+                        regrid=not no_regrid)
+    if plan_only:
+        return plan
+
+    prof = erg_pgs_profile(profile)
+    prof.start()
+
     #  ;;Preserve the original time range
     tr_org = get_timespan(in_tvarname)
 
@@ -109,7 +137,7 @@ def erg_xep_part_products(
         times_array = erg_xep_get_dist(in_tvarname, species=species, units=units_lc, time_only=True)
     else:
         print(f'ERROR: Cannot find "xep" in the given tplot variable name: {in_tvarname}')
-        return 0
+        return prof.finish(0)
 
     if trange is not None:
         
@@ -124,24 +152,56 @@ def erg_xep_part_products(
         time_indices = np.arange(times_array.shape[0])
 
     times_array = times_array[time_indices]
+    prof.lap('times')
+
+    #  ;;Only process the samples not in the existing output variables yet
+    if append:
+        append_done, append_previous = erg_pgs_append_prepare(erg_pgs_output_names(in_tvarname, plan['outputs'], suffix=suffix,
+                                                                                     limit_sets=limit_sets))
+        new_samples = ~np.isin(times_array, append_done)
+        time_indices = time_indices[new_samples]
+        times_array = times_array[new_samples]
+        if time_indices.shape[0] < 1:
+            print(f'No new {in_tvarname} data to append')
+            return prof.finish(list(append_previous.keys()))
+
+    #  ;;Restore the products of an identical earlier run if cached
+    if cache and not append:
+        cache_tvarnames = [in_tvarname, mag_name, pos_name]
+        if 'fac_matrix' in plan['support']:
+            cache_tvarnames.extend(erg_pgs_fac_att_names(fac_type))
+        cache_key = erg_pgs_cache_key('erg_xep_part_products', cache_tvarnames,
+                                      time_indices, cache_params)
+        cached_vars = erg_pgs_cache_load(cache_key)
+        if cached_vars is not None:
+            return prof.finish(cached_vars)
 
 
 
     if instnm == 'xep':
-        dist = erg_xep_get_dist(in_tvarname, 0, species=species, units=units_lc)
+        #  ;; The data are parsed once per block of samples and handed out as views
+        dist_source = DistributionSource(erg_xep_get_dist, in_tvarname, time_indices, chunk_size=256,
+                                         species=species, units=units_lc, dtype=dtype)
+        dist = dist_source.get(0)
+    prof.lap('get_dist')
 
     if 'energy' in outputs_lc:
-        out_energy = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_energy = np.zeros((times_array.shape[0], dist['n_energy']), dtype=dtype)
         out_energy_y = np.zeros((times_array.shape[0], dist['n_energy']))
     if 'phi' in outputs_lc:
-        out_phi = np.zeros((times_array.shape[0], dist['n_phi']))
+        out_phi = np.zeros((times_array.shape[0], dist['n_phi']), dtype=dtype)
         out_phi_y = np.zeros((times_array.shape[0], dist['n_phi']))
     if 'pa' in outputs_lc:
-        out_pad = np.zeros((times_array.shape[0], regrid[1]))
+        out_pad = np.zeros((times_array.shape[0], regrid[1]), dtype=dtype)
         out_pad_y = np.zeros((times_array.shape[0], regrid[1]))
 
+    if 'pa_energy' in outputs_lc:
+        out_pa_energy = np.zeros((times_array.shape[0], dist['n_energy'], regrid[1]), dtype=dtype)
+        out_pa_energy_v1 = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_pa_energy_v2 = np.zeros((times_array.shape[0], regrid[1]))
+
     if 'fac_energy' in outputs_lc:
-        out_fac_energy = np.zeros((times_array.shape[0], dist['n_energy']))
+        out_fac_energy = np.zeros((times_array.shape[0], dist['n_energy']), dtype=dtype)
         out_fac_energy_y = np.zeros((times_array.shape[0], dist['n_energy']))
 
     out_vars = []
@@ -154,8 +214,7 @@ def erg_xep_part_products(
     """
     # ;;create rotation matrix to B-field aligned coordinates if needed
     
-    fac_outputs = ['pa', 'fac_energy']
-    fac_requested = len(set(outputs_lc).intersection(fac_outputs)) > 0
+    fac_requested = 'fac_matrix' in plan['support']
     if fac_requested:
 
         fac_matrix = erg_pgs_make_fac(times_array, mag_name, pos_name, fac_type=fac_type)
@@ -167,70 +226,106 @@ def erg_xep_part_products(
     magf = np.array([0., 0., 0.])
     no_mag_for_moments = False
 
+    prof.lap('support')
+
+    #  ;; Output arrays filled sample by sample, gathered for the parallel run
+    out_arrays = {name: value for name, value in locals().items()
+                  if name.startswith('out_') and isinstance(value, np.ndarray)}
+
+    #  ;; The limit sets make their fac_energy/fac_moments from the same FAC data
+    if not fac_requested:
+        limit_sets = []
+    limit_set_arrays = erg_pgs_limit_set_arrays(limit_sets, plan['outputs'], times_array.shape[0], dist['n_energy'], dtype=dtype)
+    out_arrays.update(limit_set_arrays)
+
     """
     ;;-------------------------------------------------
     ;; Loop over time to build spectrograms and/or moments
     ;;-------------------------------------------------
     """
-    for index in range(time_indices.shape[0]):
+    def process_samples(start, stop):
+        nonlocal last_update_time
 
-        last_update_time = erg_pgs_progress_update(last_update_time=last_update_time,
-             current_sample=index, total_samples=time_indices.shape[0], type_string=in_tvarname)
+        for index in range(start, stop):
 
-        #  ;; Get the data structure for this sample
+            last_update_time = erg_pgs_progress_update(last_update_time=last_update_time,
+                 current_sample=index, total_samples=time_indices.shape[0], type_string=in_tvarname)
+            prof.mark()
 
-        if instnm == 'xep':
-            dist = erg_xep_get_dist(in_tvarname, time_indices[index], species=species, units=units_lc)
-        else:
-            print(f'ERROR: Cannot find "xep" in the given tplot variable name: {in_tvarname}')
-            return 0
-        if magf.ndim == 2:
-            magvec = magf[index]
-        elif magf.ndim == 1:
-            magvec = magf
+            #  ;; Get the data structure for this sample (instnm was checked
+            #  ;; to be 'xep' before the loop)
+            dist = dist_source.get(index)
+            prof.lap('get_dist')
 
-        clean_data = erg_pgs_clean_data(dist, units=units_lc,relativistic=relativistic, magf=magvec)
+            if magf.ndim == 2:
+                magvec = magf[index]
+            elif magf.ndim == 1:
+                magvec = magf
 
-        if fac_requested:
-            pre_limit_bins = deepcopy(clean_data['bins'])
+            clean_data = erg_pgs_clean_data(dist, units=units_lc,relativistic=relativistic, magf=magvec)
+            prof.lap('clean')
 
-        clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
+            clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
+            prof.lap('limit')
 
-        #  ;;Build energy spectrogram
-        if 'energy' in outputs_lc:
-            out_energy_y[index, :], out_energy[index, :] = erg_pgs_make_e_spec(clean_data)
+            #  ;;Build energy spectrogram
+            if 'energy' in outputs_lc:
+                out_energy_y[index, :], out_energy[index, :] = erg_pgs_make_e_spec(clean_data)
+                prof.lap('energy')
 
-        #  ;;Build phi spectrogram
-        if 'phi' in outputs_lc:
-            out_phi_y[index, :], out_phi[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=dist['n_phi'],no_ang_weighting=no_ang_weighting)
+            #  ;;Build phi spectrogram
+            if 'phi' in outputs_lc:
+                out_phi_y[index, :], out_phi[index, :] = erg_pgs_make_phi_spec(clean_data, resolution=dist['n_phi'],no_ang_weighting=no_ang_weighting)
+                prof.lap('phi')
 
-        #  ;;Perform transformation to FAC, (regrid data), and apply limits in new coords
-        
-        if fac_requested:
-            
-            # ;limits will be applied to energy-aligned bins
-            clean_data['bins'] = deepcopy(pre_limit_bins)
-            clean_data = erg_pgs_limit_range(clean_data, phi=phi_in, theta=theta, energy=energy, no_ang_weighting=no_ang_weighting)
+            #  ;;Perform transformation to FAC, (regrid data), and apply limits in new coords
+
+            if fac_requested:
+
+                # ;limits were already applied to the energy-aligned bins above
 
-            # ;perform FAC transformation and interpolate onto a new, regular grid 
-            clean_data = erg_pgs_do_fac(clean_data, fac_matrix[index, :, :])
+                # ;perform FAC transformation and interpolate onto a new, regular grid 
+                clean_data = erg_pgs_do_fac(clean_data, fac_matrix[index, :, :])
+                prof.lap('fac')
 
-            #;nearest neighbor interpolation to regular grid in FAC
-            if not no_regrid:
-                if (not np.all(np.isnan(clean_data['theta']))) and (not np.all(np.isnan(clean_data['phi']))):
-                    clean_data = spd_pgs_regrid(clean_data, regrid)
+                #;nearest neighbor interpolation to regular grid in FAC
+                if not no_regrid:
+                    if (not np.all(np.isnan(clean_data['theta']))) and (not np.all(np.isnan(clean_data['phi']))):
+                        clean_data = spd_pgs_regrid(clean_data, regrid)
+                        prof.lap('regrid')
 
-            clean_data['theta'] = 90.0-clean_data['theta']  #  ;pitch angle is specified in co-latitude
+                clean_data['theta'] = 90.0-clean_data['theta']  #  ;pitch angle is specified in co-latitude
 
-            # ;apply gyro & pitch angle limits(identical to phi & theta, just in new coords)
-            clean_data = erg_pgs_limit_range(clean_data, theta=pitch, phi=gyro, no_ang_weighting=no_ang_weighting)
+                if limit_sets:
+                    # ;each limit set masks the FAC data before the pitch & gyro limits below
+                    erg_pgs_limit_sets_apply(limit_sets, limit_set_arrays, clean_data, index, plan['outputs'], no_ang_weighting=no_ang_weighting,
+                                             dist=dist, magf=magvec, units=units_lc, eflux_data=clean_data_eflux if plan['share_eflux'] else None)
+                    prof.lap('limit_sets')
 
-            if 'pa' in outputs_lc:
-                # ;Build pitch angle spectrogram
-                out_pad_y[index, :], out_pad[index, :] = erg_pgs_make_theta_spec(clean_data, colatitude=True, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                # ;apply gyro & pitch angle limits(identical to phi & theta, just in new coords)
+                clean_data = erg_pgs_limit_range(clean_data, theta=pitch, phi=gyro, no_ang_weighting=no_ang_weighting)
+                prof.lap('fac_limit')
+
+                if 'pa' in outputs_lc:
+                    # ;Build pitch angle spectrogram
+                    out_pad_y[index, :], out_pad[index, :] = erg_pgs_make_theta_spec(clean_data, colatitude=True, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                    prof.lap('pa')
+
+                if 'pa_energy' in outputs_lc:
+                    # ;Bin the pitch angles of every energy channel at once
+                    out_pa_energy_v1[index, :], out_pa_energy_v2[index, :], out_pa_energy[index, :, :] = \
+                        erg_pgs_make_pa_energy_spec(clean_data, resolution=regrid[1], no_ang_weighting=no_ang_weighting)
+                    prof.lap('pa_energy')
+
+                if 'fac_energy' in outputs_lc:
+                    out_fac_energy_y[index, :], out_fac_energy[index, :] = erg_pgs_make_e_spec(clean_data)
+                    prof.lap('fac_energy')
+
+        return {name: value[start:stop] for name, value in out_arrays.items()}
+
+    erg_pgs_run_parallel(process_samples, out_arrays, time_indices.shape[0], n_workers=n_workers)
+    prof.mark()
 
-            if 'fac_energy' in outputs_lc:
-                out_fac_energy_y[index, :], out_fac_energy[index, :] = erg_pgs_make_e_spec(clean_data)
 
 
     if 'energy' in outputs_lc:
@@ -248,6 +343,12 @@ def erg_xep_part_products(
         erg_pgs_make_tplot(output_tplot_name, x=times_array, y=out_pad_y, z=out_pad, units=units, ylog=False, ytitle=dist['data_name'] + ' \\ PA (deg)',relativistic=relativistic)
         out_vars.append(output_tplot_name)
 
+    #  ;;Pitch angle x energy distributions and their per-energy slices
+    if 'pa_energy' in outputs_lc:
+        output_tplot_name = in_tvarname+'_pa_energy' + suffix
+        out_vars.extend(erg_pgs_make_pa_energy_tplot(output_tplot_name, x=times_array, energy=out_pa_energy_v1, pitch=out_pa_energy_v2, z=out_pa_energy,
+                                                     slice_prefix=in_tvarname+'_paspec_ene', units=units, data_name=dist['data_name'], relativistic=relativistic, suffix=suffix))
+
 
     if 'fac_energy' in outputs_lc:
 
@@ -255,4 +356,29 @@ def erg_xep_part_products(
         erg_pgs_make_tplot(output_tplot_name, x=times_array, y=out_fac_energy_y, z=out_fac_energy, units=units, ylog=True, ytitle=dist['data_name'] + ' \\ energy (eV)',relativistic=relativistic)
         out_vars.append(output_tplot_name)
 
-    return out_vars
+    #  ;;fac_energy/fac_moments of the limit sets, suffixed with '_mag_' and the set names
+    for limit_set in limit_sets:
+        set_name = limit_set['name']
+        set_suffix = '_mag_' + set_name + suffix
+        if 'fac_energy' in plan['outputs']:
+            output_tplot_name = in_tvarname + '_energy' + set_suffix
+            erg_pgs_make_tplot(output_tplot_name, x=times_array, y=limit_set_arrays[set_name, 'fac_energy_y'], z=limit_set_arrays[set_name, 'fac_energy'], units=units, ylog=True, ytitle=dist['data_name'] + ' \\ energy (eV)',relativistic=relativistic)
+            out_vars.append(output_tplot_name)
+        if 'fac_moments' in plan['outputs']:
+            set_moments_vars = erg_pgs_moments_tplot(erg_pgs_limit_set_moments(limit_set_arrays, set_name), x=times_array, prefix=in_tvarname, suffix=set_suffix)
+            out_vars.extend(set_moments_vars)
+
+    prof.lap('tplot')
+
+    if append:
+        erg_pgs_append_merge(append_previous)
+        if 'pa_energy' in outputs_lc:
+            #  ;; the slices are remade from the merged 3D variable
+            erg_pgs_pa_energy_slices(in_tvarname+'_pa_energy' + suffix, in_tvarname+'_paspec_ene', units=units, data_name=dist['data_name'], relativistic=relativistic, suffix=suffix)
+        prof.lap('append')
+
+    if cache and not append:
+        erg_pgs_cache_save(cache_key, out_vars)
+        prof.lap('cache')
+
+    return prof.finish(out_vars)
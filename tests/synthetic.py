@@ -0,0 +1,128 @@
+"""
+Synthetic tplot variables for the tests and the benchmarks of the particle
+routines, shaped like the Level-2 data of MEP-e ([time, 32, 16, 16]), MEP-i
+([time, 16, 16, 16]), LEP-i ([time, 30, 8, 16]), HEP-L (sctno and
+FEDU_L_Angle_sga variables, one sample per spin sector) and XEP-SSD, with
+MGF magnetic field and orbit position support data
+"""
+
+import os
+
+import numpy as np
+from cdflib.cdfwrite import CDF
+from pyspedas import store_data, get_data, time_double
+
+T0 = time_double('2017-04-01/00:00:00')
+
+MAG_NAME = 'erg_mgf_l2_mag_8sec_dsi'
+POS_NAME = 'erg_orb_l2_pos_gse'
+
+
+def flux(rng, shape, nan_fraction=0.02):
+    """
+    Returns log-normal synthetic fluxes with a fraction of NaN (missing) bins
+    """
+
+    data = rng.lognormal(3., 1.5, size=shape)
+    data[rng.random(shape) < nan_fraction] = np.nan
+    return data
+
+
+def write_cdf(file_name, variables):
+    """
+    Writes non record-varying double variables to a CDF file
+    """
+
+    if os.path.exists(file_name):
+        os.remove(file_name)
+    cdf_file = CDF(file_name, cdf_spec={'Compressed': False})
+    for var_name, value in variables.items():
+        value = np.asarray(value, dtype='float64')
+        cdf_file.write_var({'Variable': var_name, 'Data_Type': 45, 'Num_Elements': 1,
+                            'Rec_Vary': False, 'Dim_Sizes': list(value.shape)},
+                           var_attrs={}, var_data=value)
+    cdf_file.close()
+
+
+def make_mepe(rng, n_times):
+    name = 'erg_mepe_l2_3dflux_FEDU'
+    times = T0 + 8. * np.arange(n_times)
+    store_data(name, data={'x': times, 'y': flux(rng, (n_times, 32, 16, 16)),
+                           'v1': np.arange(32.),
+                           'v2': np.geomspace(90., 6., 16),
+                           'v3': np.arange(16.)})
+    return name
+
+
+def make_mepi(rng, n_times):
+    name = 'erg_mepi_l2_3dflux_FPDU'
+    times = T0 + 8. * np.arange(n_times)
+    store_data(name, data={'x': times, 'y': flux(rng, (n_times, 16, 16, 16)),
+                           'v1': np.arange(16.),
+                           'v2': np.geomspace(180., 10., 16),
+                           'v3': np.arange(16.)})
+    return name
+
+
+def make_lepi(rng, n_times):
+    name = 'erg_lepi_l2_3dflux_FPDU'
+    times = T0 + 8. * np.arange(n_times)
+    store_data(name, data={'x': times, 'y': flux(rng, (n_times, 30, 8, 16)),
+                           'v1': np.geomspace(25., 0.01, 30),
+                           'v2': np.arange(8.),
+                           'v3': np.arange(16.)})
+    return name
+
+
+def make_hep(rng, n_spins, cdf_dir):
+    """
+    Stores n_spins spins of HEP-L data; the CDF file get_dist reads the
+    energy table from is written to cdf_dir
+    """
+
+    name = 'erg_hep_l2_FEDU_L'
+    n_energy = 16
+    n_times = 16 * n_spins
+    times = T0 + 0.5 * np.arange(n_times)
+
+    angle_sga = np.zeros((n_times, 2, 15))
+    angle_sga[:, 0, :] = np.linspace(-70., 70., 15)
+    angle_sga[:, 1, :] = 90. + np.linspace(-5., 5., 15)
+
+    store_data(name, data={'x': times, 'y': flux(rng, (n_times, n_energy, 15)),
+                           'v1': np.arange(float(n_energy)), 'v2': np.arange(15.)})
+    store_data(name + '_Angle_sga', data={'x': times, 'y': angle_sga})
+    store_data('erg_hep_l2_sctno_L', data={'x': times, 'y': np.tile(np.arange(16), n_spins)})
+
+    #  ;; get_dist reads the energy table from the CDF file of the data
+    energy = np.geomspace(30., 1800., n_energy + 1)
+    cdf_name = os.path.join(cdf_dir, 'erg_hep_l2_omniflux_synthetic.cdf')
+    write_cdf(cdf_name, {'FEDU_L_Energy': np.array([energy[:-1], energy[1:]])})
+    get_data(name, metadata=True)['CDF'] = {'FILENAME': cdf_name}
+    return name
+
+
+def make_xep(rng, n_times):
+    name = 'erg_xep_l2_FEDU_SSD'
+    times = T0 + 8. * np.arange(n_times)
+    store_data(name, data={'x': times, 'y': flux(rng, (n_times, 9, 16)),
+                           'v1': np.geomspace(400., 6000., 9), 'v2': np.arange(16.)})
+    return name
+
+
+def make_support(n_times):
+    """
+    Stores the magnetic field (DSI) and position (GSE) variables, covering
+    n_times samples of 8 s, the cadence of the synthetic data (and of the
+    HEP spins)
+    """
+
+    times = T0 - 16. + 8. * np.arange(n_times + 4)
+    mag = np.stack([100. * np.cos(times / 500.),
+                    100. * np.sin(times / 700.),
+                    200. + 10. * np.sin(times / 300.)], axis=1)
+    pos = np.stack([30000. * np.cos(times / 20000.),
+                    30000. * np.sin(times / 20000.),
+                    np.full(times.shape, 3000.)], axis=1)
+    store_data(MAG_NAME, data={'x': times, 'y': mag})
+    store_data(POS_NAME, data={'x': times, 'y': pos})
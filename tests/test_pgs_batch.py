@@ -0,0 +1,52 @@
+"""
+Batch (block) mode of erg_mep_part_products against the per-sample loop
+
+The batch kernels reduce over the same bins as the loop but sum them in a
+different order (whole-block array reductions instead of per-sample ones),
+so the results agree to rounding only, not bit for bit: the differences
+seen are up to about 3e-13 of the largest magnitude of an output, and
+they are required to be within RTOL of it.
+"""
+
+import logging
+
+import numpy as np
+import pytest
+from pyspedas import get_data
+
+from ergpyspedas.erg import erg_mep_part_products
+
+import synthetic
+
+RTOL = 1e-10
+
+OUTPUTS = ['energy', 'theta', 'phi', 'pa', 'gyro', 'moments', 'fac_energy', 'fac_moments', 'pa_energy']
+
+
+def run(name, suffix, **kwargs):
+    out_vars = erg_mep_part_products(name, outputs=OUTPUTS, mag_name=synthetic.MAG_NAME,
+                                     pos_name=synthetic.POS_NAME, fac_type='xdsi', suffix=suffix, **kwargs)
+    return {out_var[:len(out_var) - len(suffix)]: get_data(out_var) for out_var in out_vars}
+
+
+@pytest.mark.parametrize('make_data', [synthetic.make_mepe, synthetic.make_mepi])
+@pytest.mark.parametrize('no_ang_weighting', [True, False])
+@pytest.mark.parametrize('chunk_size', [5, None])
+def test_batch_matches_loop(make_data, no_ang_weighting, chunk_size):
+    logging.disable(logging.WARNING)
+    n_times = 12
+    synthetic.make_support(n_times)
+    name = make_data(np.random.default_rng(0), n_times)
+
+    loop = run(name, '_loop', no_ang_weighting=no_ang_weighting)
+    batch = run(name, '_batch', no_ang_weighting=no_ang_weighting, batch=True, chunk_size=chunk_size)
+
+    assert sorted(loop) == sorted(batch)
+    for out_var, loop_values in loop.items():
+        for loop_value, batch_value in zip(loop_values[1:], batch[out_var][1:]):
+            loop_value = np.asarray(loop_value, dtype=np.float64)
+            batch_value = np.asarray(batch_value, dtype=np.float64)
+            assert np.array_equal(np.isnan(loop_value), np.isnan(batch_value)), out_var
+            scale = np.nanmax(np.abs(loop_value), initial=0.)
+            np.testing.assert_allclose(batch_value, loop_value, rtol=0., atol=RTOL*scale, equal_nan=True,
+                                       err_msg=out_var)
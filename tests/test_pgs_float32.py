@@ -0,0 +1,61 @@
+"""
+float32 mode (dtype='float32') of the part_products routines against the
+default float64 mode
+
+The spectrogram values are computed in float32 and agree with the float64
+ones to a relative difference of SPECTRA_RTOL per element (about 2.5
+float32 epsilons; up to 2.1e-7 is seen). The moments are accumulated in
+float64 from the float32 fluxes and each component agrees to MOMENTS_RTOL
+of the largest magnitude of its variable. These are the tolerances stated
+for the dtype keyword of erg_mep_part_products.
+"""
+
+import logging
+
+import numpy as np
+import pytest
+from pyspedas import get_data
+
+from ergpyspedas.erg import erg_mep_part_products
+
+import synthetic
+
+SPECTRA_RTOL = 3e-7
+MOMENTS_RTOL = 2e-7
+
+SPECTRA = ['energy', 'theta', 'phi', 'pa', 'gyro', 'fac_energy', 'pa_energy']
+MOMENTS = ['moments', 'fac_moments']
+
+
+def run(name, outputs, dtype, **kwargs):
+    suffix = '_' + dtype
+    out_vars = erg_mep_part_products(name, outputs=outputs, mag_name=synthetic.MAG_NAME,
+                                     pos_name=synthetic.POS_NAME, fac_type='xdsi', suffix=suffix,
+                                     dtype=dtype, **kwargs)
+    return {out_var[:len(out_var) - len(suffix)]: get_data(out_var)[1] for out_var in out_vars}
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_float32_tolerance(batch):
+    logging.disable(logging.WARNING)
+    n_times = 8
+    synthetic.make_support(n_times)
+    name = synthetic.make_mepe(np.random.default_rng(0), n_times)
+
+    for outputs in [SPECTRA, MOMENTS]:
+        single = run(name, outputs, 'float32', batch=batch)
+        double = run(name, outputs, 'float64', batch=batch)
+        assert sorted(single) == sorted(double)
+
+        for out_var, expected in double.items():
+            value = single[out_var]
+            assert np.array_equal(np.isfinite(value), np.isfinite(expected)), out_var
+            finite = np.isfinite(expected)
+            if outputs is SPECTRA:
+                assert value.dtype == np.float32, out_var
+                difference = np.abs(value[finite] - expected[finite])
+                assert np.all(difference <= SPECTRA_RTOL*np.abs(expected[finite])), out_var
+            else:
+                scale = np.max(np.abs(expected[finite]), initial=0.)
+                np.testing.assert_allclose(value, expected, rtol=0., atol=MOMENTS_RTOL*scale, equal_nan=True,
+                                           err_msg=out_var)
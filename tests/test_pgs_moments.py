@@ -0,0 +1,70 @@
+"""
+Vectorized moments kernel (erg_pgs_moments) against spd_pgs_moments
+
+The kernel integrates over the energy and angle dimensions with array
+reductions, in a different order than moments_3d, so the moments agree to
+rounding: within RTOL of the largest magnitude of each moment.
+"""
+
+import numpy as np
+import pytest
+from pyspedas.particles.moments.spd_pgs_moments import spd_pgs_moments
+
+from ergpyspedas.erg.satellite.erg.particle.erg_pgs_moments import erg_pgs_moments, erg_pgs_moments_input
+
+RTOL = 1e-10
+
+MOMENTS = ['density', 'flux', 'mftens', 'velocity', 'ptens', 'ttens', 'vthermal', 'avgtemp', 'magt3']
+
+
+def make_block(rng, n_times=6, n_energy=12, n_theta=8, n_phi=16):
+    """
+    Returns a batched particle data structure in eflux, [time, energy,
+    angle], with two bin geometries, a few inactive bins and time-varying
+    magnetic field vectors
+    """
+
+    n_angle = n_theta*n_phi
+    theta, phi = np.meshgrid(np.linspace(-78.75, 78.75, n_theta), np.arange(n_phi)*22.5 + 11.25, indexing='ij')
+    theta = np.broadcast_to(theta.ravel(), (n_times, n_energy, n_angle)).copy()
+    phi = np.broadcast_to(phi.ravel(), (n_times, n_energy, n_angle)).copy()
+    #  ;; the second half of the samples are rotated in phi
+    phi[n_times//2:] = np.mod(phi[n_times//2:] + 5., 360.)
+
+    energy = np.broadcast_to(np.geomspace(20., 20000., n_energy)[:, np.newaxis], (n_times, n_energy, n_angle))
+    denergy = energy*0.3
+
+    bins = (rng.random((n_times, n_energy, n_angle)) > 0.05).astype(np.int8)
+
+    return {'data': rng.lognormal(10., 1., size=(n_times, n_energy, n_angle)),
+            'bins': bins,
+            'energy': energy.copy(),
+            'denergy': denergy.copy(),
+            'theta': theta,
+            'phi': phi,
+            'dtheta': np.full(theta.shape, 22.5),
+            'dphi': np.full(theta.shape, 22.5),
+            'charge': -1.,
+            'mass': 5.6856591e-06,
+            'magf': rng.normal(size=(n_times, 3))*100.,
+            'sc_pot': 0.,
+            'units_name': 'eflux'}
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_moments_match_spd_pgs_moments(seed):
+    block = make_block(np.random.default_rng(seed))
+    moments = erg_pgs_moments(block)
+
+    n_times = block['data'].shape[0]
+    for index in range(n_times):
+        sample = dict(block)
+        for key in ['data', 'bins', 'energy', 'denergy', 'theta', 'phi', 'dtheta', 'dphi', 'magf']:
+            sample[key] = block[key][index]
+        expected = spd_pgs_moments(erg_pgs_moments_input(sample))
+
+        for key in MOMENTS:
+            value = np.asarray(expected[key], dtype=np.float64)
+            scale = np.max(np.abs(value), initial=0.)
+            np.testing.assert_allclose(moments[key][index], value, rtol=0., atol=RTOL*scale,
+                                       err_msg=f'{key} of sample {index}')
@@ -0,0 +1,22 @@
+"""
+Keys of the disk cache of the part_products routines
+"""
+
+import numpy as np
+
+from ergpyspedas.erg.satellite.erg.particle import erg_pgs_result_cache
+
+import synthetic
+
+
+def test_key_changes_with_code_version(monkeypatch):
+    synthetic.make_support(4)
+    args = ('erg_mep_part_products', [synthetic.MAG_NAME], np.arange(4), {'outputs': ['energy']})
+    key = erg_pgs_result_cache.erg_pgs_cache_key(*args)
+
+    monkeypatch.setattr(erg_pgs_result_cache, '_cache_format', erg_pgs_result_cache._cache_format + 1)
+    assert erg_pgs_result_cache.erg_pgs_cache_key(*args) != key
+    monkeypatch.undo()
+
+    monkeypatch.setattr(erg_pgs_result_cache, '_package_version', lambda name: name + '-0.0')
+    assert erg_pgs_result_cache.erg_pgs_cache_key(*args) != key
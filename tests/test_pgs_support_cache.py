@@ -0,0 +1,35 @@
+"""
+The support data and FAC matrix caches of erg_mep_part_products against
+magnetic field values modified in place between runs
+"""
+
+import logging
+
+import numpy as np
+from pyspedas import get_data
+
+from ergpyspedas.erg import erg_mep_part_products
+
+import synthetic
+
+
+def run(name):
+    erg_mep_part_products(name, outputs=['pa', 'gyro'], mag_name=synthetic.MAG_NAME,
+                          pos_name=synthetic.POS_NAME, fac_type='xdsi')
+    return {out_var: np.array(get_data(out_var)[1]) for out_var in [name + '_pa', name + '_gyro']}
+
+
+def test_modified_field_is_reread():
+    logging.disable(logging.WARNING)
+    n_times = 6
+    synthetic.make_support(n_times)
+    name = synthetic.make_mepe(np.random.default_rng(0), n_times)
+
+    first = run(name)
+
+    mag = get_data(synthetic.MAG_NAME, xarray=True)
+    mag.values[...] = mag.values[:, ::-1] * np.array([1., -2., 0.5])
+    second = run(name)
+
+    for out_var in first:
+        assert not np.allclose(first[out_var], second[out_var], equal_nan=True), out_var